@@ -1,44 +1,174 @@
 #!/usr/bin/env python
 from __future__ import absolute_import, print_function
 from .assemble import record_assemblies
-from getopt import getopt, GetoptError
-from json import dump as json_dump
+from .input import open_input
+from .loader import DEFAULT_MAX_ALIAS_EXPANSION, get_loader
 from logging import basicConfig, getLogger
 from os.path import basename
 import sys
 from sys import argv, exit as sys_exit
 from .transclude import transclude_template
-from yaml import serialize_all as yaml_serialize_all
-from yaml.constructor import SafeConstructor
-from yaml.dumper import SafeDumper
 from yaml.error import YAMLError
 
 # NOTE: We print to sys.stderr and do NOT do a "from sys import stderr" and
 # print to the imported stderr so we can do unit testing on error messages.
 
+# NOTE: Modules only needed on some paths (JSON output, the emitter, option
+# parsing) are imported where they are used to keep startup time down; this
+# matters for Lambda cold starts. See tests/test_imports.py.
+
 log = getLogger("assemyaml")
 
 
-def run(template_fd, resource_fds, output_fd, local_tags, format="yaml"):
-    assemblies = {}
-    for fd in resource_fds:
+def run(template_fd, resource_fds, output_fd, local_tags, format="yaml",
+        stats=None, trace=None, memo=None, splice=False, assemblies=None,
+        max_alias_expansion=DEFAULT_MAX_ALIAS_EXPANSION,
+        anchor_duplicates=None, jobs=None, streaming=False):
+    """
+    run(template_fd, resource_fds, output_fd, local_tags, format="yaml",
+        stats=None, trace=None, memo=None, splice=False, assemblies=None,
+        max_alias_expansion=DEFAULT_MAX_ALIAS_EXPANSION,
+        anchor_duplicates=None, jobs=None, streaming=False) -> int
+
+    Assemble the resource documents, transclude them into the template, and
+    write the result to output_fd. Returns 0 on success or 1 if an error was
+    logged. resource_fds may be any iterable, including one that opens the
+    inputs as they are needed.
+
+    If stats (an assemyaml.stats.Stats object) is specified, timings and
+    counters for the run are recorded in it. If trace (an
+    assemyaml.trace.Trace object) is specified, assembly and transclusion
+    decisions are recorded in it. If memo (an assemyaml.memo.TranscludeMemo
+    object) is specified, merged transclusion values are reused from it; it
+    may be shared between runs.
+
+    If splice is true and format is "yaml", the parts of the template that
+    were not changed are copied from its source text (see
+    assemyaml.splice.Splicer) instead of being serialized again.
+
+    If assemblies is specified, it is used as the table of assembly values
+    instead of a new dict; e.g., an assemyaml.spill.SpillStore to keep large
+    values on disk.
+
+    A document whose aliases would add more than max_alias_expansion nodes
+    if they were expanded is rejected (see
+    assemyaml.loader.IterativeComposer); None allows any number.
+
+    If anchor_duplicates is specified and format is "yaml", identical
+    transcluded subtrees of at least that many nodes are written once in
+    each document, with an anchor, and as aliases elsewhere (see
+    assemyaml.dedupe.DuplicateAnchors).
+
+    If jobs is greater than 1 and format is "yaml" (without splice), the
+    template's documents are transcluded and serialized in a pool of that
+    many worker processes (see assemyaml.parallel.transclude_parallel); the
+    output is the same.
+
+    If streaming is true and format is "yaml" (without splice,
+    anchor_duplicates or jobs), the template's parse events are passed
+    through to the output instead of composing the template first (see
+    assemyaml.stream.transclude_stream); the output is the same, but the
+    documents before an error have already been written.
+    """
+    if assemblies is None:
+        assemblies = {}
+
+    loader = get_loader(max_alias_expansion)
+
+    resource_fds = iter(resource_fds)
+    while True:
+        # resource_fds may open inputs as they are needed (see
+        # assemyaml.discover.open_inputs).
         try:
-            record_assemblies(fd, assemblies, local_tags)
+            fd = next(resource_fds)
+        except StopIteration:
+            break
+        except (IOError, OSError) as e:
+            log.error("Unable to open %s for reading: %s", e.filename, e)
+            return 1
+
+        try:
+            record_assemblies(fd, assemblies, local_tags, stats, trace,
+                              loader)
         except YAMLError as e:
             log.error("While processing resource document %s:",
                       getattr(fd, "filename", "<input>"))
             log.error("%s", str(e))
             return 1
 
+    splicer = None
+    anchors = None
+    parallel = (jobs is not None and jobs > 1 and format == "yaml" and
+                not splice)
+    streamed = (streaming and format == "yaml" and not splice and
+                anchor_duplicates is None and not parallel)
+
     try:
-        docs = transclude_template(template_fd, assemblies, local_tags)
+        if parallel:
+            from .parallel import transclude_parallel
+            text = transclude_parallel(
+                template_fd, assemblies, local_tags, jobs, stats, trace, memo,
+                loader, anchor_duplicates)
+        elif streamed:
+            from .stream import transclude_stream
+            transclude_stream(template_fd, output_fd, assemblies, local_tags,
+                              stats, trace, memo, loader)
+        else:
+            if splice and format == "yaml":
+                from .input import read_text
+                from .splice import Splicer
+
+                template_fd = read_text(template_fd)
+                splicer = Splicer(template_fd.text())
+
+            if anchor_duplicates is not None and format == "yaml":
+                from .dedupe import DuplicateAnchors
+                anchors = DuplicateAnchors(anchor_duplicates)
+
+            docs = transclude_template(
+                template_fd, assemblies, local_tags, stats, trace, memo,
+                splicer, loader, anchors)
     except YAMLError as e:
         log.error("While processing template document %s:",
                   getattr(template_fd, "filename", "<input>"))
         log.error("%s", str(e))
         return 1
 
-    if format == "json":
+    if parallel:
+        # Serialized by the workers.
+        output_fd.write(text)
+    elif streamed:
+        # Already written.
+        pass
+    elif stats is None:
+        if anchors is not None:
+            anchors.apply(docs)
+        write_output(docs, output_fd, format, splicer)
+    else:
+        with stats.phase("serialize"):
+            if anchors is not None:
+                anchors.apply(docs)
+            write_output(docs, output_fd, format, splicer)
+
+    if stats is not None:
+        stats.update_peak_memory()
+
+    return 0
+
+
+def write_output(docs, output_fd, format="yaml", splicer=None):
+    """
+    write_output(docs, output_fd, format="yaml", splicer=None)
+
+    Serialize the transcluded documents to output_fd. If splicer is not None,
+    it writes the (YAML) output.
+    """
+    if splicer is not None:
+        splicer.write(docs, output_fd)
+    elif format == "json":
+        from json import dump as json_dump
+        from yaml.constructor import SafeConstructor
+
         if len(docs) > 1:
             log.warning("Multiple documents are not supported with JSON "
                         "output; only the first document will be written.")
@@ -47,33 +177,101 @@ def run(template_fd, resource_fds, output_fd, local_tags, format="yaml"):
         pyobjs = constructor.construct_document(docs[0])
         json_dump(pyobjs, output_fd)
     else:
+        from yaml import serialize_all as yaml_serialize_all
+        from .dumper import SafeDumper
+
         yaml_serialize_all(docs, stream=output_fd, Dumper=SafeDumper)
 
-    return 0
+    return
+
+
+# Subcommands: name -> (module, function). The function is called with the
+# remaining arguments and returns the exit code.
+COMMANDS = {
+    "compile": ("bundle", "compile_main"),
+    "deps": ("deps", "deps_main"),
+    "index": ("index", "index_main"),
+    "map": ("mapreduce", "map_main"),
+    "plan": ("deps", "plan_main"),
+    "query": ("index", "query_main"),
+    "reduce": ("mapreduce", "reduce_main"),
+}
 
 
 def main(args=None):
+    from getopt import getopt, GetoptError
+
     format = "yaml"
     template_filename = None
     local_tags = True
     output = sys.stdout
+    output_filename = None
+    if_changed = False
+    digest_filename = None
+    stats = None
+    profile_filename = None
+    trace_filename = None
+    trace = None
+    memo = None
+    splice = False
+    spill = None
+    max_alias_expansion = DEFAULT_MAX_ALIAS_EXPANSION
+    anchor_duplicates = None
+    jobs = None
+    streaming = False
+    cache_dir = None
+    cache_size = None
+    cache = None
 
     basicConfig(stream=sys.stderr, format="%(levelname)s %(message)s")
 
     if args is None:  # pragma: nocover
         args = argv[1:]
 
+    if args and args[0] in COMMANDS:
+        from importlib import import_module
+        module_name, function_name = COMMANDS[args[0]]
+        module = import_module("." + module_name, __name__)
+        return getattr(module, function_name)(args[1:])
+
     try:
         opts, filenames = getopt(
-            args, "f:hlo:t:", ["format=", "help", "no-local-tag", "output=",
-                               "template="])
+            args, "f:hj:lo:t:", [
+                "anchor-duplicates=", "cache-dir=", "cache-size=",
+                "digest-file=", "format=", "help", "if-changed", "jobs=",
+                "max-alias-expansion=", "memo-size=", "no-local-tag",
+                "output=", "profile=", "spill-ceiling=", "splice", "stats",
+                "stream", "template=", "trace="])
     except GetoptError as e:
         log.error("%s", e)
         usage()
         return 2
 
     for opt, val in opts:
-        if opt in ("-f", "--format",):
+        if opt in ("--anchor-duplicates",):
+            try:
+                anchor_duplicates = int(val)
+                if anchor_duplicates <= 0:
+                    raise ValueError()
+            except ValueError:
+                log.error("Invalid minimum node count '%s': must be a "
+                          "positive integer", val)
+                usage()
+                return 2
+        elif opt in ("--cache-dir",):
+            cache_dir = val
+        elif opt in ("--cache-size",):
+            from .spill import parse_size
+            try:
+                cache_size = parse_size(val)
+            except ValueError:
+                log.error("Invalid cache size '%s': must be a positive size "
+                          "in bytes, optionally with a K, M or G suffix", val)
+                usage()
+                return 2
+        elif opt in ("--digest-file",):
+            digest_filename = val
+        elif opt in ("-f", "--format",):
             if val not in ("json", "yaml",):
                 log.error("Invalid output format '%s': valid types are 'json' "
                           "and 'yaml'", val)
@@ -83,16 +281,82 @@ def main(args=None):
         elif opt in ("-h", "--help",):
             usage(sys.stdout)
             return 0
+        elif opt in ("--if-changed",):
+            if_changed = True
+        elif opt in ("-j", "--jobs",):
+            try:
+                jobs = int(val)
+                if jobs <= 0:
+                    raise ValueError()
+            except ValueError:
+                log.error("Invalid number of jobs '%s': must be a positive "
+                          "integer", val)
+                usage()
+                return 2
+        elif opt in ("--max-alias-expansion",):
+            try:
+                max_alias_expansion = int(val)
+                if max_alias_expansion < 0:
+                    raise ValueError()
+            except ValueError:
+                log.error("Invalid alias expansion limit '%s': must be a "
+                          "non-negative integer", val)
+                usage()
+                return 2
+
+            if max_alias_expansion == 0:
+                max_alias_expansion = None
+        elif opt in ("--memo-size",):
+            try:
+                memo_size = int(val)
+                if memo_size <= 0:
+                    raise ValueError()
+            except ValueError:
+                log.error("Invalid memo size '%s': must be a positive "
+                          "integer", val)
+                usage()
+                return 2
+
+            from .memo import TranscludeMemo
+            memo = TranscludeMemo(memo_size)
         elif opt in ("-l", "--no-local-tag",):
             local_tags = False
         elif opt in ("-o", "--output",):
+            output_filename = val
+        elif opt in ("--profile",):
+            profile_filename = val
+        elif opt in ("--spill-ceiling",):
+            from .spill import SpillStore, parse_size
             try:
-                output = open(val, "w")
-            except IOError as e:
-                log.error("Unable to open %s for writing: %s", val, e)
-                return 1
+                spill = SpillStore(parse_size(val))
+            except ValueError:
+                log.error("Invalid spill ceiling '%s': must be a positive "
+                          "size in bytes, optionally with a K, M or G "
+                          "suffix", val)
+                usage()
+                return 2
+        elif opt in ("--splice",):
+            splice = True
+        elif opt in ("--stats",):
+            from .stats import Stats
+            stats = Stats()
+        elif opt in ("--stream",):
+            streaming = True
         elif opt in ("-t", "--template",):
             template_filename = val
+        elif opt in ("--trace",):
+            from .trace import Trace
+            trace_filename = val
+            trace = Trace()
+
+    # The output is written to a temporary file and renamed into place if
+    # it is only to be replaced when it changes, or if its digest is needed.
+    replace_output = if_changed or digest_filename is not None
+    if replace_output and output_filename is None:
+        log.error("%s requires --output",
+                  "--if-changed" if if_changed else "--digest-file")
+        usage()
+        return 2
 
     if template_filename is None:
         if len(filenames) == 0:
@@ -103,29 +367,145 @@ def main(args=None):
         filenames = filenames[1:]
 
     try:
-        template_fd = open(template_filename, "r")
+        template_fd = open_input(template_filename)
     except IOError as e:
         log.error("Unable to open %s for reading: %s", template_filename, e)
         return 1
 
-    resource_fds = []
-    for filename in filenames:
+    if output_filename is not None:
         try:
-            resource_fds.append(open(filename, "r"))
-        except IOError as e:
-            log.error("Unable to open %s for reading: %s", filename, e)
+            if replace_output:
+                from .output import ReplaceOutput
+                output = ReplaceOutput(output_filename, if_changed)
+            else:
+                output = open(output_filename, "w")
+        except (IOError, OSError) as e:
+            log.error("Unable to open %s for writing: %s", output_filename,
+                      e)
+            template_fd.close()
             return 1
 
-    result = run(template_fd, resource_fds, output, local_tags, format)
+    # Resource arguments may also be directories, glob patterns or
+    # @listfiles. They are expanded and opened in the background while the
+    # first resources are processed.
+    from .discover import Discovery, open_inputs
+    resource_filenames = Discovery(filenames)
+
+    cache_key = None
+    if cache_dir is not None and trace is None:
+        # Every input is hashed before the run, so the resource arguments
+        # are expanded first. Traces record decisions that a cached run
+        # doesn't make, so they aren't cached.
+        from .cache import DEFAULT_CACHE_SIZE, ResultCache
+        from .discover import discover
+        try:
+            cache = ResultCache(
+                cache_dir, cache_size if cache_size is not None
+                else DEFAULT_CACHE_SIZE)
+        except OSError as e:
+            log.error("Unable to use cache directory %s: %s", cache_dir, e)
+            template_fd.close()
+            return 1
+
+        try:
+            resource_filenames = discover(filenames)
+            cache_key = cache.key(template_fd, resource_filenames, {
+                "anchor_duplicates": anchor_duplicates, "format": format,
+                "local_tags": local_tags,
+                "max_alias_expansion": max_alias_expansion,
+                "splice": splice})
+        except (IOError, OSError) as e:
+            log.error("Unable to read %s: %s", e.filename, e)
+            template_fd.close()
+            return 1
+
+    resource_fds = open_inputs(resource_filenames)
+    run_output = output
+    if cache_key is not None:
+        if cache.copy_to(cache_key, output):
+            run_output = None
+        else:
+            try:
+                run_output = cache.writer(cache_key, output)
+            except (IOError, OSError) as e:
+                log.warning("Unable to write to cache directory %s: %s",
+                            cache_dir, e)
+
+    if run_output is None:
+        # Copied from the cache.
+        result = 0
+    elif profile_filename is None:
+        result = run(template_fd, resource_fds, run_output, local_tags,
+                     format, stats, trace, memo, splice, spill,
+                     max_alias_expansion, anchor_duplicates, jobs, streaming)
+    else:
+        from .profile import Profiler
+        try:
+            with Profiler(profile_filename):
+                result = run(template_fd, resource_fds, run_output,
+                             local_tags, format, stats, trace, memo, splice,
+                             spill, max_alias_expansion, anchor_duplicates,
+                             jobs, streaming)
+        except IOError as e:
+            log.error("Unable to write profile to %s: %s", profile_filename,
+                      e)
+            result = 1
+
+    if run_output is not None and run_output is not output:
+        try:
+            if result == 0:
+                cache.commit(run_output)
+            else:
+                cache.discard(run_output)
+        except (IOError, OSError) as e:
+            log.warning("Unable to write to cache directory %s: %s",
+                        cache_dir, e)
 
     template_fd.close()
-    for fd in resource_fds:
-        fd.close()
+    resource_fds.close()
+    if spill is not None:
+        spill.close()
 
-    if output is not sys.stdout:
+    if replace_output:
+        if result == 0:
+            try:
+                output.commit()
+            except (IOError, OSError) as e:
+                log.error("Unable to write %s: %s", output_filename, e)
+                output.discard()
+                result = 1
+        else:
+            # Leave the previous output in place.
+            output.discard()
+    elif output is not sys.stdout:
         output.flush()
         output.close()
 
+    if digest_filename is not None and result == 0:
+        try:
+            with open(digest_filename, "w") as fd:
+                fd.write(output.hexdigest() + "\n")
+        except IOError as e:
+            log.error("Unable to write digest to %s: %s", digest_filename, e)
+            result = 1
+
+    if stats is not None and result == 0:
+        sys.stderr.write(stats.format())
+        if memo is not None:
+            sys.stderr.write(memo.format())
+        if spill is not None:
+            sys.stderr.write(spill.format())
+        if cache is not None:
+            sys.stderr.write(cache.format())
+
+    if trace is not None:
+        try:
+            with open(trace_filename, "w") as fd:
+                trace.write(fd)
+        except IOError as e:
+            log.error("Unable to write trace to %s: %s", trace_filename, e)
+            result = 1
+
     sys.stderr.flush()
 
     return result
@@ -138,9 +518,32 @@ def usage(fd=None):
     fd.write("""
 Usage: %(argv0)s [options] template-document resource-documents...
        %(argv0)s [options] --template template-document resource-documents...
+       %(argv0)s compile|deps|plan|index|query|map|reduce [options] ...
 
 Transclude parts of YAML documents to produce a final document.
 
+Resource documents may be given as filenames, directories (searched
+recursively for .yaml and .yml files), glob patterns, or @listfile to read
+them from listfile, one per line. Files are processed in sorted order. Use -
+to read a document from stdin; it and named pipes are read incrementally, so
+each document's assemblies are recorded as soon as it has been written.
+Bundles written by "%(argv0)s compile" may be given in place of the resource
+documents they were compiled from.
+
+Commands (use "%(argv0)s <command> --help" for details):
+    compile Compile resource documents into bundles that load without
+            parsing YAML.
+    deps    Write a dependency manifest for templates and resources.
+    plan    List (and optionally reassemble) the templates affected by
+            changed files.
+    index   Write an index of where each assembly and transclusion name is
+            used.
+    query   Look up names in an index.
+    map     Assemble a subset of the resource documents into a partial
+            assembly file.
+    reduce  Merge partial assembly files and transclude the result into a
+            template.
+
 Syntax examples:
     Template document:
         Hello:
@@ -163,15 +566,85 @@ Syntax examples:
 See https://assemyaml.nz for details on document syntax.
 
 Options:
+    --anchor-duplicates <min-nodes>
+        Write identical transcluded subtrees of at least <min-nodes> nodes
+        once in each document, with an anchor, and as aliases elsewhere.
+        Only applies to YAML output.
+
+    --cache-dir <directory>
+        Keep the output of each run in directory, keyed by a digest of every
+        input's bytes and the options that affect the output. A run whose
+        digest matches an earlier one copies that output without parsing
+        any YAML. Not used with --trace, or when an input is stdin or a
+        named pipe.
+
+    --cache-size <size>
+        Keep the entries in the --cache-dir directory below about <size>
+        bytes (K, M and G suffixes are accepted; default 256M), removing the
+        least recently used first.
+
+    --digest-file <filename>
+        Write the SHA-256 digest of the output to filename, e.g. for use as
+        a cache key. Requires --output.
+
     --help
         Show this usage information.
 
+    --if-changed
+        Replace the --output file only if the new output differs from what
+        it holds, so its modification time is kept when nothing changed.
+        The file is replaced atomically and is left as it was on errors.
+        Requires --output.
+
+    --jobs <count> | -j <count>
+        Transclude and serialize the template's documents in <count> worker
+        processes. The output is the same. Only applies to YAML output
+        without --splice.
+
+    --max-alias-expansion <nodes>
+        Reject documents whose aliases would add more than <nodes> nodes if
+        they were expanded (default %(max_alias_expansion)d; 0 for no limit).
+
+    --memo-size <entries>
+        Reuse merged transclusion values for identical defaults and
+        assemblies, keeping up to <entries> of them.
+
     --no-local-tag | -l
         Ignore !Transclude and !Assembly local tags and use global tags only.
 
     --output <filename> | -o <filename>
         Write output to filename instead of stdout.
-""" % {"argv0": basename(argv[0])})
+
+    --profile <filename>
+        Profile the run and write the results to filename. If filename ends
+        in .collapsed or .folded, a sampling profiler writes collapsed stacks
+        (for flame graphs); otherwise, cProfile writes pstats data.
+
+    --spill-ceiling <size>
+        Keep the assembled values in memory below about <size> bytes (K, M
+        and G suffixes are accepted), writing the largest to a temporary
+        file and reading them back when they are transcluded.
+
+    --splice
+        Copy the parts of the template that are not changed from its source
+        text (keeping comments and formatting) instead of serializing them
+        again. Only applies to YAML output.
+
+    --stats
+        Write timings and counters for each phase to stderr.
+
+    --stream
+        Pass the template through to the output as it is parsed, composing
+        only its transclusion points, so the template's size doesn't
+        determine memory use. The output is the same, but the documents
+        before an error have already been written. Only applies to YAML
+        output without --splice, --anchor-duplicates or --jobs.
+
+    --trace <filename>
+        Write each assembly and transclusion decision to filename as JSON
+        lines.
+""" % {"argv0": basename(argv[0]),
+       "max_alias_expansion": DEFAULT_MAX_ALIAS_EXPANSION})
     fd.flush()
     return
 
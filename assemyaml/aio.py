@@ -0,0 +1,170 @@
+"""
+asyncio interface to assemyaml. Requires Python 3.7 or later.
+"""
+from __future__ import absolute_import, print_function
+from asyncio import gather, get_running_loop, StreamWriter
+from inspect import isawaitable
+from io import BytesIO, StringIO
+from logging import getLogger, Handler
+from os import getpid
+from . import run
+
+log = getLogger("assemyaml")
+
+
+async def run_async(template_fd, resource_fds, output_fd, local_tags,
+                    format="yaml", stats=None, trace=None, memo=None,
+                    executor=None):
+    """
+    await run_async(template_fd, resource_fds, output_fd, local_tags,
+                    format="yaml", stats=None, trace=None, memo=None,
+                    executor=None) -> int
+
+    Asynchronous version of run(); the parameters, result and logged errors
+    are the same.
+
+    Inputs may be file-like objects whose read() method is a coroutine (such
+    as asyncio.StreamReader objects or aiofiles files) or ordinary file-like
+    objects, which are read in the event loop's default executor.
+    Memory-mapped and in-memory inputs (assemyaml.input.MappedInput,
+    TextInput, StringIO and BytesIO objects) don't block, so they are read
+    directly. The output may be an asyncio.StreamWriter, a file-like object
+    whose write() method is a coroutine, or an ordinary file-like object.
+
+    Parsing, assembly, transclusion and serialization run in executor (the
+    event loop's default executor if None), so independent runs can proceed
+    concurrently with asyncio.gather(). With a ProcessPoolExecutor, errors
+    logged by the worker are logged again in this process, and stats and
+    trace are updated with the worker's results. A memo is only shared
+    between runs when the executor runs in this process.
+    """
+    loop = get_running_loop()
+
+    inputs = await gather(
+        *[read_input(loop, fd) for fd in [template_fd] + list(resource_fds)])
+    template, resources = inputs[0], inputs[1:]
+
+    result, output, worker_stats, worker_trace, records = (
+        await loop.run_in_executor(
+            executor, run_text, template, resources, local_tags, format,
+            stats, trace, memo, getpid()))
+
+    # Results from another process are copies.
+    for record in records:
+        getLogger(record.name).handle(record)
+
+    if stats is not None and worker_stats is not stats:
+        stats.merge(worker_stats)
+
+    if trace is not None and worker_trace is not trace:
+        trace.events.extend(worker_trace.events)
+
+    if output:
+        await write_output(output_fd, output)
+
+    return result
+
+
+async def read_input(loop, fd):
+    """
+    await read_input(loop, fd) -> (name, str | bytes)
+
+    Read the contents of an input document.
+    """
+    name = getattr(fd, "filename", None)
+    if name is None:
+        name = getattr(fd, "name", "<input>")
+
+    # Memory-mapped and in-memory inputs are read without waiting for the
+    # executor.
+    if getattr(fd, "mapped", False) or isinstance(fd, (BytesIO, StringIO)):
+        return name, fd.read()
+
+    # Other file reads may block, so read() is called in an executor. For
+    # asynchronous readers, this just creates the coroutine.
+    data = await loop.run_in_executor(None, fd.read)
+    if isawaitable(data):
+        data = await data
+
+    return name, data
+
+
+async def write_output(output_fd, output):
+    """
+    await write_output(output_fd, output)
+
+    Write the serialized output to output_fd.
+    """
+    if isinstance(output_fd, StreamWriter):
+        output_fd.write(output.encode("utf-8"))
+        await output_fd.drain()
+        return
+
+    result = output_fd.write(output)
+    if isawaitable(result):
+        await result
+
+    return
+
+
+def run_text(template, resources, local_tags, format, stats, trace, memo,
+             parent_pid):
+    """
+    run_text(template, resources, local_tags, format, stats, trace, memo,
+             parent_pid) -> (result, output, stats, trace, log_records)
+
+    Executor function for run_async(). template and each resource are
+    (name, str | bytes) tuples.
+
+    If this is not running in the parent process, messages logged to the
+    assemyaml loggers are captured and returned instead of being handled
+    here.
+    """
+    handler = None
+    if getpid() != parent_pid:
+        handler = RecordingHandler()
+        log.addHandler(handler)
+        log.propagate = False
+
+    try:
+        output = StringIO()
+        result = run(named_stream(*template),
+                     [named_stream(*resource) for resource in resources],
+                     output, local_tags, format, stats, trace, memo)
+    finally:
+        if handler is not None:
+            log.removeHandler(handler)
+            log.propagate = True
+
+    records = handler.records if handler is not None else []
+    return result, output.getvalue(), stats, trace, records
+
+
+def named_stream(name, data):
+    """
+    named_stream(name, data) -> StringIO | BytesIO
+
+    Wrap data in a stream that reports name in error marks and messages.
+    Byte strings are decoded by PyYAML's reader.
+    """
+    stream = BytesIO(data) if isinstance(data, bytes) else StringIO(data)
+    stream.name = stream.filename = name
+    return stream
+
+
+class RecordingHandler(Handler):
+    """
+    Logging handler that keeps the records it handles.
+    """
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.records = []
+        return
+
+    def emit(self, record):
+        # Format the message now; the arguments may not be picklable.
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+        return
@@ -1,11 +1,14 @@
 from logging import getLogger
 from .error import AssemblyError
+from .input import is_bundle
+from .loader import SafeLoader
+from .trace import get_trace
 from .types import (
-    GLOBAL_ASSEMBLY_TAG, LOCAL_ASSEMBLY_TAG, mapping_find, YAML_MAP_TAG,
-    YAML_NULL_TAG, YAML_NS, YAML_SEQ_TAG,
+    copy_node, GLOBAL_ASSEMBLY_TAG, LOCAL_ASSEMBLY_TAG, mapping_find,
+    YAML_MAP_TAG, YAML_NULL_TAG, YAML_NS, YAML_SEQ_TAG,
 )
+from .walk import rebuild
 from yaml import compose_all
-from yaml.loader import SafeLoader
 from yaml.nodes import (
     Node, CollectionNode, MappingNode, ScalarNode, SequenceNode,
 )
@@ -14,53 +17,129 @@ from yaml.nodes import (
 log = getLogger("assemyaml.assemble")
 
 
-def record_assemblies(stream, assemblies, local_tags=True):
-    for doc in compose_all(stream, Loader=SafeLoader):
+def record_assemblies(stream, assemblies, local_tags=True, stats=None,
+                      trace=None, loader=SafeLoader):
+    trace = get_trace(trace)
+
+    if is_bundle(stream):
+        # Precompiled by "assemyaml compile"; no YAML to parse.
+        from .bundle import load_bundle
+        load_bundle(stream, assemblies, local_tags, stats, trace)
+        return
+
+    if stats is None:
+        docs = compose_all(stream, Loader=loader)
+    else:
+        docs = stats.timed_iter(
+            compose_all(stats.reader(stream), Loader=loader), "parse")
+
+    for doc in docs:
         # Wrap the document in a sequence node so we can apply get_assemblies()
         # to an assembly at the top level.
         wrapper = SequenceNode(YAML_SEQ_TAG, [doc])
-        assemble(wrapper, assemblies, local_tags)
+
+        if stats is None:
+            assemble(wrapper, assemblies, local_tags, trace=trace)
+        else:
+            stats.documents += 1
+            with stats.phase("assemble"):
+                assemble(wrapper, assemblies, local_tags, stats, trace)
 
     return
 
 
-def assemble(node, assemblies, local_tags):
+def assemble(node, assemblies, local_tags, stats=None, trace=None):
     """
-    assemble(node, assemblies, local_tags) -> node
+    assemble(node, assemblies, local_tags, stats=None, trace=None) -> node
 
-    First, recurse on the values in this node.
+    First, process the values in this node.
 
     Then, if the current node is an assembly, record its value and return the
     value as the node.
+
+    The tree is walked without recursion (see assemyaml.walk.rebuild), so
+    deeply nested documents are handled.
     """
     assert isinstance(node, Node)
-    if isinstance(node, ScalarNode):
-        # Scalar type -- no need to evaluate
+
+    # Assemblies whose values are being walked (see contribute()).
+    enclosing = []
+
+    def enter_node(node):
+        # Called for every node, so this doesn't call get_assembly().
+        if isinstance(node, MappingNode):
+            for key_node, _ in node.value:
+                if (key_node.tag == GLOBAL_ASSEMBLY_TAG or  # noqa: E129
+                    local_tags and key_node.tag == LOCAL_ASSEMBLY_TAG):
+                    enclosing.append(node)
+                    break
+
         return node
 
-    old_values = node.value
-    node.value = []
-    for value in old_values:
-        if isinstance(value, tuple):
-            value = tuple(
-                [assemble(el, assemblies, local_tags) for el in value])
-        else:
-            value = assemble(value, assemblies, local_tags)
+    def assemble_node(node):
+        if stats is not None:
+            stats.nodes += 1
 
-        node.value.append(value)
+        if isinstance(node, ScalarNode):
+            # Scalar type -- no need to evaluate
+            return node
 
-    # Is this node an assembly?
-    name, value = get_assembly(node, local_tags)
-    if name is not None:
-        # Yes. Take a look at the existing value.
-        existing_value = assemblies.get(name)
+        if enclosing and enclosing[-1] is node:
+            enclosing.pop()
 
-        if existing_value is None:
-            node = assemblies[name] = value
-        else:
-            node = assemblies[name] = merge_nodes(existing_value, value)
+        # Is this node an assembly?
+        name, value = get_assembly(node, local_tags)
+        if name is None:
+            return node
 
-    return node
+        return contribute(assemblies, name, value, node.start_mark,
+                          bool(enclosing), stats, trace)
+
+    return rebuild(node, pre=enter_node, post=assemble_node)
+
+
+def contribute(assemblies, name, value, mark, nested=True, stats=None,
+               trace=None):
+    """
+    contribute(assemblies, name, value, mark, nested=True, stats=None,
+               trace=None) -> node
+
+    Merge the value of an assembly (at mark) into the assemblies table, and
+    return the node that replaces the assembly in its document: the merged
+    value. If nested is True (the assembly is within another assembly's
+    value), this is a copy, so the enclosing value doesn't share nodes with
+    the table; later merges reuse those nodes, and the output would have
+    aliases that aren't in the source.
+
+    If the table has a contribute(name, value, mark, nested, stats) method,
+    it is called to do the merging instead. If nested is False, the node
+    returned is discarded; e.g. assemyaml.spill.SpillStore doesn't decode a
+    spilled value to merge into it unless it is needed.
+    """
+    if stats is not None:
+        stats.assemblies += 1
+
+    table_contribute = getattr(assemblies, "contribute", None)
+    if table_contribute is not None:
+        if trace is not None:
+            trace.record("assembly", name, mark,
+                         "merge" if name in assemblies else "record")
+
+        return table_contribute(name, value, mark, nested, stats)
+
+    # Take a look at the existing value.
+    existing_value = assemblies.get(name)
+
+    if trace is not None:
+        trace.record("assembly", name, mark,
+                     "record" if existing_value is None else "merge")
+
+    if existing_value is None:
+        node = assemblies[name] = value
+    else:
+        node = assemblies[name] = merge_nodes(existing_value, value, stats)
+
+    return copy_node(node) if nested else node
 
 
 def simplify_tag(tag):
@@ -70,12 +149,14 @@ def simplify_tag(tag):
         return tag
 
 
-def merge_nodes(a, b):
+def merge_nodes(a, b, stats=None):
     """
-    merge_nodes(a, b) -> node
+    merge_nodes(a, b, stats=None) -> node
 
     Merge the values of the two nodes together to produce a new node.
     """
+    if stats is not None:
+        stats.merges += 1
 
     if a.tag == YAML_NULL_TAG:
         node = b
@@ -103,6 +184,9 @@ def merge_nodes(a, b):
         # is found. Since YAML allows for complex keys (sequences, etc.),
         # PyYAML stores mappings as an unordered list of (key, value) tuples.
         if a.tag == YAML_MAP_TAG:
+            if stats is not None:
+                stats.duplicate_key_checks += len(b.value)
+
             for bkey, _ in b.value:
                 pos = mapping_find(a, bkey)
                 if pos is not None:
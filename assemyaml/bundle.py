@@ -0,0 +1,437 @@
+from __future__ import absolute_import, print_function
+from logging import getLogger
+from marshal import dumps as marshal_dumps, loads as marshal_loads
+from os.path import basename, dirname, join as path_join, splitext
+import sys
+from zlib import compress, decompress, error as ZlibError
+from .assemble import assemble, contribute
+from .codec import decode_node, encode_node
+from .error import BundleError
+from .input import BUNDLE_MAGIC
+from .loader import SafeLoader
+from .types import YAML_SEQ_TAG
+from .walk import flatten_value
+from yaml import compose_all
+from yaml.error import Mark, YAMLError
+from yaml.nodes import CollectionNode, MappingNode, SequenceNode
+
+log = getLogger("assemyaml.bundle")
+
+# Version of the bundle format written by compile_bundle(). Bundles with
+# other versions must be compiled again.
+BUNDLE_VERSION = 1
+
+# Extension of bundles written next to their resource documents.
+BUNDLE_EXTENSION = ".ayb"
+
+
+class _Recorder(object):
+    """
+    The assembly table used when assembling a resource document to compile
+    it. Its contribute() hook (see assemyaml.assemble.contribute()) keeps
+    each contribution separately instead of merging it, in the order the
+    assembler produces them.
+    """
+    def __init__(self):
+        super(_Recorder, self).__init__()
+        # [name, mark, value] for each assembly, in post-order.
+        self.contributions = []
+        return
+
+    def __contains__(self, name):
+        return False
+
+    def contribute(self, name, value, mark, nested=True, stats=None):
+        self.contributions.append([name, mark, value])
+        return value
+
+
+def compile_bundle(stream, local_tags=True, loader=SafeLoader):
+    """
+    compile_bundle(stream, local_tags=True, loader=SafeLoader) -> bytes
+
+    Assemble the resource documents in stream and return a bundle holding
+    each assembly contribution (name, mark and value) in a compact binary
+    form. Passing the bundle to record_assemblies() (e.g. as a file given to
+    run()) records the same assemblies as the documents would, without
+    parsing any YAML.
+    """
+    contributions, documents = record_contributions(stream, local_tags,
+                                                    loader)
+    return write_bundle(contributions, local_tags, documents)
+
+
+def record_contributions(stream, local_tags=True, loader=SafeLoader):
+    """
+    record_contributions(stream, local_tags=True, loader=SafeLoader)
+        -> (contributions, documents)
+
+    Assemble the resource documents in stream without merging them. Returns
+    each assembly contribution as a [name, mark, value] list, in the order
+    record_assemblies() would merge them, and the number of documents.
+    """
+    recorder = _Recorder()
+    documents = 0
+
+    for doc in compose_all(stream, Loader=loader):
+        documents += 1
+        assemble(SequenceNode(YAML_SEQ_TAG, [doc]), recorder, local_tags)
+
+    return recorder.contributions, documents
+
+
+def find_nested(values):
+    """
+    find_nested(values) -> set
+
+    Returns the indexes of the values that also appear inside (or are) other
+    values.
+    """
+    # A nested assembly's value is stored inside the enclosing assembly's
+    # value (the assembler replaces the nested assembly with it), or is the
+    # enclosing value itself; the encoding shares it, and load_bundle()
+    # replaces it with the merged value.
+    value_indexes = {}
+    nested = set()
+    for i, value in enumerate(values):
+        if id(value) in value_indexes:
+            nested.add(value_indexes[id(value)])
+        else:
+            value_indexes[id(value)] = i
+
+    seen = set()
+    stack = []
+    for value in values:
+        if isinstance(value, CollectionNode):
+            stack.extend(flatten_value(value.value)[0])
+
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+
+        if id(node) in value_indexes:
+            nested.add(value_indexes[id(node)])
+        if isinstance(node, CollectionNode):
+            stack.extend(flatten_value(node.value)[0])
+
+    return nested
+
+
+def write_bundle(contributions, local_tags, documents):
+    """
+    write_bundle(contributions, local_tags, documents) -> bytes
+
+    Encode assembly contributions (a list of (name, mark, value) items, in
+    the order they are recorded) from the given number of documents as a
+    bundle.
+    """
+    values = [value for _, _, value in contributions]
+    nested = find_nested(values)
+
+    names = tuple([name for name, _, _ in contributions])
+    marks = tuple([(mark.name, mark.index, mark.line, mark.column)
+                   for _, mark, _ in contributions])
+    # The encoded values repeat marks and tags heavily; compressing them
+    # makes the bundle several times smaller at little cost to loading.
+    values_data = compress(encode_node(SequenceNode(YAML_SEQ_TAG, values)))
+
+    return BUNDLE_MAGIC + marshal_dumps((
+        BUNDLE_VERSION, bool(local_tags), documents, names, marks,
+        tuple(sorted(nested)), values_data))
+
+
+def read_bundle(data, name="<bundle>"):
+    """
+    read_bundle(data, name="<bundle>")
+        -> (local_tags, documents, contributions, nested)
+
+    Decode a bundle. contributions is a list of (name, mark, value) tuples;
+    nested is the set of values (by id) that also appear inside other
+    values. Raises BundleError if the data isn't a bundle of a supported
+    version.
+    """
+    if data[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+        raise BundleError("%s is not an assembly bundle" % name)
+
+    try:
+        payload = marshal_loads(memoryview(data)[len(BUNDLE_MAGIC):])
+        version = payload[0]
+    except (EOFError, IndexError, TypeError, ValueError):
+        raise BundleError("%s is not a valid assembly bundle" % name)
+
+    if version != BUNDLE_VERSION:
+        raise BundleError(
+            "%s is a version %r bundle; this version of assemyaml reads "
+            "version %d bundles. Compile it again." % (
+                name, version, BUNDLE_VERSION))
+
+    try:
+        _, local_tags, documents, names, marks, nested, values_data = payload
+        values = decode_node(decompress(values_data)).value
+    except (EOFError, TypeError, ValueError, ZlibError):
+        raise BundleError("%s is not a valid assembly bundle" % name)
+
+    contributions = [
+        (assembly_name, Mark(mark[0], mark[1], mark[2], mark[3], None, None),
+         value)
+        for assembly_name, mark, value in zip(names, marks, values)]
+
+    return (local_tags, documents, contributions,
+            set([id(values[i]) for i in nested]))
+
+
+def check_local_tags(name, bundle_local_tags, local_tags):
+    """
+    check_local_tags(name, bundle_local_tags, local_tags)
+
+    Raise BundleError if a bundle was compiled with local tags enabled or
+    disabled and they are not now.
+    """
+    if bundle_local_tags != bool(local_tags):
+        raise BundleError(
+            "%s was compiled with local tags %s; compile it again%s" % (
+                name, "enabled" if bundle_local_tags else "disabled",
+                "" if local_tags else " with --no-local-tag"))
+
+    return
+
+
+def find_slots(values, targets):
+    """
+    find_slots(values, targets) -> dict
+
+    Find where the nodes whose ids are in targets appear within the given
+    node trees. Returns a dict mapping each id to a list of (parent, index,
+    position) slots: position is None for a sequence element, or 0 or 1 for
+    the key or value of a mapping entry.
+    """
+    slots = {}
+    seen = set()
+    stack = list(values)
+
+    while stack:
+        node = stack.pop()
+        if id(node) in seen or not isinstance(node, CollectionNode):
+            continue
+        seen.add(id(node))
+
+        if isinstance(node, MappingNode):
+            for index, entry in enumerate(node.value):
+                for position in (0, 1):
+                    child = entry[position]
+                    if id(child) in targets:
+                        slots.setdefault(id(child), []).append(
+                            (node, index, position))
+                    stack.append(child)
+        else:
+            for index, child in enumerate(node.value):
+                if id(child) in targets:
+                    slots.setdefault(id(child), []).append(
+                        (node, index, None))
+                stack.append(child)
+
+    return slots
+
+
+def load_bundle(stream, assemblies, local_tags=True, stats=None, trace=None):
+    """
+    load_bundle(stream, assemblies, local_tags=True, stats=None, trace=None)
+
+    Record the assemblies in a bundle (a memory-mapped input; see
+    assemyaml.input.is_bundle()) in the assemblies table, exactly as
+    record_assemblies() would for the resource documents it was compiled
+    from.
+    """
+    name = getattr(stream, "filename", "<bundle>")
+
+    if stats is None:
+        bundle = read_bundle(stream.buffer, name)
+    else:
+        stats.bytes_read += stream.size
+        with stats.phase("parse"):
+            bundle = read_bundle(stream.buffer, name)
+
+    bundle_local_tags, documents, contributions, nested = bundle
+    check_local_tags(name, bundle_local_tags, local_tags)
+
+    if stats is None:
+        replay(contributions, nested, assemblies, trace=trace)
+    else:
+        stats.documents += documents
+        with stats.phase("assemble"):
+            replay(contributions, nested, assemblies, stats, trace)
+
+    return
+
+
+def replay(contributions, nested, assemblies, stats=None, trace=None):
+    """
+    replay(contributions, nested, assemblies, stats=None, trace=None)
+
+    Record bundle contributions in the assemblies table, merging them with
+    existing values as assemble() does. A nested contribution's value is
+    replaced, wherever it appears, by the value it was merged into.
+    """
+    if nested:
+        slots = find_slots([value for _, _, value in contributions], nested)
+    else:
+        slots = {}
+
+    # id(compiled value) -> the node that now stands in for it.
+    current = {}
+
+    for name, mark, value in contributions:
+        value_id = id(value)
+        value = current.get(value_id, value)
+
+        node = contribute(assemblies, name, value, mark, value_id in nested,
+                          stats, trace)
+
+        if value_id in nested:
+            current[value_id] = node
+            for parent, index, position in slots.get(value_id, ()):
+                if position is None:
+                    parent.value[index] = node
+                else:
+                    entry = list(parent.value[index])
+                    entry[position] = node
+                    parent.value[index] = tuple(entry)
+
+    return
+
+
+def bundle_filename(filename, output_dir=None):
+    """
+    bundle_filename(filename, output_dir=None) -> str
+
+    Returns the name of the bundle compiled from filename: its base name with
+    the BUNDLE_EXTENSION, in output_dir or alongside it.
+    """
+    if output_dir is None:
+        output_dir = dirname(filename)
+
+    return path_join(output_dir,
+                     splitext(basename(filename))[0] + BUNDLE_EXTENSION)
+
+
+def compile_main(args):
+    """
+    assemyaml compile [options] resource-documents...
+
+    Compile resource documents into bundles.
+    """
+    from getopt import getopt, GetoptError
+    from .discover import discover
+    from .input import open_input
+
+    local_tags = True
+    output_filename = None
+    output_dir = None
+
+    try:
+        opts, arguments = getopt(
+            args, "hlo:", ["help", "no-local-tag", "output=", "output-dir="])
+    except GetoptError as e:
+        log.error("%s", e)
+        compile_usage()
+        return 2
+
+    for opt, val in opts:
+        if opt in ("-h", "--help",):
+            compile_usage(sys.stdout)
+            return 0
+        elif opt in ("-l", "--no-local-tag",):
+            local_tags = False
+        elif opt in ("-o", "--output",):
+            output_filename = val
+        elif opt in ("--output-dir",):
+            output_dir = val
+
+    try:
+        filenames = discover(arguments)
+    except (IOError, OSError) as e:
+        log.error("Unable to read %s: %s", e.filename, e)
+        return 1
+
+    if not filenames:
+        log.error("Missing resource filename")
+        compile_usage()
+        return 2
+
+    if output_filename is not None and len(filenames) > 1:
+        log.error("--output can only be used with a single resource document")
+        compile_usage()
+        return 2
+
+    if output_filename is None and "-" in filenames:
+        log.error("--output is required to compile stdin")
+        compile_usage()
+        return 2
+
+    for filename in filenames:
+        try:
+            with open_input(filename) as fd:
+                data = compile_bundle(fd, local_tags)
+        except (IOError, OSError) as e:
+            log.error("Unable to open %s for reading: %s", filename, e)
+            return 1
+        except YAMLError as e:
+            log.error("While processing resource document %s:", filename)
+            log.error("%s", str(e))
+            return 1
+
+        if output_filename is not None:
+            target = output_filename
+        else:
+            target = bundle_filename(filename, output_dir)
+
+        try:
+            with open(target, "wb") as fd:
+                fd.write(data)
+        except (IOError, OSError) as e:
+            log.error("Unable to open %s for writing: %s", target, e)
+            return 1
+
+        log.debug("Compiled %s to %s (%d bytes)", filename, target, len(data))
+
+    return 0
+
+
+def compile_usage(fd=None):
+    if fd is None:  # Can't use default args for unit testing.
+        fd = sys.stderr
+
+    fd.write("""
+Usage: %(argv0)s compile [options] resource-documents...
+
+Resource documents may be filenames, directories, glob patterns or @listfile.
+
+Compile each resource document into a bundle holding its assemblies in a
+compact binary form. Bundles can be given anywhere a resource document is
+accepted (as a filename, glob pattern or @listfile entry; directories are only
+searched for YAML files), are loaded without parsing YAML, and produce the same
+output as the documents they were compiled from.
+
+Bundles record the assemyaml bundle version and whether local tags were
+recognized; a bundle that doesn't match must be compiled again.
+
+Options:
+    --help
+        Show this usage information.
+
+    --no-local-tag | -l
+        Ignore !Transclude and !Assembly local tags and use global tags only.
+
+    --output <filename> | -o <filename>
+        Write the bundle to filename. Only valid with a single resource
+        document; required when compiling stdin (-).
+
+    --output-dir <directory>
+        Write each bundle to directory under the resource document's base
+        name, with the extension changed to %(extension)s. By default, bundles
+        are written alongside their resource documents.
+""" % {"argv0": basename(sys.argv[0]), "extension": BUNDLE_EXTENSION})
+    fd.flush()
+    return
@@ -0,0 +1,291 @@
+from __future__ import absolute_import, print_function
+from collections import OrderedDict
+from errno import EEXIST, ENOENT
+from hashlib import sha256
+from io import open as io_open
+from json import dumps as json_dumps
+from logging import getLogger
+from os import (
+    close as os_close, fstat, listdir, makedirs, remove, rename, stat, utime,
+)
+from os.path import isdir, join as path_join
+from shutil import copyfileobj
+from stat import S_ISREG
+from tempfile import mkstemp
+from yaml import __version__ as yaml_version
+from .input import open_input
+
+log = getLogger("assemyaml.cache")
+
+# Version of the cache keys and entries. Change it whenever assemyaml's output
+# for the same inputs and options changes, so older entries aren't used.
+CACHE_VERSION = 1
+
+# Default limit on the total size of the entries in a cache directory.
+DEFAULT_CACHE_SIZE = 256 << 20
+
+# Extension of cache entries; anything else in the directory is left alone.
+ENTRY_SUFFIX = ".out"
+
+# Bytes hashed at a time.
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_input(digest, stream):
+    """
+    hash_input(digest, stream)
+
+    Add the length and contents of a memory-mapped or in-memory input (see
+    assemyaml.input.TextInput) to digest, a chunk at a time.
+    """
+    buffer = getattr(stream, "buffer", None)
+    if buffer is None:
+        buffer = stream.text().encode("utf-8")
+
+    size = len(buffer)
+    digest.update(("%d:" % size).encode("ascii"))
+
+    view = memoryview(buffer)
+    for start in range(0, size, HASH_CHUNK_SIZE):
+        digest.update(view[start:start + HASH_CHUNK_SIZE])
+
+    return
+
+
+class CacheWriter(object):
+    """
+    A text file-like object that writes to an output stream and to a new
+    cache entry at the same time. The entry is added to the cache by
+    ResultCache.commit(), or removed by ResultCache.discard().
+    """
+    def __init__(self, output_fd, fd, temp_filename, key):
+        super(CacheWriter, self).__init__()
+        self.output_fd = output_fd
+        self.fd = fd
+        self.temp_filename = temp_filename
+        self.key = key
+        return
+
+    def write(self, text):
+        self.output_fd.write(text)
+        self.fd.write(text)
+        return
+
+    def flush(self):
+        self.output_fd.flush()
+        return
+
+
+class ResultCache(object):
+    """
+    A directory of earlier runs' outputs, keyed by a digest of every input's
+    bytes and the options that affect the output.
+
+    On a hit, the output is copied from the cache without any YAML being
+    parsed. Entries are evicted least recently used first to keep their total
+    size below max_size bytes; a hit counts as a use.
+    """
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        super(ResultCache, self).__init__()
+        self.directory = directory
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        # Runs whose inputs couldn't be hashed (e.g. stdin).
+        self.bypasses = 0
+
+        # Bytes copied from cache entries.
+        self.bytes_copied = 0
+
+        try:
+            makedirs(directory)
+        except OSError as e:
+            if e.errno != EEXIST or not isdir(directory):
+                raise
+
+        return
+
+    def key(self, template_fd, resource_filenames, options):
+        """
+        cache.key(template_fd, resource_filenames, options) -> str | None
+
+        Returns the key for a run with the given template (an open input),
+        resource filenames and options (a JSON-serializable dict), or None
+        if an input can't be read ahead of the run (a stream or named pipe).
+        """
+        digest = sha256()
+        digest.update(json_dumps(
+            [CACHE_VERSION, yaml_version, options], sort_keys=True).encode(
+                "utf-8"))
+
+        if not getattr(template_fd, "mapped", False):
+            self.bypasses += 1
+            return None
+
+        hash_input(digest, template_fd)
+
+        for filename in resource_filenames:
+            if filename == "-" or not S_ISREG(stat(filename).st_mode):
+                self.bypasses += 1
+                return None
+
+            with open_input(filename) as fd:
+                hash_input(digest, fd)
+
+        return digest.hexdigest()
+
+    def entry_filename(self, key):
+        """
+        cache.entry_filename(key) -> str
+
+        Returns the filename of the cache entry for key.
+        """
+        return path_join(self.directory, key + ENTRY_SUFFIX)
+
+    def copy_to(self, key, output_fd):
+        """
+        cache.copy_to(key, output_fd) -> bool
+
+        Copy the cached output for key to output_fd and return True, or
+        return False if there isn't one.
+        """
+        filename = self.entry_filename(key)
+
+        try:
+            fd = io_open(filename, "r", encoding="utf-8", newline="")
+        except (IOError, OSError) as e:
+            if e.errno != ENOENT:
+                log.warning("Unable to read cache entry %s: %s", filename, e)
+            self.misses += 1
+            return False
+
+        with fd:
+            copyfileobj(fd, output_fd)
+            self.bytes_copied += fstat(fd.fileno()).st_size
+
+        # Mark the entry as recently used.
+        try:
+            utime(filename, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        log.debug("Copied output from cache entry %s", filename)
+        return True
+
+    def writer(self, key, output_fd):
+        """
+        cache.writer(key, output_fd) -> CacheWriter
+
+        Returns a file-like object to pass to run() in place of output_fd
+        that also writes a new cache entry for key.
+        """
+        temp_fd, temp_filename = mkstemp(
+            suffix=".tmp", prefix=key + ".", dir=self.directory)
+        try:
+            fd = io_open(temp_fd, "w", encoding="utf-8", newline="")
+        except Exception:
+            os_close(temp_fd)
+            remove(temp_filename)
+            raise
+
+        return CacheWriter(output_fd, fd, temp_filename, key)
+
+    def commit(self, writer):
+        """
+        cache.commit(writer)
+
+        Add the output written to writer to the cache, then evict entries if
+        the cache is over its size.
+        """
+        writer.fd.close()
+        rename(writer.temp_filename, self.entry_filename(writer.key))
+        self.stores += 1
+        self.evict()
+        return
+
+    def discard(self, writer):
+        """
+        cache.discard(writer)
+
+        Remove a partly written entry (e.g. after an error).
+        """
+        writer.fd.close()
+        try:
+            remove(writer.temp_filename)
+        except OSError:
+            pass
+        return
+
+    def evict(self):
+        """
+        cache.evict()
+
+        Remove the least recently used entries until their total size is at
+        most max_size.
+        """
+        entries = []
+        total = 0
+
+        for name in listdir(self.directory):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+
+            filename = path_join(self.directory, name)
+            try:
+                st = stat(filename)
+            except OSError:
+                # Removed by another run.
+                continue
+
+            entries.append((st.st_mtime, name, st.st_size))
+            total += st.st_size
+
+        entries.sort()
+
+        for _, name, size in entries:
+            if total <= self.max_size:
+                break
+
+            try:
+                remove(path_join(self.directory, name))
+            except OSError:
+                continue
+
+            total -= size
+            self.evictions += 1
+            log.debug("Evicted cache entry %s (%d bytes)", name, size)
+
+        return
+
+    def to_dict(self):
+        """
+        cache.to_dict() -> dict
+
+        Return the cache's counters as a JSON-serializable dict.
+        """
+        result = OrderedDict()
+        result["hits"] = self.hits
+        result["misses"] = self.misses
+        result["bypasses"] = self.bypasses
+        result["stores"] = self.stores
+        result["evictions"] = self.evictions
+        result["bytes_copied"] = self.bytes_copied
+        return result
+
+    def format(self):
+        """
+        cache.format() -> str
+
+        Return the cache's counters in a human-readable form, in the same
+        layout as Stats.format().
+        """
+        lines = []
+        for name, value in self.to_dict().items():
+            lines.append("%-22s %10d" % ("cache_" + name, value))
+
+        return "\n".join(lines) + "\n"
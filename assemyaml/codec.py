@@ -0,0 +1,176 @@
+from __future__ import absolute_import, print_function
+from marshal import dumps as marshal_dumps, loads as marshal_loads
+from .walk import flatten_value
+from yaml.error import Mark
+from yaml.nodes import (
+    CollectionNode, MappingNode, ScalarNode, SequenceNode,
+)
+
+# Version of the encoding produced by encode_node(). Decoders reject other
+# versions.
+CODEC_VERSION = 1
+
+# Record kinds.
+_SCALAR = 0
+_SEQUENCE = 1
+_MAPPING = 2
+_REFERENCE = 3
+
+# Estimated memory used by each node (the node object, its attribute
+# dictionary and its start and end marks), in bytes.
+NODE_OVERHEAD = 600
+
+
+def encode_node(node):
+    """
+    encode_node(node) -> bytes
+
+    Encode a node tree in a compact binary (marshal) form that decode_node()
+    turns back into an equal tree. Tags, values, styles and marks (without
+    their source buffers) are kept; nodes that appear more than once (through
+    aliases) are encoded once and shared again when decoded.
+
+    The tree is walked without recursion, so deeply nested nodes are
+    handled.
+    """
+    # Records in pre-order. A collection record is followed by the records
+    # of its children (keys and values alternating for mappings).
+    records = []
+
+    # Source names, stored once each.
+    names = []
+    name_indexes = {}
+
+    # id(node) -> index of its record, for shared nodes.
+    seen = {}
+
+    def encode_mark(mark):
+        if mark is None:
+            return None
+
+        name_index = name_indexes.get(mark.name)
+        if name_index is None:
+            name_index = name_indexes[mark.name] = len(names)
+            names.append(mark.name)
+
+        return (name_index, mark.index, mark.line, mark.column)
+
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        index = seen.get(id(node))
+        if index is not None:
+            records.append((_REFERENCE, index))
+            continue
+
+        seen[id(node)] = len(records)
+        marks = (encode_mark(node.start_mark), encode_mark(node.end_mark))
+
+        if isinstance(node, ScalarNode):
+            records.append((_SCALAR, node.tag, node.value, node.style, marks))
+            continue
+
+        children, _ = flatten_value(node.value)
+        kind = _MAPPING if isinstance(node, MappingNode) else _SEQUENCE
+        records.append((kind, node.tag, len(children), node.flow_style,
+                        marks))
+        stack.extend(reversed(children))
+
+    return marshal_dumps((CODEC_VERSION, tuple(names), tuple(records)))
+
+
+def decode_node(data):
+    """
+    decode_node(data) -> node
+
+    Decode a node tree encoded by encode_node().
+    """
+    version, names, records = marshal_loads(data)
+    if version != CODEC_VERSION:
+        raise ValueError("Unsupported node encoding version %r" % (version,))
+
+    def decode_mark(mark):
+        if mark is None:
+            return None
+
+        name_index, index, line, column = mark
+        return Mark(names[name_index], index, line, column, None, None)
+
+    nodes = []
+
+    # Collections being filled in: [node, children still expected, key
+    # waiting for its value (mappings only)].
+    stack = []
+    root = None
+
+    for record in records:
+        kind = record[0]
+        if kind == _REFERENCE:
+            node = nodes[record[1]]
+            nodes.append(node)
+            opened = False
+        else:
+            start_mark, end_mark = [decode_mark(mark) for mark in record[-1]]
+            if kind == _SCALAR:
+                node = ScalarNode(record[1], record[2], start_mark, end_mark,
+                                  record[3])
+                opened = False
+            else:
+                node_class = MappingNode if kind == _MAPPING else SequenceNode
+                node = node_class(record[1], [], start_mark, end_mark,
+                                  record[3])
+                opened = record[2] > 0
+
+            nodes.append(node)
+
+        if stack:
+            frame = stack[-1]
+            parent = frame[0]
+            if isinstance(parent, MappingNode):
+                if frame[2] is None:
+                    frame[2] = node
+                else:
+                    parent.value.append((frame[2], node))
+                    frame[2] = None
+            else:
+                parent.value.append(node)
+
+            frame[1] -= 1
+        else:
+            root = node
+
+        if opened:
+            stack.append([node, record[2], None])
+
+        # Close the collections that are complete.
+        while stack and stack[-1][1] == 0:
+            stack.pop()
+
+    return root
+
+
+def estimate_size(node):
+    """
+    estimate_size(node) -> int
+
+    Estimate the memory used by a node tree, in bytes: NODE_OVERHEAD per
+    node plus the lengths of scalar values. Shared nodes are counted once.
+    """
+    size = 0
+    seen = set()
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+
+        seen.add(id(node))
+        size += NODE_OVERHEAD
+
+        if isinstance(node, CollectionNode):
+            stack.extend(flatten_value(node.value)[0])
+        else:
+            size += len(node.value)
+
+    return size
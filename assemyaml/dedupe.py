@@ -0,0 +1,179 @@
+from __future__ import absolute_import, print_function
+from hashlib import sha1
+from logging import getLogger
+from .walk import flatten_value
+from yaml.nodes import CollectionNode, MappingNode, ScalarNode
+
+log = getLogger("assemyaml.dedupe")
+
+
+class DuplicateAnchors(object):
+    """
+    Makes identical transcluded subtrees share a single node, so the YAML
+    serializer writes the first occurrence in each document with an anchor
+    and the others as aliases to it.
+
+    Each transclusion is copied from its assembly value, so an assembly
+    transcluded in several places is otherwise written out in full each
+    time. transclude() calls record() with each transcluded value; apply()
+    then compares every subtree within them by a structural digest (node
+    types, tags, values and styles, as types.node_hash) and replaces later
+    duplicates with the first. Subtrees with fewer than min_nodes nodes are
+    left alone.
+    """
+    def __init__(self, min_nodes):
+        super(DuplicateAnchors, self).__init__()
+        self.min_nodes = min_nodes
+
+        # Transcluded values, by id.
+        self.roots = {}
+
+        # Number of subtrees replaced by aliases.
+        self.aliased = 0
+        return
+
+    def record(self, node):
+        """
+        anchors.record(node)
+
+        Record a transcluded value.
+        """
+        self.roots[id(node)] = node
+        return
+
+    def apply(self, documents):
+        """
+        anchors.apply(documents)
+
+        Replace duplicate transcluded subtrees in each document (in place)
+        with the first occurrence in that document.
+        """
+        digests = self.digest_roots()
+
+        for doc in documents:
+            # digest -> first node with that digest in this document.
+            first = {}
+
+            self.share(doc, None, None, id(doc) in self.roots, digests, first)
+            seen = set()
+            stack = [(doc, id(doc) in self.roots)]
+
+            while stack:
+                node, inside = stack.pop()
+                if id(node) in seen or not isinstance(node, CollectionNode):
+                    continue
+                seen.add(id(node))
+
+                mapping = isinstance(node, MappingNode)
+                for index, element in enumerate(node.value):
+                    for position, child in (enumerate(element) if mapping
+                                            else ((None, element),)):
+                        child_inside = inside or id(child) in self.roots
+                        replacement = self.share(
+                            child, node, (index, position), child_inside,
+                            digests, first)
+                        if replacement is None:
+                            stack.append((child, child_inside))
+
+        log.debug("Aliased %d duplicate transcluded subtrees", self.aliased)
+        return
+
+    def share(self, node, parent, slot, inside, digests, first):
+        """
+        anchors.share(node, parent, slot, inside, digests, first)
+            -> node | None
+
+        If node (within a transcluded value) duplicates an earlier subtree,
+        replace it in its parent's value (at slot, an (index, position)
+        pair; position is None for a sequence element) and return the
+        earlier subtree. Otherwise, record it as the first with its digest
+        and return None.
+        """
+        if not inside:
+            return None
+
+        entry = digests.get(id(node))
+        if entry is None or entry[1] is None or entry[2] < self.min_nodes:
+            return None
+
+        existing = first.setdefault(entry[1], node)
+        if existing is node or slot is None:
+            return None
+
+        index, position = slot
+        if position is None:
+            parent.value[index] = existing
+        else:
+            element = list(parent.value[index])
+            element[position] = existing
+            parent.value[index] = tuple(element)
+
+        self.aliased += 1
+        return existing
+
+    def digest_roots(self):
+        """
+        anchors.digest_roots() -> dict
+
+        Compute the structural digest and size (in nodes) of every subtree
+        within the transcluded values. Returns a dict mapping the id of each
+        node to (node, digest, size); the digest is None for a node that
+        contains itself.
+        """
+        digests = {}
+        active = set()
+        stack = [(node, False) for node in self.roots.values()]
+
+        while stack:
+            node, children_done = stack.pop()
+            node_id = id(node)
+
+            if not children_done:
+                if node_id in digests or node_id in active:
+                    continue
+
+                if isinstance(node, ScalarNode):
+                    digests[node_id] = (node, scalar_digest(node), 1)
+                    continue
+
+                active.add(node_id)
+                stack.append((node, True))
+                stack.extend([(child, False) for child in
+                              flatten_value(node.value)[0]])
+                continue
+
+            active.discard(node_id)
+            children = flatten_value(node.value)[0]
+            digest = sha1(("%s%d:%s%d:%s" % (
+                "M" if isinstance(node, MappingNode) else "Q", len(node.tag),
+                node.tag, len(children), node.flow_style)).encode("utf-8"))
+            size = 1
+
+            for child in children:
+                entry = digests.get(id(child))
+                if entry is None or entry[1] is None:
+                    # The child contains (or is) an enclosing node.
+                    digest = None
+                    break
+
+                digest.update(entry[1])
+                size += entry[2]
+
+            if digest is None:
+                digests[node_id] = (node, None, size)
+            else:
+                digests[node_id] = (node, digest.digest(), size)
+
+        return digests
+
+
+def scalar_digest(node):
+    """
+    scalar_digest(node) -> bytes
+
+    Returns the structural digest of a scalar node.
+    """
+    value = node.value
+    return sha1((u"S%d:%s%d:%s%s" % (
+        len(node.tag), node.tag, len(value), value,
+        node.style or u"")).encode("utf-8")).digest()
@@ -0,0 +1,501 @@
+from __future__ import absolute_import, print_function
+from logging import getLogger
+from os.path import basename, join as path_join, normpath
+import sys
+from .index import ASSEMBLY, scan_tags
+from .input import open_input
+from yaml.error import YAMLError
+
+log = getLogger("assemyaml.deps")
+
+# Version of the manifest format written by Manifest.dump().
+MANIFEST_VERSION = 1
+
+
+def scan_names(stream, local_tags=True):
+    """
+    scan_names(stream, local_tags=True) -> (provides, consumes)
+
+    Find the assemblies and transclusions in the YAML documents in stream.
+
+    provides is a dict mapping each assembly name to the set of names
+    transcluded within its values; a template that transcludes the assembly
+    also depends on those names. consumes is the set of all names
+    transcluded anywhere in the documents.
+    """
+    provides = {}
+    consumes = set()
+
+    for kind, name, _, enclosing in scan_tags(stream, local_tags):
+        if kind == ASSEMBLY:
+            provides.setdefault(name, set())
+        else:
+            consumes.add(name)
+            for assembly_name in enclosing:
+                provides.setdefault(assembly_name, set()).add(name)
+
+    return provides, consumes
+
+
+class Manifest(object):
+    """
+    Records which assembly names each resource document provides and which
+    transclusion names each template consumes, so the templates affected by
+    a change can be found without assembling anything.
+
+    templates and resources are lists of (filename, entry) tuples, in the
+    order the files are used. Template entries have a "consumes" list;
+    resource entries have a "provides" dict (assembly name -> list of names
+    transcluded within it) and a "consumes" list.
+    """
+    def __init__(self, local_tags=True):
+        super(Manifest, self).__init__()
+        self.local_tags = local_tags
+        self.templates = []
+        self.resources = []
+        return
+
+    @classmethod
+    def build(cls, template_filenames, resource_filenames, local_tags=True):
+        """
+        Manifest.build(template_filenames, resource_filenames,
+                       local_tags=True) -> Manifest
+
+        Scan the given files and return a manifest for them.
+        """
+        manifest = cls(local_tags)
+        for filename in template_filenames:
+            manifest.templates.append(
+                (normpath(filename), manifest.scan(filename)))
+
+        for filename in resource_filenames:
+            manifest.resources.append(
+                (normpath(filename), manifest.scan(filename)))
+
+        return manifest
+
+    def scan(self, filename):
+        """
+        manifest.scan(filename) -> dict
+
+        Scan filename and return its manifest entry.
+        """
+        fd = open_input(filename)
+        try:
+            provides, consumes = scan_names(fd, self.local_tags)
+        finally:
+            fd.close()
+
+        return {
+            "provides": dict([(name, sorted(names))
+                              for name, names in provides.items()]),
+            "consumes": sorted(consumes),
+        }
+
+    @classmethod
+    def load(cls, fd):
+        """
+        Manifest.load(fd) -> Manifest
+
+        Read a manifest written by dump().
+        """
+        from json import load as json_load
+
+        data = json_load(fd)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError("Unsupported manifest version %r" %
+                             data.get("version"))
+
+        manifest = cls(data["local_tags"])
+        manifest.templates = [
+            (entry["file"], entry) for entry in data["templates"]]
+        manifest.resources = [
+            (entry["file"], entry) for entry in data["resources"]]
+        return manifest
+
+    def dump(self, fd):
+        """
+        manifest.dump(fd)
+
+        Write the manifest to fd as JSON.
+        """
+        from json import dump as json_dump
+
+        def entries(files):
+            result = []
+            for filename, entry in files:
+                entry = dict(entry)
+                entry["file"] = filename
+                result.append(entry)
+            return result
+
+        json_dump({
+            "version": MANIFEST_VERSION,
+            "local_tags": self.local_tags,
+            "templates": entries(self.templates),
+            "resources": entries(self.resources),
+        }, fd, indent=2, sort_keys=True)
+        fd.write("\n")
+        return
+
+    def affected(self, changed_filenames, rescan=True):
+        """
+        manifest.affected(changed_filenames, rescan=True) -> list
+
+        Returns the templates (in manifest order) that must be reassembled
+        because of changes to the given files.
+
+        A template is affected if it changed itself, or if it transcludes
+        (directly or through other assemblies) a name provided by a changed
+        resource. Names are taken from the manifest and, if rescan is true,
+        from the current contents of changed resources (so newly added
+        assemblies are included). Changed resources that no longer exist
+        only contribute the names recorded in the manifest.
+        """
+        changed = set([normpath(filename) for filename in changed_filenames])
+        resources = dict(self.resources)
+        changed_names = set()
+
+        for filename in changed:
+            entry = resources.get(filename)
+            if entry is not None:
+                changed_names.update(entry["provides"])
+
+            if rescan and filename not in dict(self.templates):
+                try:
+                    new_entry = self.scan(filename)
+                except (IOError, OSError):
+                    continue
+
+                changed_names.update(new_entry["provides"])
+
+        # Names that depend on each name through the assemblies providing
+        # it. A change to a name affects everything that (transitively)
+        # transcludes it.
+        dependents = {}
+        for _, entry in self.resources:
+            for name, consumed in entry["provides"].items():
+                for consumed_name in consumed:
+                    dependents.setdefault(consumed_name, set()).add(name)
+
+        pending = list(changed_names)
+        while pending:
+            for name in dependents.get(pending.pop(), ()):
+                if name not in changed_names:
+                    changed_names.add(name)
+                    pending.append(name)
+
+        return [filename for filename, entry in self.templates
+                if filename in changed or
+                changed_names.intersection(entry["consumes"])]
+
+    def update(self, changed_filenames):
+        """
+        manifest.update(changed_filenames)
+
+        Rescan the given files, dropping entries for files that no longer
+        exist. Changed files that aren't in the manifest but do exist are
+        added to the end of the resources, as affected() treats them.
+        """
+        changed = set([normpath(filename) for filename in changed_filenames])
+        known = set()
+
+        for files in (self.templates, self.resources):
+            for i in reversed(range(len(files))):
+                filename = files[i][0]
+                if filename not in changed:
+                    continue
+
+                known.add(filename)
+                try:
+                    files[i] = (filename, self.scan(filename))
+                except (IOError, OSError):
+                    del files[i]
+
+        # Keep the order the files were given in.
+        for filename in changed_filenames:
+            filename = normpath(filename)
+            if filename in known:
+                continue
+
+            known.add(filename)
+            try:
+                self.resources.append((filename, self.scan(filename)))
+            except (IOError, OSError):
+                pass
+
+        return
+
+
+def deps_main(args):
+    """
+    assemyaml deps [options] --template <filename>... resource-documents...
+
+    Write a dependency manifest for the given templates and resources.
+    """
+    from getopt import getopt, GetoptError
+
+    template_filenames = []
+    local_tags = True
+    output_filename = None
+
+    try:
+        opts, resource_filenames = getopt(
+            args, "hlo:t:", ["help", "no-local-tag", "output=", "template="])
+    except GetoptError as e:
+        log.error("%s", e)
+        deps_usage()
+        return 2
+
+    for opt, val in opts:
+        if opt in ("-h", "--help",):
+            deps_usage(sys.stdout)
+            return 0
+        elif opt in ("-l", "--no-local-tag",):
+            local_tags = False
+        elif opt in ("-o", "--output",):
+            output_filename = val
+        elif opt in ("-t", "--template",):
+            template_filenames.append(val)
+
+    if not template_filenames:
+        log.error("Missing template filename")
+        deps_usage()
+        return 2
+
+    manifest = scan_files(template_filenames, resource_filenames, local_tags)
+    if manifest is None:
+        return 1
+
+    return write_manifest(manifest, output_filename)
+
+
+def plan_main(args):
+    """
+    assemyaml plan [options] --manifest <filename> changed-files...
+
+    Print the templates affected by changes to the given files, optionally
+    reassembling them.
+    """
+    from getopt import getopt, GetoptError
+
+    manifest_filename = None
+    output_dir = None
+    update = False
+
+    try:
+        opts, changed_filenames = getopt(
+            args, "hm:", ["help", "manifest=", "output-dir=", "update"])
+    except GetoptError as e:
+        log.error("%s", e)
+        plan_usage()
+        return 2
+
+    for opt, val in opts:
+        if opt in ("-h", "--help",):
+            plan_usage(sys.stdout)
+            return 0
+        elif opt in ("-m", "--manifest",):
+            manifest_filename = val
+        elif opt in ("--output-dir",):
+            output_dir = val
+        elif opt in ("--update",):
+            update = True
+
+    if manifest_filename is None:
+        log.error("Missing manifest filename")
+        plan_usage()
+        return 2
+
+    try:
+        with open(manifest_filename, "r") as fd:
+            manifest = Manifest.load(fd)
+    except IOError as e:
+        log.error("Unable to open %s for reading: %s", manifest_filename, e)
+        return 1
+    except (KeyError, ValueError) as e:
+        log.error("Invalid manifest %s: %s", manifest_filename, e)
+        return 1
+
+    try:
+        affected = manifest.affected(changed_filenames)
+    except YAMLError as e:
+        log.error("While scanning changed files:")
+        log.error("%s", str(e))
+        return 1
+
+    for filename in affected:
+        sys.stdout.write(filename + "\n")
+
+    if output_dir is None and not update:
+        return 0
+
+    # Templates are rebuilt with the current set of resources, so added
+    # resources are included and deleted ones aren't opened.
+    try:
+        manifest.update(changed_filenames)
+    except YAMLError as e:
+        log.error("While scanning changed files:")
+        log.error("%s", str(e))
+        return 1
+
+    if output_dir is not None:
+        templates = dict(manifest.templates)
+        result = rebuild_templates(
+            manifest, [filename for filename in affected
+                       if filename in templates], output_dir)
+        if result != 0:
+            return result
+
+    if update:
+        return write_manifest(manifest, manifest_filename)
+
+    return 0
+
+
+def scan_files(template_filenames, resource_filenames, local_tags):
+    """
+    scan_files(template_filenames, resource_filenames, local_tags)
+        -> Manifest | None
+
+    Build a manifest, logging errors and returning None on failure. Resource
+    arguments may be directories, glob patterns or @listfiles (see
+    assemyaml.discover).
+    """
+    from .discover import discover
+
+    try:
+        return Manifest.build(template_filenames,
+                              discover(resource_filenames), local_tags)
+    except (IOError, OSError) as e:
+        log.error("Unable to open %s for reading: %s", e.filename, e)
+    except YAMLError as e:
+        log.error("While scanning documents:")
+        log.error("%s", str(e))
+
+    return None
+
+
+def write_manifest(manifest, filename):
+    """
+    write_manifest(manifest, filename) -> int
+
+    Write manifest to filename (or stdout if None), returning 0 on success
+    or 1 if an error was logged.
+    """
+    if filename is None:
+        manifest.dump(sys.stdout)
+        return 0
+
+    try:
+        with open(filename, "w") as fd:
+            manifest.dump(fd)
+    except IOError as e:
+        log.error("Unable to open %s for writing: %s", filename, e)
+        return 1
+
+    return 0
+
+
+def rebuild_templates(manifest, templates, output_dir):
+    """
+    rebuild_templates(manifest, templates, output_dir) -> int
+
+    Reassemble the given templates with all of the manifest's resources,
+    writing each to output_dir under its base name. Returns 0 on success or
+    1 if an error was logged.
+    """
+    from . import run
+
+    resource_filenames = [filename for filename, _ in manifest.resources]
+
+    for template_filename in templates:
+        output_filename = path_join(output_dir, basename(template_filename))
+        fds = []
+
+        try:
+            for filename in [template_filename] + resource_filenames:
+                fds.append(open_input(filename))
+        except (IOError, OSError) as e:
+            log.error("Unable to open %s for reading: %s", e.filename, e)
+            return 1
+
+        try:
+            try:
+                output = open(output_filename, "w")
+            except IOError as e:
+                log.error("Unable to open %s for writing: %s",
+                          output_filename, e)
+                return 1
+
+            with output:
+                result = run(fds[0], fds[1:], output, manifest.local_tags)
+        finally:
+            for fd in fds:
+                fd.close()
+
+        if result != 0:
+            return result
+
+    return 0
+
+
+def deps_usage(fd=None):
+    if fd is None:  # Can't use default args for unit testing.
+        fd = sys.stderr
+
+    fd.write("""
+Usage: %(argv0)s deps [options] --template template-document...
+           resource-documents...
+
+Resource documents may be filenames, directories, glob patterns or @listfile.
+
+Write a manifest recording the assembly names each resource document provides
+and the transclusion names each template consumes.
+
+Options:
+    --help
+        Show this usage information.
+
+    --no-local-tag | -l
+        Ignore !Transclude and !Assembly local tags and use global tags only.
+
+    --output <filename> | -o <filename>
+        Write the manifest to filename instead of stdout.
+
+    --template <filename> | -t <filename>
+        Add a template document. May be specified multiple times.
+""" % {"argv0": basename(sys.argv[0])})
+    fd.flush()
+    return
+
+
+def plan_usage(fd=None):
+    if fd is None:  # Can't use default args for unit testing.
+        fd = sys.stderr
+
+    fd.write("""
+Usage: %(argv0)s plan [options] --manifest <filename> changed-files...
+
+Print the templates in a manifest (written by "%(argv0)s deps") that must be
+reassembled because of changes to the given files.
+
+Options:
+    --help
+        Show this usage information.
+
+    --manifest <filename> | -m <filename>
+        The manifest to read.
+
+    --output-dir <directory>
+        Reassemble the affected templates with all of the manifest's resource
+        documents, writing each to directory under its base name. Changed
+        files that aren't in the manifest are added as resource documents,
+        and deleted ones are left out.
+
+    --update
+        Rescan the changed files and rewrite the manifest, adding new files
+        as resource documents and dropping deleted ones.
+""" % {"argv0": basename(sys.argv[0])})
+    fd.flush()
+    return
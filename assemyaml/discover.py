@@ -0,0 +1,351 @@
+from __future__ import absolute_import, print_function
+from glob import glob, has_magic
+from logging import getLogger
+from os import listdir
+from os.path import isdir, join as path_join
+from six.moves.queue import Empty, Full, Queue
+from threading import Event, Thread
+from .input import open_input
+
+try:
+    from os import scandir
+except ImportError:  # pragma: nocover
+    scandir = None
+
+try:
+    from mmap import MADV_WILLNEED
+except ImportError:  # pragma: nocover
+    MADV_WILLNEED = None
+
+log = getLogger("assemyaml.discover")
+
+# Extensions of the files found when a directory is given as an input.
+YAML_EXTENSIONS = (".yaml", ".yml")
+
+# Number of threads used to scan directories.
+DEFAULT_WORKERS = 8
+
+# Number of inputs open_inputs() opens ahead of the one being processed.
+DEFAULT_PREFETCH = 16
+
+# How often (in seconds) blocked threads check whether they should stop.
+_POLL_INTERVAL = 0.1
+
+
+class _Result(object):
+    """
+    The result of scanning a directory, filled in by a worker thread.
+    """
+    def __init__(self):
+        super(_Result, self).__init__()
+        self.done = Event()
+        self.entries = None
+        self.error = None
+        return
+
+    def get(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.entries
+
+
+def scan_directory(path):
+    """
+    scan_directory(path) -> list of (path, is_directory)
+
+    Returns the subdirectories and YAML files (by extension) in a directory,
+    sorted by name. Hidden entries (starting with ".") are skipped, and
+    symbolic links to directories are not followed.
+    """
+    entries = []
+
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.name.startswith("."):
+                continue
+
+            if entry.is_dir(follow_symlinks=False):
+                entries.append((entry.name, entry.path, True))
+            elif entry.name.endswith(YAML_EXTENSIONS):
+                entries.append((entry.name, entry.path, False))
+    else:  # pragma: nocover
+        from os.path import islink
+
+        for name in listdir(path):
+            if name.startswith("."):
+                continue
+
+            entry_path = path_join(path, name)
+            if isdir(entry_path) and not islink(entry_path):
+                entries.append((name, entry_path, True))
+            elif name.endswith(YAML_EXTENSIONS):
+                entries.append((name, entry_path, False))
+
+    entries.sort()
+    return [(entry_path, is_dir) for _, entry_path, is_dir in entries]
+
+
+class Discovery(object):
+    """
+    Expands input arguments into filenames. Each argument may be:
+        @listfile   A file listing one argument per line (directories and
+                    glob patterns are expanded; blank lines and lines
+                    starting with "#" are ignored).
+        A directory, which is searched recursively for YAML files.
+        A glob pattern, expanded in sorted order.
+        Anything else, which is passed through as a filename.
+
+    Directories are scanned in parallel by worker threads, ahead of the
+    filenames being consumed, but filenames are always produced in the same
+    order: arguments in order, and each directory's entries sorted by name
+    with subdirectories expanded in place.
+    """
+    def __init__(self, arguments, workers=DEFAULT_WORKERS):
+        super(Discovery, self).__init__()
+        self.arguments = arguments
+        self.workers = workers
+        self.queue = Queue()
+        self.threads = []
+        return
+
+    def __iter__(self):
+        try:
+            for argument in self.arguments:
+                if argument.startswith("@") and len(argument) > 1:
+                    for line in read_listfile(argument[1:]):
+                        for filename in self.expand(line):
+                            yield filename
+                else:
+                    for filename in self.expand(argument):
+                        yield filename
+        finally:
+            self.close()
+
+    def expand(self, argument):
+        """
+        discovery.expand(argument) -> iterator of filenames
+
+        Expand a directory, glob pattern or filename.
+        """
+        if has_magic(argument):
+            try:
+                matches = glob(argument, recursive=True)
+            except TypeError:  # pragma: nocover
+                # Python 2 doesn't support recursive globs.
+                matches = glob(argument)
+
+            if not matches:
+                # Let opening the pattern as a file report the error, as a
+                # shell would.
+                matches = [argument]
+
+            paths = sorted(matches)
+        else:
+            paths = [argument]
+
+        for path in paths:
+            if isdir(path):
+                for filename in self.walk(path):
+                    yield filename
+            else:
+                yield path
+
+        return
+
+    def walk(self, root):
+        """
+        discovery.walk(root) -> iterator of filenames
+
+        Find the YAML files under root, scanning subdirectories in parallel.
+        """
+        # Scans that have been submitted but not yet walked, by path.
+        results = {}
+
+        # Iterators over the entries of the directories being expanded.
+        stack = [self.listing(root, results)]
+
+        while stack:
+            try:
+                path, is_dir = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                continue
+
+            if is_dir:
+                stack.append(self.listing(path, results))
+            else:
+                yield path
+
+        return
+
+    def listing(self, path, results):
+        """
+        discovery.listing(path, results) -> iterator of (path, is_directory)
+
+        Wait for the scan of a directory (submitting it if it isn't in
+        results) and start scanning its subdirectories before they are
+        reached.
+        """
+        result = results.pop(path, None)
+        if result is None:
+            result = self.submit(path)
+
+        entries = result.get()
+        for entry_path, is_dir in entries:
+            if is_dir:
+                results[entry_path] = self.submit(entry_path)
+
+        return iter(entries)
+
+    def submit(self, path):
+        """
+        discovery.submit(path) -> _Result
+
+        Queue a directory to be scanned by a worker thread.
+        """
+        if not self.threads:
+            for _ in range(self.workers):
+                thread = Thread(target=self.work, name="assemyaml-discover")
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+        result = _Result()
+        self.queue.put((path, result))
+        return result
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            path, result = item
+            try:
+                result.entries = scan_directory(path)
+            except (IOError, OSError) as e:
+                result.error = e
+
+            result.done.set()
+
+    def close(self):
+        """
+        Stop the worker threads.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+
+        self.threads = []
+        return
+
+
+def read_listfile(filename):
+    """
+    read_listfile(filename) -> list of str
+
+    Read the arguments in a list file: one per line, ignoring blank lines
+    and lines starting with "#".
+    """
+    with open(filename, "r") as fd:
+        lines = [line.strip() for line in fd]
+
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def discover(arguments, workers=DEFAULT_WORKERS):
+    """
+    discover(arguments, workers=DEFAULT_WORKERS) -> list of filenames
+
+    Expand input arguments (see Discovery) into a list of filenames.
+    """
+    return list(Discovery(arguments, workers))
+
+
+def open_inputs(filenames, prefetch=DEFAULT_PREFETCH):
+    """
+    open_inputs(filenames, prefetch=DEFAULT_PREFETCH)
+        -> iterator of open inputs
+
+    Open each filename (which may be any iterable, such as a Discovery) with
+    open_input(), in order. A background thread iterates over filenames and
+    opens up to prefetch inputs ahead of the one being processed, asking the
+    OS to start reading them in, so the first input can be parsed while the
+    rest are still being found and read.
+
+    Each input is closed when the next one is requested. An error opening a
+    file (or finding it) is raised when that file's turn comes.
+    """
+    queue = Queue(maxsize=prefetch)
+    stop = Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+
+        if item[0] is not None:
+            item[0].close()
+        return False
+
+    def produce():
+        try:
+            for filename in filenames:
+                fd = open_input(filename)
+                will_need(fd)
+                if not put((fd, None)):
+                    return
+        except Exception as e:
+            # Raised in the consuming thread.
+            put((None, e))
+            return
+
+        put((None, None))
+
+    thread = Thread(target=produce, name="assemyaml-open")
+    thread.daemon = True
+    thread.start()
+
+    fd = None
+    try:
+        while True:
+            fd, error = queue.get()
+            if error is not None:
+                raise error
+            if fd is None:
+                break
+
+            yield fd
+            fd.close()
+            fd = None
+    finally:
+        stop.set()
+        if fd is not None:
+            fd.close()
+
+        # Close anything opened ahead that won't be used.
+        while thread.is_alive() or not queue.empty():
+            try:
+                extra, _ = queue.get(timeout=_POLL_INTERVAL)
+            except Empty:
+                continue
+            if extra is not None:
+                extra.close()
+
+    return
+
+
+def will_need(fd):
+    """
+    will_need(fd)
+
+    Advise the OS that a memory-mapped input will be read soon, if
+    supported.
+    """
+    madvise = getattr(getattr(fd, "buffer", None), "madvise", None)
+    if madvise is not None and MADV_WILLNEED is not None:
+        madvise(MADV_WILLNEED)
+    return
@@ -0,0 +1,126 @@
+from __future__ import absolute_import, print_function
+from yaml.dumper import SafeDumper as yaml_SafeDumper
+from yaml.events import (
+    AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent,
+    SequenceEndEvent, SequenceStartEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+from yaml.serializer import Serializer
+
+
+class IterativeSerializer(Serializer):
+    """
+    Serializer that walks node trees using an explicit stack.
+
+    PyYAML's Serializer recurses once per level of nesting; this emits the
+    same events (and generates the same anchors) without being limited by
+    the interpreter's recursion limit.
+    """
+    # If True, collections are written in flow style regardless of their
+    # flow_style attribute.
+    force_flow_style = False
+
+    def anchor_node(self, node):
+        stack = [node]
+
+        while stack:
+            node = stack.pop()
+
+            if node in self.anchors:
+                if self.anchors[node] is None:
+                    self.anchors[node] = self.generate_anchor(node)
+                continue
+
+            self.anchors[node] = None
+            if isinstance(node, SequenceNode):
+                stack.extend(reversed(node.value))
+            elif isinstance(node, MappingNode):
+                for key, value in reversed(node.value):
+                    stack.append(value)
+                    stack.append(key)
+
+        return
+
+    def serialize_node(self, node, parent, index):
+        # (collection, iterator over its (child, collection, index) triples)
+        # for each open collection.
+        stack = []
+
+        while True:
+            children = self.serialize_node_start(node, parent, index)
+            if children is not None:
+                stack.append((node, children))
+
+            while stack:
+                collection, children = stack[-1]
+                child = next(children, None)
+                if child is not None:
+                    node, parent, index = child
+                    break
+
+                stack.pop()
+                if isinstance(collection, SequenceNode):
+                    self.emit(SequenceEndEvent())
+                else:
+                    self.emit(MappingEndEvent())
+                self.ascend_resolver()
+            else:
+                return
+
+    def serialize_node_start(self, node, parent, index):
+        """
+        serializer.serialize_node_start(node, parent, index) -> iterator | None
+
+        Emit the events for an alias or scalar and return None, or emit the
+        start event of a collection and return an iterator over the
+        (child, collection, index) triples of its children.
+        """
+        alias = self.anchors[node]
+        if node in self.serialized_nodes:
+            self.emit(AliasEvent(alias))
+            return None
+
+        self.serialized_nodes[node] = True
+        self.descend_resolver(parent, index)
+
+        if isinstance(node, ScalarNode):
+            detected_tag = self.resolve(ScalarNode, node.value, (True, False))
+            default_tag = self.resolve(ScalarNode, node.value, (False, True))
+            implicit = (node.tag == detected_tag), (node.tag == default_tag)
+            self.emit(ScalarEvent(alias, node.tag, implicit, node.value,
+                                  style=node.style))
+            self.ascend_resolver()
+            return None
+
+        if isinstance(node, SequenceNode):
+            implicit = (
+                node.tag == self.resolve(SequenceNode, node.value, True))
+            self.emit(SequenceStartEvent(
+                alias, node.tag, implicit,
+                flow_style=self.force_flow_style or node.flow_style))
+            return iter([(item, node, i) for i, item in enumerate(node.value)])
+
+        implicit = (node.tag == self.resolve(MappingNode, node.value, True))
+        self.emit(MappingStartEvent(
+            alias, node.tag, implicit,
+            flow_style=self.force_flow_style or node.flow_style))
+        children = []
+        for key, value in node.value:
+            children.append((key, node, None))
+            children.append((value, node, key))
+
+        # ascend_resolver() is called when the end event is emitted.
+        return iter(children)
+
+
+class SafeDumper(IterativeSerializer, yaml_SafeDumper):
+    """
+    yaml.SafeDumper with an IterativeSerializer.
+    """
+
+
+class FlowDumper(SafeDumper):
+    """
+    SafeDumper that writes all collections in flow style.
+    """
+    force_flow_style = True
@@ -1,4 +1,5 @@
-from yaml import MarkedYAMLError
+from yaml import MarkedYAMLError, YAMLError
+from yaml.composer import ComposerError
 
 
 class TranscludeError(MarkedYAMLError):
@@ -7,3 +8,11 @@ class TranscludeError(MarkedYAMLError):
 
 class AssemblyError(MarkedYAMLError):
     pass
+
+
+class BundleError(YAMLError):
+    pass
+
+
+class AliasExpansionError(ComposerError):
+    pass
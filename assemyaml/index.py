@@ -0,0 +1,487 @@
+from __future__ import absolute_import, print_function
+from logging import getLogger
+from os import stat
+from os.path import basename, normpath
+import sys
+from .error import AssemblyError, TranscludeError
+from .input import open_input
+from .loader import SafeLoader
+from .types import (
+    GLOBAL_ASSEMBLY_TAG, GLOBAL_TRANSCLUDE_TAG, LOCAL_ASSEMBLY_TAG,
+    LOCAL_TRANSCLUDE_TAG,
+)
+from yaml import parse as yaml_parse
+from yaml.error import YAMLError
+from yaml.events import (
+    AliasEvent, CollectionEndEvent, CollectionStartEvent, MappingStartEvent,
+    NodeEvent,
+)
+
+try:
+    # Events only need a parser, so libyaml's can be used when available.
+    from yaml.cyaml import CParser as EventParser
+except ImportError:  # pragma: nocover
+    EventParser = SafeLoader
+
+log = getLogger("assemyaml.index")
+
+# Version of the index format written by NameIndex.dump().
+INDEX_VERSION = 1
+
+ASSEMBLY = "assembly"
+TRANSCLUDE = "transclude"
+
+
+class _Mapping(object):
+    """
+    Per-mapping state kept by scan_tags() while the mapping's events are
+    being read.
+    """
+    __slots__ = ("start_mark", "items", "kind", "name", "line", "error")
+
+    def __init__(self, start_mark):
+        self.start_mark = start_mark
+        self.items = 0
+
+        # The first assembly or transclude key found, as get_assembly() and
+        # get_transclude() would find it.
+        self.kind = None
+        self.name = None
+        self.line = None
+
+        # The error get_assembly()/get_transclude() would raise.
+        self.error = None
+
+
+def scan_tags(stream, local_tags=True):
+    """
+    scan_tags(stream, local_tags=True)
+        -> iterator of (kind, name, line, enclosing assembly names)
+
+    Find the assemblies (kind ASSEMBLY) and transclusions (kind TRANSCLUDE)
+    in the YAML documents in stream from the parser's events (using libyaml's
+    parser if available); no node trees are built. Each is yielded at the end
+    of its mapping, after anything nested within it. line is the 1-based
+    line of the tagged key; enclosing is a tuple of the names of the
+    assemblies whose values contain it.
+
+    Assemblies and transclusions are detected with the same rules as
+    get_assembly() and get_transclude(), including the errors they raise for
+    malformed ones. As those raise when the mapping is reached, a mapping's
+    error is raised after anything found inside it has been yielded.
+    """
+    if local_tags:
+        assembly_tags = (GLOBAL_ASSEMBLY_TAG, LOCAL_ASSEMBLY_TAG)
+        transclude_tags = (GLOBAL_TRANSCLUDE_TAG, LOCAL_TRANSCLUDE_TAG)
+    else:
+        assembly_tags = (GLOBAL_ASSEMBLY_TAG,)
+        transclude_tags = (GLOBAL_TRANSCLUDE_TAG,)
+
+    tags = assembly_tags + transclude_tags
+
+    # One entry per open collection: a _Mapping, or None for sequences.
+    stack = []
+
+    # Anchored nodes with one of our tags: anchor -> (tag, scalar value or
+    # None for collections), so aliases used as keys are detected as well.
+    anchors = {}
+
+    for event in yaml_parse(stream, Loader=EventParser):
+        if not isinstance(event, (NodeEvent, CollectionEndEvent)):
+            continue
+
+        if isinstance(event, CollectionEndEvent):
+            mapping = stack.pop()
+            if mapping is None or mapping.kind is None:
+                continue
+
+            if mapping.items != 2:
+                error_class = (AssemblyError if mapping.kind == ASSEMBLY
+                               else TranscludeError)
+                raise error_class(
+                    None, None, "%s must be a single-entry mapping" %
+                    mapping.kind.capitalize(), mapping.start_mark)
+
+            if mapping.error is not None:
+                raise mapping.error
+
+            yield (mapping.kind, mapping.name, mapping.line,
+                   tuple([m.name for m in stack
+                          if m is not None and m.kind == ASSEMBLY]))
+            continue
+
+        parent = stack[-1] if stack else None
+        if parent is not None:
+            # Keys are checked the way get_assembly() then get_transclude()
+            # would: the first assembly key wins over any transclude key.
+            if parent.items % 2 == 0 and parent.kind != ASSEMBLY:
+                if isinstance(event, AliasEvent):
+                    tag, value = anchors.get(event.anchor, (None, None))
+                else:
+                    tag = event.tag
+                    value = getattr(event, "value", None)
+
+                if tag in assembly_tags:
+                    kind, error_class = ASSEMBLY, AssemblyError
+                elif tag in transclude_tags and parent.kind is None:
+                    kind, error_class = TRANSCLUDE, TranscludeError
+                else:
+                    kind = None
+
+                if kind is not None:
+                    parent.kind = kind
+                    parent.line = event.start_mark.line + 1
+                    if value is not None:
+                        parent.name = value
+                        parent.error = None
+                    else:
+                        parent.name = None
+                        parent.error = error_class(
+                            None, None, "%s name must be a scalar" %
+                            kind.capitalize(), event.start_mark)
+
+            parent.items += 1
+
+        if event.anchor is not None and getattr(event, "tag", None) in tags:
+            anchors[event.anchor] = (event.tag, getattr(event, "value", None))
+
+        if isinstance(event, MappingStartEvent):
+            stack.append(_Mapping(event.start_mark))
+        elif isinstance(event, CollectionStartEvent):
+            stack.append(None)
+
+    return
+
+
+def stat_key(filename):
+    """
+    stat_key(filename) -> [mtime_ns, size]
+
+    Returns the modification time and size of filename, used to decide
+    whether an index entry is still current.
+    """
+    st = stat(filename)
+    mtime_ns = getattr(st, "st_mtime_ns", None)
+    if mtime_ns is None:  # pragma: nocover
+        mtime_ns = int(st.st_mtime * 1e9)
+    return [mtime_ns, st.st_size]
+
+
+class NameIndex(object):
+    """
+    A persistent index of the assembly names each file provides and the
+    transclusion names each file consumes, with their line numbers.
+
+    files is a list of (filename, entry) tuples, in the order the files were
+    given. Each entry has:
+        "stat": [mtime_ns, size] of the file when it was scanned.
+        "provides": [[name, line, [names transcluded within it]], ...]
+        "consumes": [[name, line], ...]
+    """
+    def __init__(self, local_tags=True):
+        super(NameIndex, self).__init__()
+        self.local_tags = local_tags
+        self.files = []
+        return
+
+    @classmethod
+    def build(cls, filenames, local_tags=True, previous=None):
+        """
+        NameIndex.build(filenames, local_tags=True, previous=None)
+            -> NameIndex
+
+        Scan the given files and return an index for them. Entries from
+        previous (an earlier index) are reused for files that have not
+        changed since.
+        """
+        index = cls(local_tags)
+        reusable = {}
+        if previous is not None and previous.local_tags == local_tags:
+            reusable = dict(previous.files)
+
+        for filename in filenames:
+            filename = normpath(filename)
+            entry = reusable.get(filename)
+            if entry is None or entry["stat"] != stat_key(filename):
+                entry = index.scan(filename)
+
+            index.files.append((filename, entry))
+
+        return index
+
+    def scan(self, filename):
+        """
+        index.scan(filename) -> dict
+
+        Scan filename and return its index entry.
+        """
+        key = stat_key(filename)
+        provides = []
+        consumes = []
+
+        # (depth, name) for each transclusion found so far, and (depth,
+        # None) for each assembly. Assemblies are yielded after their
+        # contents, so the transclusions within one are the deeper entries
+        # just before it.
+        found = []
+
+        fd = open_input(filename)
+        try:
+            for kind, name, line, enclosing in scan_tags(fd, self.local_tags):
+                depth = len(enclosing)
+                if kind == TRANSCLUDE:
+                    consumes.append([name, line])
+                    found.append((depth, name))
+                    continue
+
+                within = set()
+                for found_depth, found_name in reversed(found):
+                    if found_depth <= depth:
+                        break
+                    if found_name is not None:
+                        within.add(found_name)
+
+                provides.append([name, line, sorted(within)])
+                found.append((depth, None))
+        finally:
+            fd.close()
+
+        provides.sort(key=lambda entry: entry[1])
+        consumes.sort(key=lambda entry: entry[1])
+        return {"stat": key, "provides": provides, "consumes": consumes}
+
+    def provides(self, name):
+        """
+        index.provides(name) -> list of (filename, line)
+
+        Returns the locations of the assemblies named name.
+        """
+        return [(filename, line) for filename, entry in self.files
+                for assembly, line, _ in entry["provides"]
+                if assembly == name]
+
+    def consumes(self, name):
+        """
+        index.consumes(name) -> list of (filename, line)
+
+        Returns the locations of the transclusions of name.
+        """
+        return [(filename, line) for filename, entry in self.files
+                for transclude, line in entry["consumes"]
+                if transclude == name]
+
+    @classmethod
+    def load(cls, fd):
+        """
+        NameIndex.load(fd) -> NameIndex
+
+        Read an index written by dump().
+        """
+        from json import load as json_load
+
+        data = json_load(fd)
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported index version %r" %
+                             data.get("version"))
+
+        index = cls(data["local_tags"])
+        index.files = [(entry["file"], entry) for entry in data["files"]]
+        return index
+
+    def dump(self, fd):
+        """
+        index.dump(fd)
+
+        Write the index to fd as JSON.
+        """
+        from json import dump as json_dump
+
+        files = []
+        for filename, entry in self.files:
+            entry = dict(entry)
+            entry["file"] = filename
+            files.append(entry)
+
+        json_dump({
+            "version": INDEX_VERSION,
+            "local_tags": self.local_tags,
+            "files": files,
+        }, fd, indent=1, sort_keys=True)
+        fd.write("\n")
+        return
+
+
+def load_index(filename):
+    """
+    load_index(filename) -> NameIndex | None
+
+    Read an index from filename, logging an error and returning None if it
+    can't be read.
+    """
+    try:
+        with open(filename, "r") as fd:
+            return NameIndex.load(fd)
+    except IOError as e:
+        log.error("Unable to open %s for reading: %s", filename, e)
+    except (KeyError, ValueError) as e:
+        log.error("Invalid index %s: %s", filename, e)
+
+    return None
+
+
+def index_main(args):
+    """
+    assemyaml index [options] --output <filename> documents...
+
+    Write (or bring up to date) a name index for the given documents.
+    """
+    from getopt import getopt, GetoptError
+    from os.path import exists
+
+    local_tags = True
+    output_filename = None
+
+    try:
+        opts, filenames = getopt(
+            args, "hlo:", ["help", "no-local-tag", "output="])
+    except GetoptError as e:
+        log.error("%s", e)
+        index_usage()
+        return 2
+
+    for opt, val in opts:
+        if opt in ("-h", "--help",):
+            index_usage(sys.stdout)
+            return 0
+        elif opt in ("-l", "--no-local-tag",):
+            local_tags = False
+        elif opt in ("-o", "--output",):
+            output_filename = val
+
+    if output_filename is None:
+        log.error("Missing output filename")
+        index_usage()
+        return 2
+
+    previous = None
+    if exists(output_filename):
+        previous = load_index(output_filename)
+        if previous is None:
+            return 1
+
+    from .discover import discover
+
+    try:
+        index = NameIndex.build(discover(filenames), local_tags, previous)
+    except (IOError, OSError) as e:
+        log.error("Unable to open %s for reading: %s", e.filename, e)
+        return 1
+    except YAMLError as e:
+        log.error("While scanning documents:")
+        log.error("%s", str(e))
+        return 1
+
+    try:
+        with open(output_filename, "w") as fd:
+            index.dump(fd)
+    except IOError as e:
+        log.error("Unable to open %s for writing: %s", output_filename, e)
+        return 1
+
+    return 0
+
+
+def query_main(args):
+    """
+    assemyaml query [options] --index <filename> provides|consumes names...
+
+    Print the locations of the assemblies or transclusions of the given
+    names.
+    """
+    from getopt import getopt, GetoptError
+
+    index_filename = None
+
+    try:
+        opts, args = getopt(args, "hi:", ["help", "index="])
+    except GetoptError as e:
+        log.error("%s", e)
+        query_usage()
+        return 2
+
+    for opt, val in opts:
+        if opt in ("-h", "--help",):
+            query_usage(sys.stdout)
+            return 0
+        elif opt in ("-i", "--index",):
+            index_filename = val
+
+    if index_filename is None:
+        log.error("Missing index filename")
+        query_usage()
+        return 2
+
+    if not args or args[0] not in ("provides", "consumes"):
+        log.error("Query must be 'provides' or 'consumes'")
+        query_usage()
+        return 2
+
+    index = load_index(index_filename)
+    if index is None:
+        return 1
+
+    lookup = getattr(index, args[0])
+    for name in args[1:]:
+        for filename, line in lookup(name):
+            sys.stdout.write("%s\t%s:%d\n" % (name, filename, line))
+
+    return 0
+
+
+def index_usage(fd=None):
+    if fd is None:  # Can't use default args for unit testing.
+        fd = sys.stderr
+
+    fd.write("""
+Usage: %(argv0)s index [options] --output <filename> documents...
+
+Documents may be filenames, directories, glob patterns or @listfile.
+
+Write an index of the assembly names each document provides and the
+transclusion names each document consumes, with their line numbers. If the
+index already exists, entries for documents that have not changed are reused.
+
+Options:
+    --help
+        Show this usage information.
+
+    --no-local-tag | -l
+        Ignore !Transclude and !Assembly local tags and use global tags only.
+
+    --output <filename> | -o <filename>
+        The index to write.
+""" % {"argv0": basename(sys.argv[0])})
+    fd.flush()
+    return
+
+
+def query_usage(fd=None):
+    if fd is None:  # Can't use default args for unit testing.
+        fd = sys.stderr
+
+    fd.write("""
+Usage: %(argv0)s query [options] --index <filename> provides|consumes names...
+
+Print the location (filename:line) of each assembly (provides) or
+transclusion (consumes) of the given names, using an index written by
+"%(argv0)s index".
+
+Options:
+    --help
+        Show this usage information.
+
+    --index <filename> | -i <filename>
+        The index to read.
+""" % {"argv0": basename(sys.argv[0])})
+    fd.flush()
+    return
@@ -0,0 +1,347 @@
+from __future__ import absolute_import, print_function
+from codecs import (
+    BOM_UTF16_BE, BOM_UTF16_LE, getincrementaldecoder, utf_16_be_decode,
+    utf_16_le_decode, utf_8_decode,
+)
+from mmap import mmap, ACCESS_READ
+from os import fstat, read as os_read
+from stat import S_ISREG
+import sys
+from yaml.reader import ReaderError
+
+# Prefix of the assembly bundles written by assemyaml.bundle. A YAML document
+# can't start with a NUL byte.
+BUNDLE_MAGIC = b"\x00assemyaml-bundle\n"
+
+
+def detect_encoding(header):
+    """
+    detect_encoding(header) -> (encoding, decode function)
+
+    Detect the encoding of a YAML document from its first bytes, using the
+    same rules as PyYAML's Reader: UTF-16 LE or BE if the matching byte order
+    mark is present, otherwise UTF-8.
+    """
+    if header[:2] == BOM_UTF16_LE:
+        return "utf-16-le", utf_16_le_decode
+    elif header[:2] == BOM_UTF16_BE:
+        return "utf-16-be", utf_16_be_decode
+    else:
+        return "utf-8", utf_8_decode
+
+
+def decode_text(data, name):
+    """
+    decode_text(data, name) -> str
+
+    Decode the bytes of a YAML document (any object supporting the buffer
+    protocol). A decoding error is raised as a yaml.reader.ReaderError, as
+    PyYAML would.
+    """
+    encoding, decode = detect_encoding(data[:2])
+    try:
+        return decode(memoryview(data), "strict", True)[0]
+    except UnicodeDecodeError as e:
+        raise ReaderError(name, e.start, e.object[e.start:e.start + 1],
+                          encoding, e.reason)
+
+
+class TextInput(object):
+    """
+    A YAML document whose decoded text is available all at once (for
+    consumers, such as the splicer, that need the whole text).
+
+    They also support read(), returning slices of the text, so they can be
+    passed anywhere a text-mode file object is expected, including to the
+    loader.
+    """
+    # Checked by the loader and by Stats.reader(), which counts size instead
+    # of wrapping read().
+    mapped = True
+
+    def __init__(self, text, name="<input>"):
+        super(TextInput, self).__init__()
+        self.name = self.filename = name
+        self._text = text
+        self.size = len(text) if text is not None else 0
+        self.position = 0
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def text(self):
+        """
+        ti.text() -> str
+
+        Returns the text of the document.
+        """
+        return self._text
+
+    def read(self, size=-1):
+        text = self.text()
+        if size is None or size < 0:
+            end = len(text)
+        else:
+            end = min(self.position + size, len(text))
+
+        result = text[self.position:end]
+        self.position = end
+        return result
+
+    def close(self):
+        return
+
+
+class MappedInput(TextInput):
+    """
+    A YAML document read from a memory-mapped file.
+
+    The encoding is detected once from the byte order mark (see
+    detect_encoding()). The loader reads the mapping through reader(), a
+    chunk at a time; the whole mapping is decoded only if text() is called.
+
+    buffer is the mapping itself (or an empty bytes object for an empty
+    file); other consumers (such as scanners that only need the raw bytes)
+    can use it without reading the file again. size is its length in bytes.
+    """
+    def __init__(self, fd, name=None):
+        if name is None:
+            name = getattr(fd, "name", "<file>")
+
+        super(MappedInput, self).__init__(None, name)
+
+        size = fstat(fd.fileno()).st_size
+        if size == 0:
+            # mmap can't map an empty file.
+            self.buffer = b""
+        else:
+            self.buffer = mmap(fd.fileno(), size, access=ACCESS_READ)
+
+        self.size = size
+        self.encoding = detect_encoding(self.buffer[:2])[0]
+        return
+
+    def text(self):
+        """
+        mi.text() -> str
+
+        Returns the decoded contents of the file.
+        """
+        if self._text is None:
+            self._text = decode_text(self.buffer, self.name)
+
+        return self._text
+
+    def reader(self):
+        """
+        mi.reader() -> StreamInput
+
+        Returns a StreamInput that decodes the mapping a chunk at a time as
+        it is read, for consumers that shouldn't hold the whole decoded text
+        in memory.
+        """
+        return StreamInput(BufferReader(self.buffer), self.name)
+
+    def close(self):
+        self._text = None
+        if not isinstance(self.buffer, bytes):
+            self.buffer.close()
+        return
+
+
+class BufferReader(object):
+    """
+    A binary file-like object reading from a bytes-like buffer (such as a
+    memory mapping) without copying the rest of it.
+    """
+    def __init__(self, buffer):
+        super(BufferReader, self).__init__()
+        self.buffer = buffer
+        self.position = 0
+        return
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self.buffer)
+        else:
+            end = min(self.position + size, len(self.buffer))
+
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+    read1 = read
+
+    def close(self):
+        return
+
+
+class StreamInput(object):
+    """
+    A YAML document read incrementally from a pipe, terminal or other stream
+    that can't be memory-mapped.
+
+    read(size) returns as soon as some text is available instead of waiting
+    for size characters or the end of the stream. The loader then composes
+    each document in a multi-document stream as soon as it has arrived (and
+    the next document has started), so assemyaml can record its assemblies
+    while the producer is still writing the rest.
+
+    The encoding is detected from the first bytes as for MappedInput. The
+    underlying stream is closed by close() only if owned is true.
+    """
+    mapped = False
+
+    def __init__(self, fd, name=None, owned=True):
+        super(StreamInput, self).__init__()
+        if name is None:
+            name = getattr(fd, "name", "<stream>")
+
+        self.name = self.filename = name
+        self.fd = fd
+        self.owned = owned
+        self.encoding = None
+        self.decoder = None
+
+        # Bytes read before the encoding could be detected.
+        self.pending = b""
+
+        # Text decoded but not yet returned by read().
+        self.buffer = ""
+        self.first = True
+
+        read1 = getattr(fd, "read1", None)
+        if read1 is None:
+            # Python 2 files and raw descriptors.
+            fileno = fd.fileno()
+            read1 = lambda size: os_read(fileno, size)  # noqa: E731
+        self.read1 = read1
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(1 << 16)
+                if not chunk:
+                    return "".join(chunks)
+                chunks.append(chunk)
+
+        if not self.buffer:
+            self.buffer = self.read_chunk(size)
+
+            if self.first:
+                # yaml.reader.Reader reads once to detect the encoding and
+                # then reads again before using the first chunk, which would
+                # wait for more input. Return just enough for the detection
+                # the first time so the second read gets the rest.
+                self.first = False
+                text, self.buffer = self.buffer[:2], self.buffer[2:]
+                return text
+
+        text, self.buffer = self.buffer[:size], self.buffer[size:]
+        return text
+
+    def read_chunk(self, size):
+        """
+        si.read_chunk(size) -> str
+
+        Decode and return the text from the next read of up to size bytes,
+        waiting only until some text is available.
+        """
+        while True:
+            data = self.read1(max(size, 1))
+
+            if self.decoder is None:
+                if data and len(self.pending + data) < 2:
+                    self.pending += data
+                    continue
+
+                data = self.pending + data
+                self.pending = b""
+                self.encoding = detect_encoding(data[:2])[0]
+                self.decoder = getincrementaldecoder(self.encoding)("strict")
+
+            # An empty read is the end of the stream.
+            final = not data
+            try:
+                text = self.decoder.decode(data, final)
+            except UnicodeDecodeError as e:
+                raise ReaderError(self.name, e.start,
+                                  e.object[e.start:e.start + 1],
+                                  self.encoding, e.reason)
+
+            # An empty result means end of stream to the reader, so keep
+            # going if only part of a character was read.
+            if text or final:
+                return text
+
+    def close(self):
+        if self.owned:
+            self.fd.close()
+        return
+
+
+def is_bundle(stream):
+    """
+    is_bundle(stream) -> bool
+
+    Returns True if stream is a memory-mapped assembly bundle (see
+    assemyaml.bundle) rather than a YAML document.
+    """
+    return (isinstance(stream, MappedInput) and
+            stream.buffer[:len(BUNDLE_MAGIC)] == BUNDLE_MAGIC)
+
+
+def read_text(stream):
+    """
+    read_text(stream) -> TextInput
+
+    Returns stream if it is already a TextInput (or MappedInput); otherwise,
+    reads the stream and returns its contents as a TextInput.
+    """
+    if getattr(stream, "mapped", False):
+        return stream
+
+    name = getattr(stream, "filename", None)
+    if name is None:
+        name = getattr(stream, "name", "<input>")
+
+    data = stream.read()
+    if isinstance(data, bytes):
+        data = decode_text(data, name)
+
+    return TextInput(data, name)
+
+
+def open_input(filename):
+    """
+    open_input(filename) -> MappedInput | StreamInput
+
+    Open filename for reading as a YAML document. "-" is standard input.
+    Regular files are memory-mapped; anything else (named pipes, devices) is
+    read incrementally.
+    """
+    if filename == "-":
+        stdin = getattr(sys.stdin, "buffer", sys.stdin)
+        return StreamInput(stdin, "<stdin>", owned=False)
+
+    fd = open(filename, "rb")
+    if not S_ISREG(fstat(fd.fileno()).st_mode):
+        return StreamInput(fd, filename)
+
+    with fd:
+        # The mapping stays valid after the file is closed.
+        return MappedInput(fd, filename)
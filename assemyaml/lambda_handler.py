@@ -1,17 +1,187 @@
 from __future__ import absolute_import, print_function
-import boto3
-from boto3.session import Session as Boto3Session
-from botocore.client import Config
-from json import loads as json_loads
+from hashlib import sha256
+from json import dumps as json_dumps, loads as json_loads
 from logging import getLogger
-from six import string_types
+from os.path import splitext
+import sys
 from tempfile import NamedTemporaryFile
+from threading import Lock
 from traceback import format_exc
 from zipfile import ZipFile
 from assemyaml import run
+from assemyaml.input import MappedInput
+from assemyaml.stats import Stats
 
 log = getLogger("assemyaml.lambda")
 
+# NOTE: boto3 and botocore take a large share of the cold-start time, so they
+# are imported only when the first session or client is created.
+
+# Maximum number of pooled HTTP connections per client.
+MAX_POOL_CONNECTIONS = 20
+
+# Object metadata key holding the digest of an output artifact's contents.
+DIGEST_METADATA_KEY = "assemyaml-digest"
+
+# Name of the object, beside an action's output artifacts, that records the
+# digest and key of the most recent one.
+OUTPUT_INDEX_NAME = ".assemyaml-output.json"
+
+
+def client_config(service_name):
+    """
+    client_config(service_name) -> botocore.client.Config
+
+    Returns the client configuration to use for the given service. Clients
+    are long-lived, so connections are pooled and kept alive between calls.
+    """
+    from botocore.client import Config
+
+    kw = {"max_pool_connections": MAX_POOL_CONNECTIONS}
+    if service_name == "s3":
+        kw["signature_version"] = "s3v4"
+
+    try:
+        return Config(tcp_keepalive=True, **kw)
+    except TypeError:  # pragma: no cover
+        # Older versions of botocore don't support TCP keep-alive.
+        return Config(**kw)
+
+
+class BotoClientPool(object):
+    """
+    Cache of Boto3 sessions and clients, keyed by the credentials used to
+    create them.
+
+    Creating a client loads the service model and endpoint data, which costs
+    tens of milliseconds. CodePipeline hands out the same artifact credentials
+    across many jobs, so the pool keeps sessions and clients around (across
+    artifacts and warm Lambda invocations) until the credentials change.
+    """
+    def __init__(self):
+        super(BotoClientPool, self).__init__()
+        self.lock = Lock()
+        self.sessions = {}
+        self.clients = {}
+        return
+
+    @staticmethod
+    def credentials_key(credentials):
+        """
+        BotoClientPool.credentials_key(credentials) -> tuple | None
+
+        Convert CodePipeline artifact credentials into a hashable key. None
+        refers to the default credentials of the Lambda function.
+        """
+        if credentials is None:
+            return None
+
+        return (credentials["accessKeyId"], credentials["secretAccessKey"],
+                credentials["sessionToken"])
+
+    def session(self, credentials=None):
+        """
+        pool.session(credentials=None) -> boto3.session.Session
+
+        Returns a session for the given credentials, creating it if
+        necessary. Sessions (and their clients) for previous non-default
+        credentials are discarded.
+        """
+        from boto3.session import Session as Boto3Session
+
+        key = self.credentials_key(credentials)
+
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None:
+                return session
+
+            if key is None:
+                session = Boto3Session()
+            else:
+                # The credentials have changed; the old ones are of no
+                # further use.
+                for old_key in list(self.sessions):
+                    if old_key is not None:
+                        del self.sessions[old_key]
+
+                for old_key in list(self.clients):
+                    if old_key[0] is not None:
+                        del self.clients[old_key]
+
+                session = Boto3Session(
+                    aws_access_key_id=key[0],
+                    aws_secret_access_key=key[1],
+                    aws_session_token=key[2])
+
+            self.sessions[key] = session
+            return session
+
+    def client(self, service_name, credentials=None):
+        """
+        pool.client(service_name, credentials=None) -> botocore client
+
+        Returns a client for the given service and credentials, creating it
+        if necessary.
+        """
+        key = (self.credentials_key(credentials), service_name)
+        client = self.clients.get(key)
+        if client is not None:
+            return client
+
+        session = self.session(credentials)
+
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = self.clients[key] = session.client(
+                    service_name, config=client_config(service_name))
+
+        return client
+
+    def clear(self):
+        """
+        pool.clear()
+
+        Discard all cached sessions and clients.
+        """
+        with self.lock:
+            self.sessions.clear()
+            self.clients.clear()
+
+        return
+
+
+# Shared by all jobs handled by this process (including warm invocations).
+client_pool = BotoClientPool()
+
+
+def output_digest(filename, content):
+    """
+    output_digest(filename, content) -> str
+
+    Returns the SHA-256 hex digest of an output artifact holding content (a
+    string) as filename. The zip archive itself isn't hashed: it records the
+    time each file was added.
+    """
+    digest = sha256()
+    digest.update(filename.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def output_index_key(key):
+    """
+    output_index_key(key) -> str
+
+    Returns the key of the output index for the output artifact at key.
+    CodePipeline stores an action's output artifacts under the same
+    pipeline/artifact prefix in each execution.
+    """
+    prefix, _, _ = key.rpartition("/")
+    return prefix + "/" + OUTPUT_INDEX_NAME if prefix else OUTPUT_INDEX_NAME
+
 
 def split_artifact_filename(s):
     """
@@ -24,7 +194,7 @@ def split_artifact_filename(s):
 
 
 class InputArtifact(object):
-    def __init__(self, input_artifact, boto_session):
+    def __init__(self, input_artifact, s3):
         super(InputArtifact, self).__init__()
         self.input_artifact = input_artifact
         self.name = input_artifact["name"]
@@ -33,7 +203,7 @@ class InputArtifact(object):
         self.artifact_file = None
         self.zip = None
         self.extracted_files = []
-        self.boto_session = boto_session
+        self.s3 = s3
         return
 
     def __del__(self):
@@ -76,12 +246,9 @@ class InputArtifact(object):
 
         self.artifact_file = NamedTemporaryFile("w+b")
 
-        s3 = self.boto_session.client(
-            "s3", config=Config(signature_version="s3v4"))
-
         try:
-            s3.download_fileobj(Bucket=bucket, Key=key,
-                                Fileobj=self.artifact_file)
+            self.s3.download_fileobj(Bucket=bucket, Key=key,
+                                     Fileobj=self.artifact_file)
         except Exception as e:
             raise RuntimeError(
                 "Unable to download input artifact %r (%s): %s" % (
@@ -92,9 +259,10 @@ class InputArtifact(object):
 
     def get_file(self, filename):
         """
-        ia.get_file(filename) -> fileobj
+        ia.get_file(filename) -> MappedInput
 
-        Returns a temporary file with the contents of filename.
+        Extracts filename to a temporary file and returns a memory-mapped
+        view of it.
         """
         if self.zip is None:
             self.download()
@@ -107,10 +275,12 @@ class InputArtifact(object):
                     break
                 ofd.write(data)
 
-        ofd.seek(0)
-
+        ofd.flush()
         self.extracted_files.append(ofd)
-        return ofd
+
+        doc = MappedInput(ofd)
+        self.extracted_files.append(doc)
+        return doc
 
 
 class CodePipelineJob(object):
@@ -127,12 +297,10 @@ class CodePipelineJob(object):
 
         creds = self.cp_data["artifactCredentials"]
 
-        # Create a Boto3 session using the credentials provided by
-        # CodePipeline, not the Lambda job, for processing artifacts.
-        self.boto_session = Boto3Session(
-            aws_access_key_id=creds["accessKeyId"],
-            aws_secret_access_key=creds["secretAccessKey"],
-            aws_session_token=creds["sessionToken"])
+        # Use the credentials provided by CodePipeline, not the Lambda job,
+        # for processing artifacts. The client is shared by all artifacts in
+        # this job and by later jobs using the same credentials.
+        self.s3 = client_pool.client("s3", creds)
 
         # CodePipeline itself should be called using the default client.
         # We can't run this during unit tests -- Moto doesn't support it yet.
@@ -141,7 +309,7 @@ class CodePipelineJob(object):
         if skip_codepipeline:
             self.codepipeline = None
         else:  # pragma: no cover
-            self.codepipeline = boto3.client("codepipeline")
+            self.codepipeline = client_pool.client("codepipeline")
 
         # Parameters for running the transclusion
         self.default_input_filename = "assemble.yml"
@@ -149,6 +317,7 @@ class CodePipelineJob(object):
         self.resource_document_names = []
         self.local_tags = True
         self.format = "yaml"
+        self.profile_filename = None
 
         # File objects for the template and resources
         self.template_document = None
@@ -157,19 +326,44 @@ class CodePipelineJob(object):
         # Create a named temporary file for the output.
         self.output_temp = NamedTemporaryFile(mode="w+")
 
+        # Timings and counters for this job.
+        self.stats = Stats()
+
+        # Profiler output, if requested.
+        self.profile_temp = None
+
+        # Whether the output artifact was copied from an identical previous
+        # one instead of being uploaded.
+        self.output_reused = False
+
         return
 
     def run(self):
         self.create_input_artifacts()
         self.extract_user_parameters()
-        self.extract_artifacts()
-        self.transclude()
-        self.write_output()
+
+        if self.profile_filename is None:
+            self.extract_artifacts()
+            self.transclude()
+        else:
+            from assemyaml.profile import Profiler
+
+            # The profiler picks its output format from the extension.
+            self.profile_temp = NamedTemporaryFile(
+                mode="w+b", suffix=splitext(self.profile_filename)[1])
+            with Profiler(self.profile_temp.name):
+                self.extract_artifacts()
+                self.transclude()
+
+        with self.stats.phase("upload"):
+            self.write_output()
+
+        self.stats.update_peak_memory()
         return
 
     def create_input_artifacts(self):
         # The input artifacts, in order declared.
-        self.input_artifacts = [InputArtifact(ia, self.boto_session)
+        self.input_artifacts = [InputArtifact(ia, self.s3)
                                 for ia in self.cp_input_artifacts]
 
         # And by name
@@ -179,6 +373,8 @@ class CodePipelineJob(object):
         return
 
     def extract_user_parameters(self):
+        from six import string_types
+
         # Decode the user parameters if specified.
         if self.cp_userparam_str:
             user_parameters = json_loads(self.cp_userparam_str)
@@ -229,6 +425,10 @@ class CodePipelineJob(object):
         self.output_filename = user_parameters.get(
             "OutputFilename", "assemble.yml")
 
+        # If specified, profile the job and add the results to the output
+        # artifact under this name.
+        self.profile_filename = user_parameters.get("ProfileFilename")
+
         # If any input artifacts are untouched, use them as the template or
         # additional resource documents.
         for ia in self.input_artifacts:
@@ -272,7 +472,13 @@ class CodePipelineJob(object):
         ia = self.input_artifacts_by_name[ia_name]
 
         try:
-            doc = ia.get_file(filename)
+            if ia.zip is None:
+                with self.stats.phase("download"):
+                    ia.download()
+
+            with self.stats.phase("extract"):
+                doc = ia.get_file(filename)
+
             doc.filename = doc_name
             return doc
         except Exception as e:
@@ -292,7 +498,8 @@ class CodePipelineJob(object):
 
     def transclude(self):
         result = run(self.template_document, self.resource_documents,
-                     self.output_temp, self.local_tags)
+                     self.output_temp, self.local_tags, self.format,
+                     self.stats)
         if result != 0:
             raise ValueError("Transclusion error -- see above messages for "
                              "details.")
@@ -300,24 +507,130 @@ class CodePipelineJob(object):
         return
 
     def write_output(self):
+        oa = self.cp_output_artifacts[0]
+        s3loc = oa["location"]["s3Location"]
+        bucket = s3loc["bucketName"]
+        key = s3loc["objectKey"]
+
+        self.output_temp.seek(0)
+        content = self.output_temp.read()
+
+        # Profiles differ on every run, so artifacts holding one are always
+        # uploaded.
+        digest = None
+        if self.profile_temp is None:
+            digest = output_digest(self.output_filename, content)
+            if self.copy_previous_output(bucket, key, digest):
+                self.output_reused = True
+                self.write_output_index(bucket, key, digest)
+                return
+
         # Create the output ZipFile
         output_binary = NamedTemporaryFile(mode="w+b")
         output_zip = ZipFile(output_binary, "a")
-        self.output_temp.seek(0)
-        content = self.output_temp.read()
         output_zip.writestr(self.output_filename, content)
+        if self.profile_temp is not None:
+            output_zip.write(self.profile_temp.name, self.profile_filename)
         output_zip.close()
 
         # Write the output artifact
-        oa = self.cp_output_artifacts[0]
-        s3loc = oa["location"]["s3Location"]
-        bucket = s3loc["bucketName"]
-        key = s3loc["objectKey"]
+        kw = {}
+        if digest is not None:
+            kw["Metadata"] = {DIGEST_METADATA_KEY: digest}
+
         output_binary.seek(0)
-        s3 = self.boto_session.client(
-            "s3", config=Config(signature_version="s3v4"))
-        s3.put_object(Body=output_binary, Bucket=bucket, Key=key,
-                      ServerSideEncryption="aws:kms")
+        self.s3.put_object(Body=output_binary, Bucket=bucket, Key=key,
+                           ServerSideEncryption="aws:kms", **kw)
+
+        if digest is not None:
+            self.write_output_index(bucket, key, digest)
+
+        return
+
+    def copy_previous_output(self, bucket, key, digest):
+        """
+        cpj.copy_previous_output(bucket, key, digest) -> bool
+
+        If the output index names a previous output artifact with the same
+        digest, and that object is still there, copy it to key within S3 and
+        return True. Otherwise, return False so the output is uploaded.
+        """
+        from botocore.exceptions import ClientError
+
+        index_key = output_index_key(key)
+
+        try:
+            index = json_loads(self.s3.get_object(
+                Bucket=bucket, Key=index_key)["Body"].read().decode("utf-8"))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in (
+                    "404", "NoSuchKey"):
+                log.warning("Unable to read output index s3://%s/%s: %s",
+                            bucket, index_key, e)
+            return False
+        except ValueError as e:
+            log.warning("Ignoring invalid output index s3://%s/%s: %s",
+                        bucket, index_key, e)
+            return False
+
+        if not isinstance(index, dict) or index.get("digest") != digest:
+            return False
+
+        previous_key = index.get("key")
+
+        try:
+            # The previous artifact may have been removed (e.g. by a
+            # lifecycle rule) or replaced since the index was written.
+            metadata = self.s3.head_object(
+                Bucket=bucket, Key=previous_key).get("Metadata", {})
+            if metadata.get(DIGEST_METADATA_KEY) != digest:
+                return False
+
+            if previous_key != key:
+                self.s3.copy_object(
+                    Bucket=bucket, Key=key,
+                    CopySource={"Bucket": bucket, "Key": previous_key},
+                    MetadataDirective="COPY", ServerSideEncryption="aws:kms")
+        except (ClientError, TypeError, ValueError) as e:
+            log.warning("Unable to copy previous output artifact s3://%s/%s: "
+                        "%s", bucket, previous_key, e)
+            return False
+
+        log.info("Output unchanged; copied s3://%s/%s to s3://%s/%s",
+                 bucket, previous_key, bucket, key)
+        return True
+
+    def write_output_index(self, bucket, key, digest):
+        """
+        cpj.write_output_index(bucket, key, digest)
+
+        Record key as the most recent output artifact, with its digest, for
+        the next execution of this action.
+        """
+        from botocore.exceptions import ClientError
+
+        index_key = output_index_key(key)
+        body = json_dumps({"digest": digest, "key": key}).encode("utf-8")
+
+        try:
+            self.s3.put_object(Body=body, Bucket=bucket, Key=index_key,
+                               ContentType="application/json",
+                               ServerSideEncryption="aws:kms")
+        except ClientError as e:
+            # The next execution will upload its output again.
+            log.warning("Unable to write output index s3://%s/%s: %s",
+                        bucket, index_key, e)
+
+        return
+
+    def log_stats(self):
+        """
+        Write the job statistics to stdout as a single JSON line, suitable for
+        CloudWatch Logs metric filters.
+        """
+        self.stats.update_peak_memory()
+        print(self.stats.to_json())
+        sys.stdout.flush()
         return
 
     def send_success(self):
@@ -355,3 +668,5 @@ def codepipeline_handler(event, context):
         # Notify CodePipeline that we failed.
         log.error("Execution failed:%s", format_exc())
         cpj.send_failure("Unhandled exception: %s" % e)
+    finally:
+        cpj.log_stats()
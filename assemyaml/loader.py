@@ -0,0 +1,212 @@
+from __future__ import absolute_import, print_function
+from .error import AliasExpansionError
+from yaml.composer import Composer, ComposerError
+from yaml.events import (
+    AliasEvent, MappingEndEvent, MappingStartEvent, ScalarEvent,
+    SequenceEndEvent, SequenceStartEvent,
+)
+from yaml.nodes import MappingNode, SequenceNode
+from yaml.loader import SafeLoader as yaml_SafeLoader
+
+# Default limit on the number of nodes aliases may add to a document if they
+# were expanded; see IterativeComposer.
+DEFAULT_MAX_ALIAS_EXPANSION = 1000000
+
+
+class IterativeComposer(Composer):
+    """
+    Composer that builds node trees using an explicit stack.
+
+    PyYAML's Composer recurses once per level of nesting, so it cannot
+    compose documents nested more deeply than the interpreter's recursion
+    limit allows. This produces the same nodes (including anchors, aliases
+    and marks) without that limit.
+
+    Aliases are composed as references to the anchored node, but anything
+    that expands them (JSON output, or a consumer of the output) sees a copy
+    of the node for each reference; a small document can expand
+    exponentially. The composer counts the nodes each alias would add if
+    expanded and raises AliasExpansionError when a document's total exceeds
+    max_alias_expansion (None for no limit).
+    """
+    max_alias_expansion = DEFAULT_MAX_ALIAS_EXPANSION
+
+    def compose_node(self, parent, index):
+        if parent is None:
+            self.start_document()
+
+        # Each entry is [collection node, end event class, pending key].
+        stack = []
+
+        while True:
+            node, opened = self.compose_node_start(parent, index)
+
+            if opened:
+                if isinstance(node, SequenceNode):
+                    stack.append([node, SequenceEndEvent, None])
+                else:
+                    stack.append([node, MappingEndEvent, None])
+                node = None
+
+            # Add completed nodes to their parents, completing any parents
+            # whose end event is next.
+            while stack:
+                frame = stack[-1]
+                collection, end_event_class, pending_key = frame
+
+                if node is not None:
+                    if end_event_class is SequenceEndEvent:
+                        collection.value.append(node)
+                    elif pending_key is None:
+                        frame[2] = node
+                    else:
+                        collection.value.append((pending_key, node))
+                        frame[2] = None
+
+                    node = None
+
+                if frame[2] is not None or not self.check_event(
+                        end_event_class):
+                    break
+
+                end_event = self.get_event()
+                collection.end_mark = end_event.end_mark
+                self.ascend_resolver()
+                stack.pop()
+                node = collection
+
+                anchor_start = self.anchor_starts.pop(id(collection), None)
+                if anchor_start is not None:
+                    anchor, start = anchor_start
+                    self.anchor_sizes[anchor] = self.composed_nodes - start
+
+            if not stack:
+                return node
+
+            # Compose the next child of the innermost open collection.
+            collection, end_event_class, pending_key = stack[-1]
+            parent = collection
+            if end_event_class is SequenceEndEvent:
+                index = len(collection.value)
+            else:
+                index = pending_key
+
+    def start_document(self):
+        """
+        composer.start_document()
+
+        Reset the alias expansion counts at the start of a document. This is
+        done when its root node is composed; call it before composing nodes
+        within a document some other way (see assemyaml.stream).
+        """
+        self.composed_nodes = 0
+        self.alias_nodes = 0
+        self.anchor_sizes = {}
+        self.anchor_starts = {}
+        return
+
+    def compose_node_start(self, parent, index):
+        """
+        composer.compose_node_start(parent, index) -> (node, opened)
+
+        Consume the events for an alias or scalar and return (node, False),
+        or consume the start event of a collection and return
+        (empty collection node, True).
+        """
+        if self.check_event(AliasEvent):
+            event = self.get_event()
+            anchor = event.anchor
+            if anchor not in self.anchors:
+                raise ComposerError(None, None, "found undefined alias %r"
+                                    % anchor, event.start_mark)
+
+            # An alias to a collection still being composed (which contains
+            # itself) counts as one node.
+            size = self.anchor_sizes.get(anchor, 1)
+            self.composed_nodes += size
+            self.alias_nodes += size
+            if (self.max_alias_expansion is not None and  # noqa: E129
+                self.alias_nodes > self.max_alias_expansion):
+                raise AliasExpansionError(
+                    None, None, "Aliases expand the document by more than %d "
+                    "nodes" % self.max_alias_expansion, event.start_mark)
+
+            return self.anchors[anchor], False
+
+        event = self.peek_event()
+        anchor = event.anchor
+        if anchor is not None:
+            if anchor in self.anchors:
+                raise ComposerError(
+                    "found duplicate anchor %r; first occurrence" % anchor,
+                    self.anchors[anchor].start_mark, "second occurrence",
+                    event.start_mark)
+
+        self.descend_resolver(parent, index)
+        self.composed_nodes += 1
+
+        if self.check_event(ScalarEvent):
+            node = self.compose_scalar_node(anchor)
+            self.ascend_resolver()
+            if anchor is not None:
+                self.anchor_sizes[anchor] = 1
+            return node, False
+
+        start_event = self.get_event()
+        tag = start_event.tag
+
+        if isinstance(start_event, SequenceStartEvent):
+            node_class = SequenceNode
+        else:
+            assert isinstance(start_event, MappingStartEvent)
+            node_class = MappingNode
+
+        if tag is None or tag == "!":
+            tag = self.resolve(node_class, None, start_event.implicit)
+
+        node = node_class(tag, [], start_event.start_mark, None,
+                          flow_style=start_event.flow_style)
+        if anchor is not None:
+            self.anchors[anchor] = node
+            self.anchor_starts[id(node)] = (anchor, self.composed_nodes - 1)
+
+        # ascend_resolver() is called when the end event is consumed.
+        return node, True
+
+
+class SafeLoader(IterativeComposer, yaml_SafeLoader):
+    """
+    yaml.SafeLoader with an IterativeComposer.
+    """
+    def __init__(self, stream):
+        # Memory-mapped inputs are decoded a chunk at a time from the mapping
+        # as the Reader needs them. Passing the whole text instead would make
+        # the Reader copy it, and every mark would keep that copy alive.
+        reader = getattr(stream, "reader", None)
+        if reader is not None:
+            stream = reader()
+
+        super(SafeLoader, self).__init__(stream)
+
+
+# SafeLoader subclasses with other alias expansion limits, by limit.
+_loaders = {}
+
+
+def get_loader(max_alias_expansion=DEFAULT_MAX_ALIAS_EXPANSION):
+    """
+    get_loader(max_alias_expansion=DEFAULT_MAX_ALIAS_EXPANSION) -> class
+
+    Returns SafeLoader, or a subclass of it with a different
+    max_alias_expansion (None for no limit).
+    """
+    if max_alias_expansion == SafeLoader.max_alias_expansion:
+        return SafeLoader
+
+    loader = _loaders.get(max_alias_expansion)
+    if loader is None:
+        loader = _loaders[max_alias_expansion] = type(
+            "SafeLoader", (SafeLoader,),
+            {"max_alias_expansion": max_alias_expansion})
+
+    return loader
@@ -0,0 +1,404 @@
+from __future__ import absolute_import, print_function
+from logging import getLogger
+from os.path import basename
+import sys
+from .assemble import merge_nodes
+from .bundle import (
+    check_local_tags, find_nested, read_bundle, record_contributions, replay,
+    write_bundle,
+)
+from .error import BundleError
+from .input import is_bundle
+from .loader import SafeLoader
+from .walk import flatten_value
+from yaml.error import YAMLError
+from yaml.nodes import CollectionNode
+
+log = getLogger("assemyaml.mapreduce")
+
+
+def contains_any(node, targets):
+    """
+    contains_any(node, targets) -> bool
+
+    Returns True if node, or any node within it, has its id in targets.
+    """
+    seen = set()
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+        if id(node) in targets:
+            return True
+
+        if id(node) in seen or not isinstance(node, CollectionNode):
+            continue
+        seen.add(id(node))
+        stack.extend(flatten_value(node.value)[0])
+
+    return False
+
+
+def combine(contributions, stats=None):
+    """
+    combine(contributions, stats=None) -> list
+
+    Merge together, with merge_nodes(), the contributions to each assembly
+    that takes no part in nesting. The merged value takes the place (and
+    mark) of the assembly's first contribution.
+
+    A nested assembly's value is replaced, when it is recorded, by
+    everything merged into that assembly so far, so the contributions to an
+    assembly that is nested anywhere (or whose values hold a nested
+    assembly) are kept separate and in order. Replaying the result records
+    the same assemblies as replaying contributions; since merging is
+    associative, so does combining partial results and then combining
+    again.
+    """
+    values = [value for _, _, value in contributions]
+    nested = find_nested(values)
+    nested_ids = set([id(values[i]) for i in nested])
+
+    # Names whose contributions must stay separate.
+    dependent = set()
+    for i, (name, _, value) in enumerate(contributions):
+        if i in nested or (nested_ids and contains_any(value, nested_ids)):
+            dependent.add(name)
+
+    combined = []
+
+    # Name -> index in combined of its merged value.
+    positions = {}
+
+    for name, mark, value in contributions:
+        if name in dependent:
+            combined.append((name, mark, value))
+            continue
+
+        index = positions.get(name)
+        if index is None:
+            positions[name] = len(combined)
+            combined.append((name, mark, value))
+            continue
+
+        existing = combined[index][2]
+        merged = merge_nodes(existing, value, stats)
+        if merged is not existing and merged is not value:
+            # Later errors point to where the merged value begins.
+            merged.start_mark = existing.start_mark
+            merged.end_mark = value.end_mark
+
+        combined[index] = (name, combined[index][1], merged)
+
+    return combined
+
+
+def read_partial(stream, local_tags=True, loader=SafeLoader):
+    """
+    read_partial(stream, local_tags=True, loader=SafeLoader)
+        -> (contributions, documents)
+
+    Read the assembly contributions from a bundle (including a partial
+    assembly file) or from resource documents.
+    """
+    if not is_bundle(stream):
+        return record_contributions(stream, local_tags, loader)
+
+    name = getattr(stream, "filename", "<bundle>")
+    bundle_local_tags, documents, contributions, _ = read_bundle(
+        stream.buffer, name)
+    check_local_tags(name, bundle_local_tags, local_tags)
+    return list(contributions), documents
+
+
+def map_resources(streams, local_tags=True, loader=SafeLoader):
+    """
+    map_resources(streams, local_tags=True, loader=SafeLoader) -> bytes
+
+    Assemble a subset of the resource documents (or bundles) of a build and
+    return a partial assembly file: a bundle holding their contributions,
+    in order, combined as far as possible (see combine()).
+
+    Partial assembly files are merged by reduce_partials(), or can be given
+    anywhere a bundle is accepted. Given in the order of their resources,
+    they record the same assemblies as the resources themselves.
+    """
+    contributions = []
+    documents = 0
+
+    for stream in streams:
+        stream_contributions, stream_documents = read_partial(
+            stream, local_tags, loader)
+        contributions.extend(stream_contributions)
+        documents += stream_documents
+
+    return write_bundle(combine(contributions), local_tags, documents)
+
+
+def reduce_partials(streams, local_tags=True):
+    """
+    reduce_partials(streams, local_tags=True) -> (contributions, documents)
+
+    Merge partial assembly files, in order. Merging is associative: partial
+    files of partial files give the same result. Merge errors (duplicate
+    mapping keys, or values of different types) are raised as merge_nodes()
+    raises them.
+    """
+    contributions = []
+    documents = 0
+
+    for stream in streams:
+        if not is_bundle(stream):
+            raise BundleError(
+                "%s is not a partial assembly file" %
+                getattr(stream, "filename", "<input>"))
+
+        stream_contributions, stream_documents = read_partial(
+            stream, local_tags)
+        contributions.extend(stream_contributions)
+        documents += stream_documents
+
+    return combine(contributions), documents
+
+
+def map_main(args):
+    """
+    assemyaml map [options] --output partial-file resource-documents...
+
+    Write a partial assembly file for a subset of the resource documents.
+    """
+    from getopt import getopt, GetoptError
+    from .discover import discover, open_inputs
+
+    local_tags = True
+    output_filename = None
+
+    try:
+        opts, arguments = getopt(args, "hlo:",
+                                 ["help", "no-local-tag", "output="])
+    except GetoptError as e:
+        log.error("%s", e)
+        map_usage()
+        return 2
+
+    for opt, val in opts:
+        if opt in ("-h", "--help",):
+            map_usage(sys.stdout)
+            return 0
+        elif opt in ("-l", "--no-local-tag",):
+            local_tags = False
+        elif opt in ("-o", "--output",):
+            output_filename = val
+
+    if output_filename is None:
+        log.error("Missing --output filename")
+        map_usage()
+        return 2
+
+    try:
+        filenames = discover(arguments)
+    except (IOError, OSError) as e:
+        log.error("Unable to read %s: %s", e.filename, e)
+        return 1
+
+    if not filenames:
+        log.error("Missing resource filename")
+        map_usage()
+        return 2
+
+    fds = open_inputs(filenames)
+    try:
+        data = map_resources(fds, local_tags)
+    except (IOError, OSError) as e:
+        log.error("Unable to open %s for reading: %s", e.filename, e)
+        return 1
+    except YAMLError as e:
+        log.error("While assembling resource documents:")
+        log.error("%s", str(e))
+        return 1
+    finally:
+        fds.close()
+
+    try:
+        with open(output_filename, "wb") as fd:
+            fd.write(data)
+    except (IOError, OSError) as e:
+        log.error("Unable to open %s for writing: %s", output_filename, e)
+        return 1
+
+    log.debug("Mapped %d resource documents to %s (%d bytes)",
+              len(filenames), output_filename, len(data))
+    return 0
+
+
+def reduce_main(args):
+    """
+    assemyaml reduce [options] template-document partial-files...
+    assemyaml reduce [options] --partial partial-file partial-files...
+
+    Merge partial assembly files and transclude the result into a template,
+    or write it as another partial assembly file.
+    """
+    from getopt import getopt, GetoptError
+    from .discover import Discovery, open_inputs
+    from .input import open_input
+    from . import run
+
+    format = "yaml"
+    local_tags = True
+    output_filename = None
+    partial_filename = None
+
+    try:
+        opts, filenames = getopt(
+            args, "f:hlo:", ["format=", "help", "no-local-tag", "output=",
+                             "partial="])
+    except GetoptError as e:
+        log.error("%s", e)
+        reduce_usage()
+        return 2
+
+    for opt, val in opts:
+        if opt in ("-f", "--format",):
+            if val not in ("json", "yaml",):
+                log.error("Invalid output format '%s': valid types are 'json' "
+                          "and 'yaml'", val)
+                reduce_usage()
+                return 2
+            format = val
+        elif opt in ("-h", "--help",):
+            reduce_usage(sys.stdout)
+            return 0
+        elif opt in ("-l", "--no-local-tag",):
+            local_tags = False
+        elif opt in ("-o", "--output",):
+            output_filename = val
+        elif opt in ("--partial",):
+            partial_filename = val
+
+    if partial_filename is None:
+        if not filenames:
+            log.error("Missing template filename")
+            reduce_usage()
+            return 2
+
+        template_filename = filenames[0]
+        filenames = filenames[1:]
+
+    fds = open_inputs(Discovery(filenames))
+    try:
+        contributions, documents = reduce_partials(fds, local_tags)
+    except (IOError, OSError) as e:
+        log.error("Unable to open %s for reading: %s", e.filename, e)
+        return 1
+    except YAMLError as e:
+        log.error("While merging partial assembly files:")
+        log.error("%s", str(e))
+        return 1
+    finally:
+        fds.close()
+
+    if partial_filename is not None:
+        try:
+            with open(partial_filename, "wb") as fd:
+                fd.write(write_bundle(contributions, local_tags, documents))
+        except (IOError, OSError) as e:
+            log.error("Unable to open %s for writing: %s", partial_filename,
+                      e)
+            return 1
+
+        return 0
+
+    values = [value for _, _, value in contributions]
+    assemblies = {}
+    replay(contributions, set([id(values[i]) for i in find_nested(values)]),
+           assemblies)
+
+    try:
+        template_fd = open_input(template_filename)
+    except IOError as e:
+        log.error("Unable to open %s for reading: %s", template_filename, e)
+        return 1
+
+    output = sys.stdout
+    if output_filename is not None:
+        try:
+            output = open(output_filename, "w")
+        except IOError as e:
+            log.error("Unable to open %s for writing: %s", output_filename, e)
+            template_fd.close()
+            return 1
+
+    result = run(template_fd, [], output, local_tags, format,
+                 assemblies=assemblies)
+
+    template_fd.close()
+    if output is not sys.stdout:
+        output.close()
+
+    return result
+
+
+def map_usage(fd=None):
+    if fd is None:  # Can't use default args for unit testing.
+        fd = sys.stderr
+
+    fd.write("""
+Usage: %(argv0)s map [options] --output <partial-file> resource-documents...
+
+Resource documents may be filenames, directories, glob patterns or @listfile;
+compiled bundles are also accepted.
+
+Assemble a subset of a build's resource documents (e.g. one CI shard's) into a
+partial assembly file, recording each assembly's contributions in order.
+Combine partial assembly files with "%(argv0)s reduce", in the order of their
+resource documents, or give them anywhere a bundle is accepted.
+
+Options:
+    --help
+        Show this usage information.
+
+    --no-local-tag | -l
+        Ignore !Transclude and !Assembly local tags and use global tags only.
+
+    --output <filename> | -o <filename>
+        Write the partial assembly file to filename (required).
+""" % {"argv0": basename(sys.argv[0])})
+    fd.flush()
+    return
+
+
+def reduce_usage(fd=None):
+    if fd is None:  # Can't use default args for unit testing.
+        fd = sys.stderr
+
+    fd.write("""
+Usage: %(argv0)s reduce [options] template-document partial-files...
+       %(argv0)s reduce [options] --partial <filename> partial-files...
+
+Merge partial assembly files written by "%(argv0)s map", in the order given,
+and transclude the result into the template. Merging is associative, so
+partial files may themselves be merged in stages with --partial. Duplicate
+mapping keys and values of different types are reported as they would be if
+every resource document were given to one run.
+
+Options:
+    --format json|yaml | -f json|yaml
+        Write output in this format.
+
+    --help
+        Show this usage information.
+
+    --no-local-tag | -l
+        Ignore !Transclude and !Assembly local tags and use global tags only.
+        Partial files must have been written with the same setting.
+
+    --output <filename> | -o <filename>
+        Write output to filename instead of stdout.
+
+    --partial <filename>
+        Write the merged partial files to filename as another partial
+        assembly file instead of transcluding a template.
+""" % {"argv0": basename(sys.argv[0])})
+    fd.flush()
+    return
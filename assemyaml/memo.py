@@ -0,0 +1,145 @@
+from __future__ import absolute_import, print_function
+from collections import OrderedDict
+from threading import Lock
+from weakref import WeakKeyDictionary
+from .assemble import merge_nodes
+from .types import copy_node, node_hash
+
+# Default maximum number of merged nodes kept by a TranscludeMemo.
+DEFAULT_MEMO_SIZE = 256
+
+
+class TranscludeMemo(object):
+    """
+    Bounded table of merged transclusion values, keyed by the structural
+    hashes (see types.node_hash) of the local default value and the
+    assembly value.
+
+    The same assembly is often transcluded with the same default value into
+    many documents and templates; the memo lets transclude() skip the merge
+    (and its duplicate key checks) for every occurrence after the first. A
+    single memo may be shared by any number of runs, including concurrent
+    ones.
+
+    The least recently used entry is discarded when the memo is full.
+    Merges that fail are not memoized, so errors are reported exactly as
+    they would be without the memo.
+    """
+    def __init__(self, max_size=DEFAULT_MEMO_SIZE):
+        super(TranscludeMemo, self).__init__()
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        # Digests of assembly values. These are never modified once
+        # recorded, so their digests can be reused.
+        self.assembly_digests = WeakKeyDictionary()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    def __getstate__(self):
+        # Locks and weak references can't be pickled (e.g. when the memo is
+        # passed to a process pool).
+        state = self.__dict__.copy()
+        del state["lock"]
+        del state["assembly_digests"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+        self.assembly_digests = WeakKeyDictionary()
+        return
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of lookups that were hits (0.0 if there were none).
+        """
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def merge(self, default, assembly, stats=None):
+        """
+        memo.merge(default, assembly, stats=None) -> node
+
+        Returns the result of merge_nodes(default, assembly), reusing a
+        previous result for structurally identical values if one is
+        available. The returned node must not be modified.
+        """
+        assembly_digest = self.assembly_digests.get(assembly)
+        if assembly_digest is None:
+            assembly_digest = self.assembly_digests[assembly] = (
+                node_hash(assembly))
+
+        key = (node_hash(default), assembly_digest)
+
+        with self.lock:
+            merged = self.entries.pop(key, None)
+            if merged is not None:
+                # Move the entry to the most recently used end.
+                self.entries[key] = merged
+                self.hits += 1
+                return merged
+
+            self.misses += 1
+
+        # Copy the result so later changes to the documents it came from
+        # (e.g. through aliases) don't affect the memo.
+        merged = copy_node(merge_nodes(default, assembly, stats))
+
+        with self.lock:
+            self.entries[key] = merged
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        return merged
+
+    def clear(self):
+        """
+        Discard all entries. The counters are not reset.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.assembly_digests = WeakKeyDictionary()
+
+        return
+
+    def to_dict(self):
+        """
+        memo.to_dict() -> dict
+
+        Return the memo's size and counters as a JSON-serializable dict.
+        """
+        result = OrderedDict()
+        result["size"] = len(self.entries)
+        result["max_size"] = self.max_size
+        result["hits"] = self.hits
+        result["misses"] = self.misses
+        result["evictions"] = self.evictions
+        result["hit_rate"] = round(self.hit_rate, 4)
+        return result
+
+    def format(self):
+        """
+        memo.format() -> str
+
+        Return the memo's size and counters in a human-readable form, in the
+        same layout as Stats.format().
+        """
+        lines = []
+        for name, value in self.to_dict().items():
+            name = "memo_" + name
+            if isinstance(value, float):
+                lines.append("%-22s %10.1f %%" % (name, value * 100.0))
+            else:
+                lines.append("%-22s %10d" % (name, value))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,164 @@
+from __future__ import absolute_import, print_function
+from errno import ENOENT
+from hashlib import sha256
+from io import BufferedWriter, FileIO, RawIOBase, TextIOWrapper
+from logging import getLogger
+from os import chmod, remove, rename, stat, umask
+from os.path import basename, dirname, realpath
+from stat import S_IMODE, S_ISREG
+from tempfile import mkstemp
+
+try:
+    from os import replace
+except ImportError:  # pragma: nocover
+    # Python 2: rename() replaces an existing file on POSIX systems.
+    replace = rename
+
+log = getLogger("assemyaml.output")
+
+# Bytes read at a time when hashing an existing file.
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(filename):
+    """
+    file_digest(filename) -> str | None
+
+    Returns the SHA-256 hex digest of a regular file's contents, or None if
+    it doesn't exist or isn't a regular file.
+    """
+    try:
+        if not S_ISREG(stat(filename).st_mode):
+            return None
+
+        digest = sha256()
+        with open(filename, "rb") as fd:
+            while True:
+                chunk = fd.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    except (IOError, OSError) as e:
+        if e.errno != ENOENT:
+            raise
+        return None
+
+    return digest.hexdigest()
+
+
+class DigestWriter(RawIOBase):
+    """
+    A raw binary stream that adds the bytes written to a file to a digest.
+    """
+    def __init__(self, raw, digest):
+        super(DigestWriter, self).__init__()
+        self.raw = raw
+        self.digest = digest
+        return
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        written = self.raw.write(data)
+        self.digest.update(memoryview(data)[:written])
+        return written
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super(DigestWriter, self).close()
+        return
+
+
+class ReplaceOutput(object):
+    """
+    A text output file that is written to a temporary file beside filename
+    and renamed over it by commit(), so filename always holds either the
+    previous output or the whole new one. The new output's SHA-256 digest is
+    computed as it is written.
+
+    If if_changed is True, commit() leaves filename alone (including its
+    modification time) when it already holds the same bytes, so tools that
+    compare timestamps don't rebuild anything that depends on it.
+
+    Text is encoded and newlines translated as open(filename, "w") would.
+    """
+    def __init__(self, filename, if_changed=True):
+        super(ReplaceOutput, self).__init__()
+        self.filename = filename
+        self.if_changed = if_changed
+
+        # Replace the file a symbolic link points to, not the link.
+        self.target = realpath(filename)
+        self.digest = sha256()
+
+        temp_fd, self.temp_filename = mkstemp(
+            prefix="." + basename(self.target) + ".", suffix=".tmp",
+            dir=dirname(self.target))
+        self.fd = TextIOWrapper(BufferedWriter(
+            DigestWriter(FileIO(temp_fd, "w"), self.digest)))
+        return
+
+    def write(self, text):
+        self.fd.write(text)
+        return
+
+    def flush(self):
+        self.fd.flush()
+        return
+
+    def hexdigest(self):
+        """
+        ro.hexdigest() -> str
+
+        Returns the SHA-256 hex digest of the output written so far.
+        """
+        if not self.fd.closed:
+            self.fd.flush()
+        return self.digest.hexdigest()
+
+    def commit(self):
+        """
+        ro.commit() -> bool
+
+        Finish writing the output and move it into place. Returns False if
+        if_changed is True and filename already held the same output (which
+        is left untouched), or True if filename was replaced.
+        """
+        self.fd.close()
+        digest = self.digest.hexdigest()
+
+        if self.if_changed and file_digest(self.target) == digest:
+            remove(self.temp_filename)
+            log.debug("Output to %s is unchanged", self.filename)
+            return False
+
+        # mkstemp creates the file readable only by its owner; give it the
+        # permissions open() would have.
+        try:
+            mode = S_IMODE(stat(self.target).st_mode)
+        except OSError as e:
+            if e.errno != ENOENT:
+                raise
+            mask = umask(0)
+            umask(mask)
+            mode = 0o666 & ~mask
+
+        chmod(self.temp_filename, mode)
+        replace(self.temp_filename, self.target)
+        return True
+
+    def discard(self):
+        """
+        ro.discard()
+
+        Remove the new output (e.g. after an error), leaving filename as it
+        was.
+        """
+        self.fd.close()
+        try:
+            remove(self.temp_filename)
+        except OSError:
+            pass
+        return
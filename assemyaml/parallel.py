@@ -0,0 +1,242 @@
+from __future__ import absolute_import, print_function
+from logging import getLogger
+from six.moves import cStringIO as StringIO
+from .codec import decode_node, encode_node
+from .dumper import SafeDumper
+from .loader import SafeLoader
+from .spill import SpillOverlay
+from .trace import get_trace
+from .transclude import transclude_document as transclude_tree
+from yaml import compose_all
+
+log = getLogger("assemyaml.parallel")
+
+# State of a worker process, set by _init_worker().
+_worker = {}
+
+
+class EncodedTable(object):
+    """
+    A read-only assembly table holding values in the encoding of
+    assemyaml.codec.encode_node(); each value is decoded the first time it is
+    looked up. copy() returns a view for a single document's assemblies, as
+    with dicts.
+    """
+    def __init__(self, encoded):
+        super(EncodedTable, self).__init__()
+        self.encoded = encoded
+        self.decoded = {}
+        return
+
+    def __contains__(self, name):
+        return name in self.encoded
+
+    def __getitem__(self, name):
+        node = self.decoded.get(name)
+        if node is None:
+            node = self.decoded[name] = decode_node(self.encoded[name])
+        return node
+
+    def get(self, name, default=None):
+        if name not in self.encoded:
+            return default
+        return self[name]
+
+    def copy(self):
+        return SpillOverlay(self)
+
+
+class _RecordingTrace(object):
+    """
+    Collects trace events in a worker process to be recorded again, in
+    document order, in the parent's trace.
+    """
+    def __init__(self):
+        super(_RecordingTrace, self).__init__()
+        self.events = []
+        return
+
+    def record(self, event, name, mark, action):
+        self.events.append((event, name, mark, action))
+        return
+
+
+def _init_worker(encoded_assemblies, local_tags, memo_size,
+                 anchor_duplicates):
+    """
+    Set up a worker process with the assembly table shared by every document.
+    """
+    memo = None
+    if memo_size is not None:
+        from .memo import TranscludeMemo
+        memo = TranscludeMemo(memo_size)
+
+    _worker.update(assemblies=EncodedTable(encoded_assemblies),
+                   local_tags=local_tags, memo=memo,
+                   anchor_duplicates=anchor_duplicates)
+    return
+
+
+def _process_document(encoded_doc, first, with_stats, with_trace):
+    """
+    _process_document(encoded_doc, first, with_stats, with_trace)
+        -> (text, open_ended, stats, trace events)
+
+    Assemble, transclude and serialize a single template document in a
+    worker process.
+    """
+    stats = None
+    if with_stats:
+        from .stats import Stats
+        stats = Stats()
+
+    trace = _RecordingTrace() if with_trace else None
+    doc = decode_node(encoded_doc)
+    text, open_ended = transclude_document(
+        doc, _worker["assemblies"], _worker["local_tags"], first, stats,
+        trace, _worker["memo"], _worker["anchor_duplicates"])
+
+    if stats is not None:
+        stats.update_peak_memory()
+
+    return text, open_ended, stats, trace.events if with_trace else None
+
+
+def transclude_document(doc, assemblies, local_tags, first, stats=None,
+                        trace=None, memo=None, anchor_duplicates=None):
+    """
+    transclude_document(doc, assemblies, local_tags, first, stats=None,
+                        trace=None, memo=None, anchor_duplicates=None)
+        -> (text, open_ended)
+
+    Assemble and transclude a single template document as
+    transclude_template() does, and serialize it as write_output() would
+    within a stream of documents (first indicates whether it is the first).
+
+    The emitter ends a stream with "..." if the last document is open-ended
+    (e.g. it ends with a block scalar keeping its trailing line breaks);
+    open_ended reports whether this one is.
+    """
+    anchors = None
+    if anchor_duplicates is not None:
+        from .dedupe import DuplicateAnchors
+        anchors = DuplicateAnchors(anchor_duplicates)
+
+    doc = transclude_tree(doc, assemblies, local_tags, stats, trace, memo,
+                          anchors)
+
+    if stats is None:
+        return serialize_document(doc, first, anchors)
+
+    with stats.phase("serialize"):
+        return serialize_document(doc, first, anchors)
+
+
+def serialize_document(doc, first, anchors=None):
+    """
+    serialize_document(doc, first, anchors=None) -> (text, open_ended)
+
+    Serialize a transcluded document as part of a stream.
+    """
+    if anchors is not None:
+        anchors.apply([doc])
+
+    output = StringIO()
+
+    # Every document after the first starts with "---", as it does when
+    # the documents are serialized together.
+    dumper = SafeDumper(output, explicit_start=not first)
+    try:
+        dumper.open()
+        dumper.serialize(doc)
+        open_ended = dumper.open_ended
+    finally:
+        dumper.dispose()
+
+    return output.getvalue(), open_ended
+
+
+def transclude_parallel(stream, assemblies, local_tags, jobs, stats=None,
+                        trace=None, memo=None, loader=SafeLoader,
+                        anchor_duplicates=None):
+    """
+    transclude_parallel(stream, assemblies, local_tags, jobs, stats=None,
+                        trace=None, memo=None, loader=SafeLoader,
+                        anchor_duplicates=None) -> str
+
+    Transclude the documents of a template in a pool of jobs worker
+    processes and return the serialized (YAML) output, which is identical
+    to that of transclude_template() and write_output().
+
+    Documents are composed here and sent to the workers in the encoding of
+    assemyaml.codec; each worker receives the assembly table once. Trace
+    events and stats are gathered from the workers in document order. Each
+    worker keeps its own memo (of memo's size), if memo is specified.
+
+    If a document fails in a worker, it and the documents after it are
+    processed in this process instead. An error in the document is raised
+    with its full source context; other failures (e.g. a worker process
+    that died) don't stop the output from being produced.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    trace = get_trace(trace)
+
+    if stats is None:
+        docs = list(compose_all(stream, Loader=loader))
+    else:
+        docs = list(stats.timed_iter(
+            compose_all(stats.reader(stream), Loader=loader), "parse"))
+
+    if not docs:
+        return ""
+
+    encoded_assemblies = dict(
+        [(name, encode_node(value)) for name, value in assemblies.items()])
+
+    executor = ProcessPoolExecutor(
+        max_workers=min(jobs, len(docs)), initializer=_init_worker,
+        initargs=(encoded_assemblies, local_tags,
+                  memo.max_size if memo is not None else None,
+                  anchor_duplicates))
+
+    pieces = []
+    open_ended = False
+
+    with executor:
+        futures = [
+            executor.submit(_process_document, encode_node(doc), i == 0,
+                            stats is not None, trace is not None)
+            for i, doc in enumerate(docs)]
+
+        for i, future in enumerate(futures):
+            try:
+                text, open_ended, doc_stats, events = future.result()
+            except Exception as e:
+                for remaining in futures[i + 1:]:
+                    remaining.cancel()
+
+                log.debug("Document %d failed in a worker (%s); processing "
+                          "the remaining documents in this process", i + 1,
+                          e)
+                break
+
+            pieces.append(text)
+
+            if stats is not None:
+                stats.merge(doc_stats)
+
+            if trace is not None:
+                for event in events:
+                    trace.record(*event)
+
+    for i in range(len(pieces), len(docs)):
+        text, open_ended = transclude_document(
+            docs[i], assemblies, local_tags, i == 0, stats, trace, memo,
+            anchor_duplicates)
+        pieces.append(text)
+
+    if open_ended:
+        pieces.append("...\n")
+
+    return "".join(pieces)
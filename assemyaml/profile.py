@@ -0,0 +1,108 @@
+from __future__ import absolute_import, print_function
+from logging import getLogger
+from os.path import basename
+import sys
+from threading import Event, Thread
+
+try:
+    from threading import get_ident
+except ImportError:  # pragma: no cover
+    from thread import get_ident
+
+log = getLogger("assemyaml.profile")
+
+# Filename extensions that select the sampling profiler, which writes
+# collapsed ("folded") stacks suitable for flame graph tools.
+COLLAPSED_EXTENSIONS = (".collapsed", ".folded")
+
+# Seconds between samples taken by the sampling profiler.
+DEFAULT_SAMPLE_INTERVAL = 0.001
+
+
+class Profiler(object):
+    """
+    Context manager that profiles the enclosed block and writes the results
+    to a file.
+
+    If the filename ends with .collapsed or .folded, the calling thread is
+    sampled periodically and the results are written as collapsed stacks
+    (one "frame;frame;frame count" line per unique stack). Otherwise, the
+    block is run under cProfile and the results are written in pstats format.
+    """
+    def __init__(self, filename, interval=DEFAULT_SAMPLE_INTERVAL):
+        super(Profiler, self).__init__()
+        self.filename = filename
+        self.interval = interval
+        self.sampling = filename.endswith(COLLAPSED_EXTENSIONS)
+        self.profile = None
+        self.sampler = None
+        return
+
+    def __enter__(self):
+        if self.sampling:
+            self.sampler = StackSampler(get_ident(), self.interval)
+            self.sampler.start()
+        else:
+            from cProfile import Profile
+            self.profile = Profile()
+            self.profile.enable()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.sampling:
+            self.sampler.stop()
+            self.sampler.write(self.filename)
+        else:
+            self.profile.disable()
+            self.profile.dump_stats(self.filename)
+
+        log.info("Wrote profile to %s", self.filename)
+        return False
+
+
+class StackSampler(Thread):
+    """
+    Thread that periodically records the stack of another thread.
+    """
+    def __init__(self, thread_id, interval):
+        super(StackSampler, self).__init__(name="assemyaml-sampler")
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stopped = Event()
+
+        # Collapsed stack string -> number of samples.
+        self.samples = {}
+        return
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:  # pragma: no cover
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (
+                    code.co_name, basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+
+            key = ";".join(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+        return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return
+
+    def write(self, filename):
+        with open(filename, "w") as fd:
+            for stack in sorted(self.samples):
+                fd.write("%s %d\n" % (stack, self.samples[stack]))
+
+        return
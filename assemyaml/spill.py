@@ -0,0 +1,402 @@
+from __future__ import absolute_import, print_function
+from collections import OrderedDict
+from logging import getLogger
+from re import compile as re_compile
+from tempfile import TemporaryFile
+from .assemble import merge_nodes
+from .codec import decode_node, encode_node, estimate_size
+from .types import copy_node, YAML_MAP_TAG, YAML_NULL_TAG
+from yaml.nodes import ScalarNode
+
+log = getLogger("assemyaml.spill")
+
+_size_pattern = re_compile(r"^\s*([0-9]+)\s*([kKmMgG]?)i?[bB]?\s*$")
+
+_size_units = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
+
+def parse_size(value):
+    """
+    parse_size(value) -> int
+
+    Parse a size in bytes with an optional K, M or G (binary) suffix, e.g.
+    "512M". Raises ValueError if value isn't a positive size.
+    """
+    match = _size_pattern.match(value)
+    if match is None:
+        raise ValueError("Invalid size %r" % value)
+
+    size = int(match.group(1)) * _size_units[match.group(2).lower()]
+    if size <= 0:
+        raise ValueError("Invalid size %r" % value)
+
+    return size
+
+
+class SpillStore(object):
+    """
+    An assembly table (assembly name -> value node) that keeps the estimated
+    memory used by its values (see codec.estimate_size) below a ceiling by
+    writing the largest values to a temporary file.
+
+    Spilled values are stored in the compact encoding of
+    assemyaml.codec.encode_node and are decoded each time they are looked up
+    (e.g. at a transclusion point, where they must be merged with the local
+    default value). Decoded values are not kept.
+
+    Later contributions to a spilled assembly (see contribute()) are checked
+    against a shell of the value (its type, tag, marks and, for mappings,
+    keys) and appended to the file as they are; they are merged when the
+    value is loaded. Space left by replaced or discarded values is reclaimed
+    by compacting the file once it makes up more than half of it.
+
+    Pass an instance as the assemblies parameter to run().
+    """
+    def __init__(self, ceiling, directory=None):
+        super(SpillStore, self).__init__()
+        self.ceiling = ceiling
+        self.directory = directory
+
+        # name -> (node, estimated size) for values held in memory.
+        self.memory = OrderedDict()
+        self.used = 0
+
+        # name -> _SpilledValue for values in the spill file.
+        self.spilled = {}
+        self.file = None
+        self.file_size = 0
+
+        # Bytes in the spill file no longer used by any value.
+        self.garbage = 0
+
+        self.spills = 0
+        self.appends = 0
+        self.loads = 0
+        self.compactions = 0
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self.memory) + len(self.spilled)
+
+    def __contains__(self, name):
+        return name in self.memory or name in self.spilled
+
+    def __getitem__(self, name):
+        entry = self.memory.get(name)
+        if entry is not None:
+            return entry[0]
+
+        return self.load(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __setitem__(self, name, node):
+        self.discard(name)
+        self.hold(name, node, estimate_size(node))
+        return
+
+    def contribute(self, name, value, mark, nested=True, stats=None):
+        """
+        store.contribute(name, value, mark, nested=True, stats=None) -> node
+
+        Merge an assembly's value into the store (see
+        assemyaml.assemble.contribute()), returning the merged value.
+
+        If the existing value has been spilled, value is appended to it in
+        the file instead of decoding it; the merged value is only loaded if
+        nested is True. Otherwise value is returned. As for the default
+        table, a value held in memory is copied if nested is True.
+        """
+        spilled = self.spilled.get(name)
+        if spilled is None:
+            entry = self.memory.pop(name, None)
+            if entry is None:
+                node, size = value, estimate_size(value)
+            else:
+                self.used -= entry[1]
+                node = merge_nodes(entry[0], value, stats)
+                size = entry[1] + estimate_size(value)
+
+            self.hold(name, node, size)
+            return copy_node(node) if nested else node
+
+        # Raises the same error merging into the whole value would.
+        shell = spilled.shell
+        merge_nodes(shell, value, stats)
+
+        if value.tag == YAML_NULL_TAG:
+            if shell.tag != YAML_NULL_TAG:
+                # Merging a null value leaves the existing value as it is.
+                return self.load(name) if nested else value
+        elif shell.tag == YAML_NULL_TAG:
+            spilled.shell = _shell(value)
+        else:
+            # The merged value is a new node without marks.
+            shell.start_mark = shell.end_mark = None
+            if shell.tag == YAML_MAP_TAG:
+                shell.value.extend([(key, None) for key, _ in value.value])
+
+        spilled.segments.append(self.write(encode_node(value)))
+        self.appends += 1
+        return self.load(name) if nested else value
+
+    def hold(self, name, node, size):
+        """
+        store.hold(name, node, size)
+
+        Keep a value (with the given estimated size) in memory, spilling the
+        largest values if the ceiling is exceeded.
+        """
+        self.memory[name] = (node, size)
+        self.used += size
+
+        while self.used > self.ceiling and self.memory:
+            self.spill(max(self.memory, key=lambda n: self.memory[n][1]))
+
+        return
+
+    def items(self):
+        """
+        store.items() -> iterator of (name, node)
+
+        Iterate over the entries, decoding spilled values one at a time.
+        """
+        for name, entry in list(self.memory.items()):
+            yield name, entry[0]
+
+        for name in list(self.spilled):
+            yield name, self.load(name)
+
+        return
+
+    def discard(self, name):
+        """
+        store.discard(name)
+
+        Remove an entry if present.
+        """
+        entry = self.memory.pop(name, None)
+        if entry is not None:
+            self.used -= entry[1]
+
+        spilled = self.spilled.pop(name, None)
+        if spilled is not None:
+            self.garbage += sum([length for _, length in spilled.segments])
+            if self.garbage > self.file_size // 2:
+                self.compact()
+
+        return
+
+    def copy(self):
+        """
+        store.copy() -> SpillOverlay
+
+        Return a view of the store whose changes are kept separately (in
+        memory), for assemblies that apply only to a single document.
+        """
+        return SpillOverlay(self)
+
+    def spill(self, name):
+        """
+        store.spill(name)
+
+        Write an in-memory value to the spill file.
+        """
+        node, size = self.memory.pop(name)
+        self.used -= size
+
+        data = encode_node(node)
+        self.spilled[name] = _SpilledValue(_shell(node), [self.write(data)])
+        self.spills += 1
+
+        log.debug("Spilled assembly %s (about %d bytes in memory, %d on "
+                  "disk)", name, size, len(data))
+        return
+
+    def write(self, data):
+        """
+        store.write(data) -> (offset, length)
+
+        Append data to the spill file.
+        """
+        if self.file is None:
+            self.file = TemporaryFile(dir=self.directory)
+
+        offset = self.file_size
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file_size += len(data)
+        return (offset, len(data))
+
+    def load(self, name):
+        """
+        store.load(name) -> node
+
+        Decode a spilled value, merging the contributions appended to it.
+        Raises KeyError if name isn't spilled.
+        """
+        nodes = []
+        for offset, length in self.spilled[name].segments:
+            self.file.seek(offset)
+            nodes.append(decode_node(self.file.read(length)))
+
+        self.loads += 1
+        return _merge_all(nodes)
+
+    def compact(self):
+        """
+        store.compact()
+
+        Rewrite the spill file with only the data of the current values.
+        """
+        old_file = self.file
+        self.file = None
+        self.file_size = 0
+        self.garbage = 0
+
+        for spilled in self.spilled.values():
+            segments = []
+            for offset, length in spilled.segments:
+                old_file.seek(offset)
+                segments.append(self.write(old_file.read(length)))
+            spilled.segments = segments
+
+        old_file.close()
+        self.compactions += 1
+        return
+
+    def close(self):
+        """
+        Discard the spill file.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        self.spilled.clear()
+        return
+
+    def to_dict(self):
+        """
+        store.to_dict() -> dict
+
+        Return the store's sizes and counters as a JSON-serializable dict.
+        """
+        result = OrderedDict()
+        result["ceiling"] = self.ceiling
+        result["in_memory"] = self.used
+        result["spilled"] = len(self.spilled)
+        result["file_size"] = self.file_size
+        result["spills"] = self.spills
+        result["appends"] = self.appends
+        result["loads"] = self.loads
+        result["compactions"] = self.compactions
+        return result
+
+    def format(self):
+        """
+        store.format() -> str
+
+        Return the store's sizes and counters in a human-readable form, in
+        the same layout as Stats.format().
+        """
+        lines = []
+        for name, value in self.to_dict().items():
+            lines.append("%-22s %10d" % ("spill_" + name, value))
+
+        return "\n".join(lines) + "\n"
+
+
+class _SpilledValue(object):
+    """
+    A value in the spill file: the (offset, length) segments holding each
+    contribution to it, and a shell of the merged value (see _shell()) to
+    check later contributions against.
+    """
+    __slots__ = ("shell", "segments")
+
+    def __init__(self, shell, segments):
+        self.shell = shell
+        self.segments = segments
+        return
+
+
+def _shell(node):
+    """
+    _shell(node) -> node
+
+    Returns a node with the same type, tag and marks as node (and, for a
+    plain mapping, the same keys), so merge_nodes() reports the same errors
+    for it without the values being kept.
+    """
+    if isinstance(node, ScalarNode):
+        return ScalarNode(node.tag, u"", node.start_mark, node.end_mark)
+
+    if node.tag == YAML_MAP_TAG:
+        value = [(key, None) for key, _ in node.value]
+    else:
+        value = []
+
+    return node.__class__(node.tag, value, node.start_mark, node.end_mark)
+
+
+def _merge_all(nodes):
+    """
+    _merge_all(nodes) -> node
+
+    Merge contributions already checked by merge_nodes(), producing the
+    same node as merging them one at a time would.
+    """
+    values = [node for node in nodes if node.tag != YAML_NULL_TAG]
+    if not values:
+        return nodes[-1]
+
+    if len(values) == 1:
+        return values[0]
+
+    merged = []
+    for node in values:
+        merged.extend(node.value)
+
+    return values[0].__class__(values[0].tag, merged)
+
+
+class SpillOverlay(object):
+    """
+    A view of a SpillStore with its own (in-memory) changes layered on top;
+    returned by SpillStore.copy().
+    """
+    def __init__(self, store):
+        super(SpillOverlay, self).__init__()
+        self.store = store
+        self.local = {}
+        return
+
+    def __contains__(self, name):
+        return name in self.local or name in self.store
+
+    def __getitem__(self, name):
+        if name in self.local:
+            return self.local[name]
+        return self.store[name]
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __setitem__(self, name, node):
+        self.local[name] = node
+        return
@@ -0,0 +1,346 @@
+from __future__ import absolute_import, print_function
+from logging import getLogger
+from re import compile as re_compile
+from .dumper import FlowDumper, SafeDumper
+from .walk import flatten_value
+from yaml import serialize as yaml_serialize
+from yaml.nodes import CollectionNode, MappingNode
+
+log = getLogger("assemyaml.splice")
+
+# Text before a node on its line that allows a block collection to start
+# there: indentation and (compact) block sequence entry indicators.
+_block_line_prefix = re_compile(r"^(?: *- )* *$")
+
+# Trailing whitespace of a node's source text.
+_trailing_space = re_compile(r"[ \t\r\n]*$")
+
+# Document end marker written after open-ended scalars at the top level.
+_document_end = re_compile(r"(?:^|\n)\.\.\.\n$")
+
+# Width used for flow-style fragments, which must stay on one line.
+_FLOW_WIDTH = 1 << 30
+
+
+class CannotSplice(Exception):
+    """
+    Raised internally when a document can't be spliced; the document is
+    serialized in full instead.
+    """
+
+
+class Splicer(object):
+    """
+    Writes transcluded documents by copying the source text of the parts of
+    the template that were not changed and serializing only the replaced
+    nodes (transclusions and assemblies).
+
+    record() must be called with each document of the template as it is
+    composed, before it is assembled or transcluded; it takes a snapshot of
+    the original structure. write() then compares the transcluded documents
+    against the snapshots.
+
+    Replaced nodes that start on their own line in block context are written
+    in block style, indented to the column of the node they replace; others
+    are written in flow style on a single line. Documents that can't be
+    spliced safely (e.g. ones containing aliases) are serialized in full.
+    """
+    def __init__(self, text):
+        super(Splicer, self).__init__()
+        self.text = text
+
+        # For each document: (original root, end of its source text,
+        # snapshot) where the snapshot maps the id of each original node to
+        # (node, tuple of children) (None for scalars), or None if the
+        # document contains aliases.
+        self.documents = []
+
+        # The snapshot of the document being written.
+        self.snapshot = None
+        return
+
+    def record(self, doc):
+        """
+        splicer.record(doc)
+
+        Take a snapshot of the structure of a newly composed document.
+        """
+        snapshot = {}
+        stack = [doc]
+
+        while stack:
+            node = stack.pop()
+            if id(node) in snapshot:
+                # Reached through an alias; copied text could refer to an
+                # anchor that isn't written.
+                snapshot = None
+                break
+
+            if isinstance(node, CollectionNode):
+                children, _ = flatten_value(node.value)
+                snapshot[id(node)] = (node, tuple(children))
+                stack.extend(children)
+            else:
+                snapshot[id(node)] = (node, None)
+
+        self.documents.append((doc, source_end(doc, None), snapshot))
+        return
+
+    def write(self, docs, output_fd):
+        """
+        splicer.write(docs, output_fd)
+
+        Write the transcluded documents (in the same order as they were
+        recorded) to output_fd.
+        """
+        assert len(docs) == len(self.documents)
+        text = self.text
+        pieces = []
+
+        # Text between documents (directives, separators, comments) is
+        # copied as is.
+        position = 0
+
+        for doc, (original, end, snapshot) in zip(docs, self.documents):
+            start = original.start_mark.index
+            pieces.append(text[position:start])
+            mark = len(pieces)
+            self.snapshot = snapshot
+
+            try:
+                if snapshot is None or has_shared_nodes(doc):
+                    # Fragments serialized separately would each define
+                    # their own anchors.
+                    raise CannotSplice()
+                self.splice(doc, original, snapshot, pieces)
+            except CannotSplice:
+                log.debug("Serializing document at line %d in full",
+                          original.start_mark.line + 1)
+                del pieces[mark:]
+                pieces.append(self.render(doc, original, False, end))
+
+            position = end
+
+        pieces.append(text[position:])
+
+        self.snapshot = None
+
+        result = "".join(pieces)
+        if result.startswith(u"\ufeff"):
+            result = result[1:]
+
+        if result and not result.endswith("\n"):
+            result += "\n"
+
+        output_fd.write(result)
+        return
+
+    def splice(self, root, original, snapshot, pieces):
+        """
+        Append the text for the document root (replacing original) to pieces.
+        """
+        text = self.text
+        clean = clean_nodes(root, snapshot)
+
+        # Work items: strings to append, or (node, original node, in flow
+        # context, is a mapping key) tuples to expand.
+        stack = [(root, original, False, False)]
+
+        while stack:
+            item = stack.pop()
+            if not isinstance(item, tuple):
+                pieces.append(item)
+                continue
+
+            node, original, in_flow, is_key = item
+
+            if node is original and id(node) in clean:
+                pieces.append(text[node.start_mark.index:
+                                   source_end(node, snapshot)])
+                continue
+
+            entry = snapshot.get(id(node))
+            if node is not original or entry[1] is None:
+                # A replaced node. (This may be an original node from
+                # elsewhere in the document, e.g. the value of an assembly,
+                # whose text can't be copied to a different position.)
+                if is_key:
+                    raise CannotSplice()
+                pieces.append(self.render(node, original, in_flow))
+                continue
+
+            # An original collection with some replaced descendants. Copy
+            # the text around its children and expand the children.
+            original_children = entry[1]
+            children, _ = flatten_value(node.value)
+            if len(children) != len(original_children):
+                if is_key:
+                    raise CannotSplice()
+                pieces.append(self.render(node, original, in_flow))
+                continue
+
+            items = []
+            position = node.start_mark.index
+            child_in_flow = in_flow or bool(node.flow_style)
+            mapping = isinstance(node, MappingNode)
+
+            for i, (child, original_child) in enumerate(
+                    zip(children, original_children)):
+                child_start = original_child.start_mark.index
+                child_end = source_end(original_child, snapshot)
+                if child_start < position or child_end < child_start:
+                    raise CannotSplice()
+
+                items.append(text[position:child_start])
+                items.append((child, original_child, child_in_flow,
+                              mapping and i % 2 == 0))
+                position = child_end
+
+            end = source_end(node, snapshot)
+            if end < position:
+                raise CannotSplice()
+
+            items.append(text[position:end])
+            items.reverse()
+            stack.extend(items)
+
+        return
+
+    def render(self, node, original, in_flow, end=None):
+        """
+        splicer.render(node, original, in_flow, end=None) -> str
+
+        Serialize node to replace the source text of original, which ends at
+        end (or source_end(original) if None).
+        """
+        text = self.text
+        start_mark = original.start_mark
+        start = start_mark.index
+        line_start = text.rfind("\n", 0, start) + 1
+
+        block = (
+            not in_flow and not getattr(original, "flow_style", False) and
+            _block_line_prefix.match(text[line_start:start]) is not None and
+            (isinstance(original, MappingNode) or
+             not isinstance(node, MappingNode)))
+
+        if block:
+            fragment = yaml_serialize(node, Dumper=SafeDumper)
+            if fragment.startswith("---"):
+                block = False
+
+        if not block:
+            fragment = yaml_serialize(node, Dumper=FlowDumper,
+                                      width=_FLOW_WIDTH)
+
+        fragment = _document_end.sub("", fragment).rstrip("\n")
+
+        if not fragment and not block:
+            # An empty plain scalar would disappear in flow context.
+            fragment = "!!null ''"
+
+        # Indent continuation lines to the column of the replaced node.
+        indent = " " * start_mark.column
+        lines = fragment.split("\n")
+        fragment = "\n".join(
+            [lines[0]] + [indent + line if line else line
+                          for line in lines[1:]])
+
+        # Keep any line breaks at the end of the replaced text (e.g. after
+        # a block scalar) so the following text stays on its own line.
+        if end is None:
+            end = source_end(original, self.snapshot)
+        original_text = text[start:end]
+        trailing = _trailing_space.search(original_text).group()
+        if "\n" in trailing:
+            fragment += trailing
+
+        return fragment
+
+
+def has_shared_nodes(root):
+    """
+    has_shared_nodes(root) -> bool
+
+    Indicates whether any node is reached more than once (through an alias)
+    within root.
+    """
+    seen = set()
+    stack = [root]
+
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            return True
+        seen.add(id(node))
+
+        if isinstance(node, CollectionNode):
+            stack.extend(flatten_value(node.value)[0])
+
+    return False
+
+
+def source_end(node, snapshot):
+    """
+    source_end(node, snapshot) -> int
+
+    Returns the index just past the last character of node's source text.
+
+    The end marks of block collections extend to the start of the following
+    token (past trailing line breaks and comments), so the end of the last
+    descendant scalar or flow collection is used instead. If snapshot is not
+    None, it supplies the original children of nodes that have been changed.
+    """
+    while (isinstance(node, CollectionNode) and  # noqa: E129
+           not node.flow_style):
+        children = None
+        if snapshot is not None:
+            entry = snapshot.get(id(node))
+            if entry is not None:
+                children = entry[1]
+
+        if children is None:
+            children, _ = flatten_value(node.value)
+
+        if not children:
+            break
+
+        node = children[-1]
+
+    return node.end_mark.index
+
+
+def clean_nodes(root, snapshot):
+    """
+    clean_nodes(root, snapshot) -> set
+
+    Returns the ids of the nodes under root (inclusive) that are original
+    nodes whose descendants are all unchanged.
+    """
+    clean = set()
+
+    # Post-order walk: (node, children) entries are expanded the first time
+    # they are seen and checked the second time.
+    stack = [(root, None)]
+
+    while stack:
+        node, children = stack.pop()
+        entry = snapshot.get(id(node))
+        if entry is None:
+            continue
+
+        if entry[1] is None:
+            clean.add(id(node))
+            continue
+
+        if children is None:
+            children, _ = flatten_value(node.value)
+            stack.append((node, children))
+            stack.extend([(child, None) for child in children])
+            continue
+
+        if (tuple(children) == entry[1] and  # noqa: E129
+            all([id(child) in clean for child in children])):
+            clean.add(id(node))
+
+    return clean
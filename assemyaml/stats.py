@@ -0,0 +1,201 @@
+from __future__ import absolute_import, print_function
+from collections import OrderedDict
+from contextlib import contextmanager
+from sys import platform
+from time import time
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:  # pragma: no cover
+    # Not available on Windows.
+    getrusage = None
+
+
+class Stats(object):
+    """
+    Wall time per phase and counters collected during an assembly run.
+
+    Pass an instance as the stats parameter to run() (and the functions it
+    calls) to have it filled in.
+    """
+    counters = (
+        "bytes_read", "documents", "nodes", "assemblies", "transclusions",
+        "merges", "duplicate_key_checks",
+    )
+
+    def __init__(self):
+        super(Stats, self).__init__()
+        # Phase name -> seconds, in the order the phases first ran.
+        self.phases = OrderedDict()
+
+        # Characters (text streams) or bytes (binary streams and memory-mapped
+        # files) read from input documents.
+        self.bytes_read = 0
+
+        # YAML documents composed from templates and resources.
+        self.documents = 0
+
+        # Nodes visited while assembling and transcluding.
+        self.nodes = 0
+
+        # Assemblies recorded and transclusion points replaced.
+        self.assemblies = 0
+        self.transclusions = 0
+
+        # Calls to merge_nodes() and mapping keys checked for duplicates.
+        self.merges = 0
+        self.duplicate_key_checks = 0
+
+        # Peak resident set size of this process, in bytes (if available).
+        self.peak_memory = None
+        return
+
+    @contextmanager
+    def phase(self, name):
+        """
+        with stats.phase(name): ...
+
+        Add the wall time spent in the block to the named phase.
+        """
+        start = time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time() - start)
+
+    def timed_iter(self, iterable, name):
+        """
+        stats.timed_iter(iterable, name) -> iterator
+
+        Iterate over iterable, adding the time spent producing each item (but
+        not the time spent by the caller consuming it) to the named phase.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+
+            yield item
+
+    def reader(self, stream):
+        """
+        stats.reader(stream) -> stream
+
+        Wrap a file-like object so reads from it are counted in bytes_read.
+        Strings and memory-mapped inputs are counted immediately and returned
+        unchanged.
+        """
+        if not hasattr(stream, "read"):
+            self.bytes_read += len(stream)
+            return stream
+
+        if getattr(stream, "mapped", False):
+            self.bytes_read += stream.size
+            return stream
+
+        return CountingReader(stream, self)
+
+    def merge(self, other):
+        """
+        stats.merge(other)
+
+        Add the phase times and counters from another Stats object (for
+        example, one filled in by another process) to this one.
+        """
+        for name, seconds in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+        for counter in self.counters:
+            setattr(self, counter,
+                    getattr(self, counter) + getattr(other, counter))
+
+        if other.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, other.peak_memory)
+
+        return
+
+    def update_peak_memory(self):
+        """
+        Record the peak resident set size of the process.
+        """
+        if getrusage is None:  # pragma: no cover
+            return
+
+        maxrss = getrusage(RUSAGE_SELF).ru_maxrss
+
+        # Linux reports this in kilobytes; macOS reports it in bytes.
+        if platform != "darwin":
+            maxrss *= 1024
+
+        self.peak_memory = maxrss
+        return
+
+    def to_dict(self):
+        """
+        stats.to_dict() -> dict
+
+        Return the statistics as a JSON-serializable dict.
+        """
+        result = OrderedDict()
+        result["phases"] = OrderedDict(
+            [(name, round(seconds, 6))
+             for name, seconds in self.phases.items()])
+
+        for counter in self.counters:
+            result[counter] = getattr(self, counter)
+
+        result["peak_memory"] = self.peak_memory
+        return result
+
+    def to_json(self):
+        """
+        stats.to_json() -> str
+
+        Return the statistics as a single line of JSON.
+        """
+        from json import dumps as json_dumps
+        return json_dumps(self.to_dict(), separators=(",", ":"))
+
+    def format(self):
+        """
+        stats.format() -> str
+
+        Return the statistics in a human-readable form.
+        """
+        lines = []
+        for name, seconds in self.phases.items():
+            lines.append("%-22s %10.3f ms" % (name, seconds * 1000.0))
+
+        for counter in self.counters:
+            lines.append("%-22s %10d" % (counter, getattr(self, counter)))
+
+        if self.peak_memory is not None:
+            lines.append("%-22s %10.1f MiB" % (
+                "peak_memory", self.peak_memory / 1048576.0))
+
+        return "\n".join(lines) + "\n"
+
+
+class CountingReader(object):
+    """
+    File-like wrapper that counts the size of data read from a stream.
+
+    Other attributes (such as name, which PyYAML uses in error marks) are
+    passed through to the underlying stream.
+    """
+    def __init__(self, stream, stats):
+        super(CountingReader, self).__init__()
+        self.stream = stream
+        self.stats = stats
+        return
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.stats.bytes_read += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
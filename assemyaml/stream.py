@@ -0,0 +1,346 @@
+from __future__ import absolute_import, print_function
+from logging import getLogger
+from .dumper import SafeDumper
+from .error import TranscludeError
+from .index import EventParser
+from .input import read_text
+from .loader import SafeLoader
+from .trace import get_trace
+from .transclude import transclude, transclude_document
+from .types import (
+    GLOBAL_ASSEMBLY_TAG, GLOBAL_TRANSCLUDE_TAG, LOCAL_ASSEMBLY_TAG,
+    LOCAL_TRANSCLUDE_TAG, YAML_SEQ_TAG,
+)
+from yaml import parse as yaml_parse
+from yaml.error import YAMLError
+from yaml.events import (
+    DocumentEndEvent, DocumentStartEvent, MappingEndEvent, MappingStartEvent,
+    NodeEvent, ScalarEvent, SequenceEndEvent, SequenceStartEvent,
+    StreamEndEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+log = getLogger("assemyaml.stream")
+
+
+def scan_documents(source, local_tags=True):
+    """
+    scan_documents(source, local_tags=True) -> iterator of bool
+
+    Parse a template (with libyaml, where available) and yield, for each
+    document in turn, whether it must be composed in full rather than
+    streamed: it has anchors or aliases (which the serializer renames by
+    where they are used) or assemblies (which apply to the transclusions
+    before them as well as after).
+
+    Documents are scanned as they are requested. If the template can't be
+    parsed, True is yielded for the rest of the documents so composing them
+    raises the error.
+    """
+    if local_tags:
+        assembly_tags = (GLOBAL_ASSEMBLY_TAG, LOCAL_ASSEMBLY_TAG)
+    else:
+        assembly_tags = (GLOBAL_ASSEMBLY_TAG,)
+
+    composed = False
+
+    try:
+        for event in yaml_parse(source, Loader=EventParser):
+            if isinstance(event, DocumentStartEvent):
+                composed = False
+            elif isinstance(event, DocumentEndEvent):
+                yield composed
+            elif isinstance(event, NodeEvent) and (
+                    event.anchor is not None or
+                    getattr(event, "tag", None) in assembly_tags):
+                composed = True
+    except YAMLError:
+        pass
+
+    while True:
+        yield True
+
+
+class StreamTranscluder(object):
+    """
+    Transcludes a template by passing its parse events through to the
+    emitter, so the template is never held in memory as a whole.
+
+    Only a transclusion point is composed into nodes: its mapping is
+    transcluded as transclude() would within the document and the events of
+    the result are emitted in its place. Documents that scan_documents()
+    reports can't be streamed are composed and transcluded whole, as
+    transclude_template() does. The output is the same as serializing the
+    documents transclude_template() returns.
+    """
+    def __init__(self, loader, dumper, assemblies, local_tags=True,
+                 stats=None, trace=None, memo=None):
+        super(StreamTranscluder, self).__init__()
+        self.loader = loader
+        self.dumper = dumper
+        self.assemblies = assemblies
+        self.local_tags = local_tags
+        self.stats = stats
+        self.trace = trace
+        self.memo = memo
+
+        if local_tags:
+            self.transclude_tags = (GLOBAL_TRANSCLUDE_TAG,
+                                    LOCAL_TRANSCLUDE_TAG)
+        else:
+            self.transclude_tags = (GLOBAL_TRANSCLUDE_TAG,)
+
+        # Documents streamed and composed in full.
+        self.streamed = 0
+        self.composed = 0
+        return
+
+    def run(self, scan):
+        """
+        st.run(scan)
+
+        Transclude every document in the template, using scan (an iterator
+        from scan_documents()) to decide which must be composed in full.
+        """
+        loader = self.loader
+        dumper = self.dumper
+        stats = self.stats
+
+        loader.get_event()
+        dumper.open()
+
+        while not loader.check_event(StreamEndEvent):
+            if not next(scan):
+                if stats is None:
+                    self.stream_document()
+                else:
+                    stats.documents += 1
+                    with stats.phase("stream"):
+                        self.stream_document()
+
+                self.streamed += 1
+                continue
+
+            if stats is None:
+                doc = loader.compose_document()
+                doc = transclude_document(
+                    doc, self.assemblies, self.local_tags, trace=self.trace,
+                    memo=self.memo)
+                dumper.serialize(doc)
+            else:
+                with stats.phase("parse"):
+                    doc = loader.compose_document()
+                doc = transclude_document(
+                    doc, self.assemblies, self.local_tags, stats, self.trace,
+                    self.memo)
+                with stats.phase("serialize"):
+                    dumper.serialize(doc)
+
+            self.composed += 1
+
+        loader.get_event()
+        dumper.close()
+        return
+
+    def stream_document(self):
+        """
+        st.stream_document()
+
+        Emit the events of the next document, transcluding each
+        transclusion point in it.
+        """
+        loader = self.loader
+        dumper = self.dumper
+        stats = self.stats
+
+        loader.get_event()
+        loader.start_document()
+        dumper.emit(DocumentStartEvent(
+            explicit=dumper.use_explicit_start, version=dumper.use_version,
+            tags=dumper.use_tags))
+
+        # One entry per open collection: None for a sequence, or
+        # [start mark, whether the next node is a key] for a mapping.
+        stack = []
+
+        while True:
+            event = loader.get_event()
+
+            if isinstance(event, (MappingEndEvent, SequenceEndEvent)):
+                stack.pop()
+                dumper.emit(event.__class__())
+                if not stack:
+                    break
+                continue
+
+            if stats is not None:
+                stats.nodes += 1
+
+            if stack and stack[-1] is not None:
+                mapping = stack[-1]
+                is_key = mapping[1]
+                mapping[1] = not is_key
+
+                # The first key of a transclusion is found when its mapping
+                # starts; one found later is in a mapping with other keys.
+                if (is_key and  # noqa: E129
+                    getattr(event, "tag", None) in self.transclude_tags):
+                    raise TranscludeError(
+                        None, None,
+                        "Transclude must be a single-entry mapping",
+                        mapping[0])
+
+            if isinstance(event, ScalarEvent):
+                self.emit_scalar(event)
+                if not stack:
+                    break
+            elif isinstance(event, SequenceStartEvent):
+                tag = self.resolve(SequenceNode, event)
+                dumper.emit(SequenceStartEvent(
+                    None, tag, tag == dumper.resolve(SequenceNode, None, True),
+                    flow_style=event.flow_style))
+                stack.append(None)
+            else:
+                assert isinstance(event, MappingStartEvent)
+                key = loader.peek_event()
+                if (isinstance(key, NodeEvent) and  # noqa: E129
+                    getattr(key, "tag", None) in self.transclude_tags):
+                    self.transclude_mapping(event)
+                    if not stack:
+                        break
+                    continue
+
+                tag = self.resolve(MappingNode, event)
+                dumper.emit(MappingStartEvent(
+                    None, tag, tag == dumper.resolve(MappingNode, None, True),
+                    flow_style=event.flow_style))
+                stack.append([event.start_mark, True])
+
+        loader.get_event()
+        dumper.emit(DocumentEndEvent(explicit=dumper.use_explicit_end))
+
+        # Anchor names start again in each document, as for serialize().
+        dumper.last_anchor_id = 0
+        return
+
+    def resolve(self, node_class, event):
+        """
+        st.resolve(node_class, event) -> str
+
+        Returns the tag the composer would give the node for event.
+        """
+        tag = event.tag
+        if tag is None or tag == "!":
+            value = event.value if node_class is ScalarNode else None
+            tag = self.loader.resolve(node_class, value, event.implicit)
+
+        return tag
+
+    def emit_scalar(self, event):
+        """
+        st.emit_scalar(event)
+
+        Emit a scalar from the template as the serializer would write its
+        node.
+        """
+        dumper = self.dumper
+        tag = self.resolve(ScalarNode, event)
+        implicit = (
+            tag == dumper.resolve(ScalarNode, event.value, (True, False)),
+            tag == dumper.resolve(ScalarNode, event.value, (False, True)))
+        dumper.emit(ScalarEvent(None, tag, implicit, event.value,
+                                style=event.style))
+        return
+
+    def transclude_mapping(self, start_event):
+        """
+        st.transclude_mapping(start_event)
+
+        Compose the rest of a transclusion point's mapping, transclude it and
+        emit the result.
+        """
+        loader = self.loader
+        node = MappingNode(self.resolve(MappingNode, start_event), [],
+                           start_event.start_mark, None,
+                           flow_style=start_event.flow_style)
+
+        while not loader.check_event(MappingEndEvent):
+            key = loader.compose_node(node, None)
+            value = loader.compose_node(node, key)
+            node.value.append((key, value))
+
+        node.end_mark = loader.get_event().end_mark
+
+        wrapper = SequenceNode(YAML_SEQ_TAG, [node])
+        wrapper = transclude(wrapper, self.assemblies, self.local_tags,
+                             self.stats, self.trace, self.memo)
+        self.emit_node(wrapper.value[0])
+        return
+
+    def emit_node(self, node):
+        """
+        st.emit_node(node)
+
+        Serialize a transcluded value within the current document.
+        """
+        dumper = self.dumper
+
+        # Each transcluded value is a separate copy, so anchors are only
+        # needed for nodes shared within it. Their names continue from the
+        # previous value's, as they would if the whole document were
+        # serialized at once.
+        dumper.anchors = {}
+        dumper.serialized_nodes = {}
+        dumper.anchor_node(node)
+        dumper.serialize_node(node, None, None)
+        dumper.anchors = {}
+        dumper.serialized_nodes = {}
+        return
+
+
+def transclude_stream(stream, output_fd, assemblies, local_tags=True,
+                      stats=None, trace=None, memo=None, loader=SafeLoader):
+    """
+    transclude_stream(stream, output_fd, assemblies, local_tags=True,
+                      stats=None, trace=None, memo=None, loader=SafeLoader)
+
+    Transclude a template into output_fd as YAML (the same output as
+    transclude_template() and write_output()), streaming its events instead
+    of composing it first (see StreamTranscluder). Memory-mapped templates
+    are read twice, once to scan them (see scan_documents()) and once,
+    decoded a chunk at a time, to transclude them; other streams are read
+    into memory first.
+
+    If an error is raised, the documents before it have already been
+    written to output_fd.
+    """
+    trace = get_trace(trace)
+
+    if not getattr(stream, "mapped", False):
+        stream = read_text(stream)
+
+    if stats is not None:
+        # Counts the size of the whole input.
+        stats.reader(stream)
+
+    buffer = getattr(stream, "buffer", None)
+    if buffer is not None:
+        from .input import BufferReader
+        scan = scan_documents(BufferReader(buffer), local_tags)
+        source = stream.reader()
+    else:
+        scan = scan_documents(stream.text(), local_tags)
+        source = stream
+
+    transcluder = StreamTranscluder(
+        loader(source), SafeDumper(output_fd), assemblies, local_tags, stats,
+        trace, memo)
+    try:
+        transcluder.run(scan)
+    finally:
+        transcluder.loader.dispose()
+        transcluder.dumper.dispose()
+
+    log.debug("Streamed %d template documents; composed %d in full",
+              transcluder.streamed, transcluder.composed)
+    return
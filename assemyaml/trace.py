@@ -0,0 +1,90 @@
+from __future__ import absolute_import, print_function
+from logging import DEBUG, getLogger
+
+log = getLogger("assemyaml.trace")
+
+
+class Trace(object):
+    """
+    Structured record of the assembly and transclusion decisions made during
+    a run.
+
+    Each event is a dict with the keys event ("assembly" or "transclude"),
+    name, file, line, column (1-based, from the start mark of the node) and
+    action. Nodes themselves are never formatted, so tracing stays cheap even
+    for large documents.
+
+    Actions for assembly events:
+        record: the first contribution to this name.
+        merge: merged into an existing contribution.
+
+    Actions for transclude events:
+        default: no (or a null) assembly was found; the local default value
+            is used.
+        replace: the local default value is null; the assembly is used.
+        merge: the assembly was merged into the local default value.
+    """
+    def __init__(self):
+        super(Trace, self).__init__()
+        self.events = []
+        return
+
+    def record(self, event, name, mark, action):
+        """
+        trace.record(event, name, mark, action)
+
+        Record an event. mark is the start mark of the node (or None).
+        """
+        entry = {"event": event, "name": name, "action": action}
+        if mark is not None:
+            entry["file"] = mark.name
+            entry["line"] = mark.line + 1
+            entry["column"] = mark.column + 1
+        else:
+            entry["file"] = entry["line"] = entry["column"] = None
+
+        self.events.append(entry)
+        return
+
+    def write(self, fd):
+        """
+        trace.write(fd)
+
+        Write the events to fd as JSON lines.
+        """
+        from json import dumps as json_dumps
+
+        for entry in self.events:
+            fd.write(json_dumps(entry, sort_keys=True))
+            fd.write("\n")
+
+        return
+
+
+class LoggingTrace(Trace):
+    """
+    Trace that also writes each event to the assemyaml.trace logger at DEBUG
+    level.
+    """
+    def record(self, event, name, mark, action):
+        super(LoggingTrace, self).record(event, name, mark, action)
+        entry = self.events[-1]
+        log.debug("%s %s at %s:%s:%s: %s", event, name, entry["file"],
+                  entry["line"], entry["column"], action)
+        return
+
+
+def get_trace(trace=None):
+    """
+    get_trace(trace=None) -> Trace | None
+
+    Returns trace if it is not None. Otherwise, returns a LoggingTrace if
+    debug logging is enabled for the assemyaml.trace logger, or None.
+
+    This is called once per document; the traversal functions only check
+    whether the result is None, so disabled tracing costs nothing per node.
+    """
+    if trace is None and log.isEnabledFor(DEBUG):
+        trace = LoggingTrace()
+
+    return trace
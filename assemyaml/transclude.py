@@ -1,9 +1,13 @@
-from logging import getLogger
+from logging import DEBUG, getLogger
 from .assemble import assemble, merge_nodes
 from .error import TranscludeError
+from .loader import SafeLoader
+from .trace import get_trace
 from .types import (
-    copy_node, GLOBAL_TRANSCLUDE_TAG, LOCAL_TRANSCLUDE_TAG, YAML_SEQ_TAG,
+    copy_node, GLOBAL_TRANSCLUDE_TAG, LOCAL_TRANSCLUDE_TAG, YAML_NULL_TAG,
+    YAML_SEQ_TAG,
 )
+from .walk import rebuild
 from yaml import compose_all
 from yaml.nodes import (
     CollectionNode, MappingNode, Node, ScalarNode, SequenceNode,
@@ -11,74 +15,163 @@ from yaml.nodes import (
 
 log = getLogger("assemyaml.transclude")
 
+# Maximum number of transclusions nested within each other's values.
+MAX_TRANSCLUDE_DEPTH = 1000
 
-def transclude_template(stream, assemblies, local_tags=True):
+
+def transclude_template(stream, assemblies, local_tags=True, stats=None,
+                        trace=None, memo=None, splicer=None,
+                        loader=SafeLoader, anchors=None):
     documents = []
+    debug = log.isEnabledFor(DEBUG)
+    trace = get_trace(trace)
 
-    for doc in compose_all(stream):
-        # Wrap the document in a sequence node so we can apply get_assemblies()
-        # and transclude() to an assembly or transclude at the top level.
-        wrapper = SequenceNode(YAML_SEQ_TAG, [doc])
+    if stats is None:
+        docs = compose_all(stream, Loader=loader)
+    else:
+        docs = stats.timed_iter(
+            compose_all(stats.reader(stream), Loader=loader), "parse")
 
-        # Record any assemblies in the document itself, but don't apply
-        # these to other documents.
-        doc_assemblies = assemblies.copy()
+    for doc in docs:
+        if splicer is not None:
+            splicer.record(doc)
 
-        log.debug("Before transclude: wrapper=%s", wrapper)
+        if debug:
+            log.debug("Before transclude: doc=%s", doc)
 
-        wrapper = assemble(wrapper, doc_assemblies, local_tags)
-        wrapper = transclude(wrapper, doc_assemblies, local_tags)
+        doc = transclude_document(doc, assemblies, local_tags, stats, trace,
+                                  memo, anchors)
 
-        log.debug("After transclude:  wrapper=%s", wrapper)
+        if debug:
+            log.debug("After transclude:  doc=%s", doc)
 
-        documents.append(wrapper.value[0])
+        documents.append(doc)
 
     return documents
 
 
-def transclude(node, assemblies, local_tags):
+def transclude_document(doc, assemblies, local_tags, stats=None, trace=None,
+                        memo=None, anchors=None):
+    """
+    transclude_document(doc, assemblies, local_tags, stats=None, trace=None,
+                        memo=None, anchors=None) -> node
+
+    Record the assemblies in a template document and transclude it. The
+    document's own assemblies are added to a copy of assemblies, so they
+    don't apply to other documents.
+    """
+    # Wrap the document in a sequence node so we can apply get_assemblies()
+    # and transclude() to an assembly or transclude at the top level.
+    wrapper = SequenceNode(YAML_SEQ_TAG, [doc])
+    doc_assemblies = assemblies.copy()
+
+    if stats is None:
+        wrapper = assemble(wrapper, doc_assemblies, local_tags, trace=trace)
+        wrapper = transclude(
+            wrapper, doc_assemblies, local_tags, trace=trace, memo=memo,
+            anchors=anchors)
+    else:
+        stats.documents += 1
+        with stats.phase("assemble"):
+            wrapper = assemble(
+                wrapper, doc_assemblies, local_tags, stats, trace)
+        with stats.phase("transclude"):
+            wrapper = transclude(
+                wrapper, doc_assemblies, local_tags, stats, trace, memo,
+                anchors)
+
+    return wrapper.value[0]
+
+
+def transclude(node, assemblies, local_tags, stats=None, trace=None,
+               memo=None, anchors=None):
     """
-    transclude(node, assemblies, local_tags) -> node
+    transclude(node, assemblies, local_tags, stats=None, trace=None,
+               memo=None, anchors=None) -> node
 
     Find all transclusion points in the given node and replace or merge their
     contents with values from the assemblies.
+
+    If memo (an assemyaml.memo.TranscludeMemo) is specified, merged values
+    are looked up in and added to it. If anchors (an
+    assemyaml.dedupe.DuplicateAnchors) is specified, each transcluded value
+    is recorded in it.
+
+    The tree is walked without recursion (see assemyaml.walk.rebuild), so
+    deeply nested documents are handled.
     """
     assert isinstance(node, Node)
-    if isinstance(node, ScalarNode):
-        # Scalar type -- no need to evaluate
-        return node
 
-    log.debug("transclude(%s)", node)
+    # Transclusions currently being expanded (the id of the copy -> its key)
+    # and the keys of those expansions. A transclusion point reached again
+    # within its own expansion would expand forever.
+    expanding = {}
+    active = set()
+
+    def transclude_node(node):
+        if stats is not None:
+            stats.nodes += 1
+
+        if isinstance(node, ScalarNode):
+            # Scalar type -- no need to evaluate
+            return node
+
+        name, value = get_transclude(node, local_tags)
+        if name is None:
+            return node
 
-    name, value = get_transclude(node, local_tags)
-    if name is not None:
-        log.debug("transclude starting on node=%s", node)
         assembly_value = assemblies.get(name)
 
+        if stats is not None:
+            stats.transclusions += 1
+
+        if trace is not None:
+            if (assembly_value is None or  # noqa: E129
+                assembly_value.tag == YAML_NULL_TAG):
+                action = "default"
+            elif value.tag == YAML_NULL_TAG:
+                action = "replace"
+            else:
+                action = "merge"
+
+            trace.record("transclude", name, node.start_mark, action)
+
+        mark = node.start_mark
+        key = (name, mark.name, mark.index) if mark is not None else None
+        if ((key is not None and key in active) or  # noqa: E129
+            len(expanding) >= MAX_TRANSCLUDE_DEPTH):
+            raise TranscludeError(
+                None, None, "Transclude %s includes itself" % name, mark)
+
         if assembly_value is not None:
             # Add existing assembly values into the transcluded value.
-            value = merge_nodes(value, assembly_value)
+            if (memo is None or value.tag == YAML_NULL_TAG or  # noqa: E129
+                assembly_value.tag == YAML_NULL_TAG):
+                value = merge_nodes(value, assembly_value, stats)
+            else:
+                value = memo.merge(value, assembly_value, stats)
 
+        # The walk continues into the children of the copy.
         node = copy_node(value)
         assert isinstance(node, Node)
-        if isinstance(node, ScalarNode):
-            return node
 
-    # Recurse on the node's value
-    old_values = node.value
-    node.value = []
+        expanding[id(node)] = key
+        if key is not None:
+            active.add(key)
 
-    for value in old_values:
-        if isinstance(value, tuple):
-            value = tuple([transclude(el, assemblies, local_tags)
-                          for el in value])
-        else:
-            assert isinstance(value, Node)
-            value = transclude(value, assemblies, local_tags)
+        return node
 
-        node.value.append(value)
+    def finish_node(node):
+        if anchors is not None and id(node) in expanding:
+            anchors.record(node)
+
+        key = expanding.pop(id(node), None)
+        if key is not None:
+            active.discard(key)
+
+        return node
 
-    return node
+    return rebuild(node, pre=transclude_node, post=finish_node)
 
 
 def get_transclude(node, local_tags):
@@ -96,7 +189,6 @@ def get_transclude(node, local_tags):
     transclude_key = None
     transclude_value = None
     for key_node, value_node in node.value:
-        log.debug("get_transclude: considering key_node=%s", key_node)
         if (key_node.tag == GLOBAL_TRANSCLUDE_TAG or  # noqa: E129
             local_tags and key_node.tag == LOCAL_TRANSCLUDE_TAG):
             transclude_key = key_node
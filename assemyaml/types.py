@@ -1,6 +1,6 @@
 from __future__ import absolute_import, print_function
 from logging import getLogger
-from six.moves import range
+from .walk import flatten_value, unflatten_value
 from yaml.nodes import (
     CollectionNode, MappingNode, Node, ScalarNode, SequenceNode,
 )
@@ -43,6 +43,10 @@ def copy_node(node):
     Create a deep copy of the specified node or list/tuple of nodes.
 
     If node is not a list, tuple, or Node, it is returned unchanged.
+
+    The copy is made without recursion, so deeply nested nodes can be copied.
+    Nodes shared through aliases (including a node which contains itself) are
+    copied once, and the copies are shared in the same way.
     """
     if isinstance(node, tuple):
         return tuple([copy_node(el) for el in node])
@@ -51,21 +55,134 @@ def copy_node(node):
     elif not isinstance(node, Node):
         return node
 
+    result = _copy_shallow(node)
+    if not isinstance(node, CollectionNode):
+        return result
+
+    # Copies of the nodes reached so far, by id of the source node.
+    copies = {id(node): result}
+    stack = [_CopyFrame(node, result)]
+
+    while stack:
+        frame = stack[-1]
+
+        if frame.index == len(frame.children):
+            stack.pop()
+            frame.finish()
+            continue
+
+        child = frame.children[frame.index]
+        frame.index += 1
+
+        existing = copies.get(id(child))
+        if existing is not None:
+            frame.results.append(existing)
+            continue
+
+        child_copy = copies[id(child)] = _copy_shallow(child)
+        frame.results.append(child_copy)
+
+        if isinstance(child, CollectionNode):
+            stack.append(_CopyFrame(child, child_copy))
+
+    return result
+
+
+class _CopyFrame(object):
+    """
+    A collection node being copied by copy_node().
+    """
+    __slots__ = ("source", "target", "children", "sizes", "index", "results")
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+        self.index = 0
+        self.results = []
+        self.children, self.sizes = flatten_value(source.value)
+        return
+
+    def finish(self):
+        self.target.value = unflatten_value(self.results, self.sizes)
+        return
+
+
+def _copy_shallow(node):
+    """
+    Copy a node without its children. Collection copies have an empty value.
+    """
     kw = {
         "tag": node.tag,
         "start_mark": node.start_mark,
         "end_mark": node.end_mark,
-        "value": copy_node(node.value),
     }
 
     if isinstance(node, ScalarNode):
+        kw["value"] = node.value
         kw["style"] = node.style
     elif isinstance(node, CollectionNode):
+        kw["value"] = []
         kw["flow_style"] = node.flow_style
+    else:
+        kw["value"] = copy_node(node.value)
 
     return type(node)(**kw)
 
 
+def node_hash(node):
+    """
+    node_hash(node) -> str
+
+    Returns a hex digest of the structure of node: node types, tags, scalar
+    values and styles, and flow styles, but not marks. Nodes with the same
+    digest are serialized identically and behave identically when merged.
+
+    The node is walked without recursion. A node that contains itself is
+    hashed as a reference to the enclosing node.
+    """
+    from hashlib import sha1
+
+    digest = sha1()
+
+    # Pre-order walk. None entries mark the end of a collection.
+    stack = [node]
+
+    # Ids of the collections enclosing the current node, and their depths.
+    path = []
+    depths = {}
+
+    while stack:
+        node = stack.pop()
+
+        if node is None:
+            del depths[path.pop()]
+            continue
+
+        if isinstance(node, ScalarNode):
+            value = node.value
+            digest.update((u"S%d:%s%d:%s%s" % (
+                len(node.tag), node.tag, len(value), value,
+                node.style or u"")).encode("utf-8"))
+            continue
+
+        depth = depths.get(id(node))
+        if depth is not None:
+            digest.update((u"R%d" % depth).encode("utf-8"))
+            continue
+
+        children, _ = flatten_value(node.value)
+        digest.update((u"%s%d:%s%d:%s" % (
+            "M" if isinstance(node, MappingNode) else "Q", len(node.tag),
+            node.tag, len(children), node.flow_style)).encode("utf-8"))
+
+        depths[id(node)] = len(path)
+        path.append(id(node))
+        stack.append(None)
+        stack.extend(reversed(children))
+
+    return digest.hexdigest()
+
+
 def comparison_function(*tags):
     def add_function(f):
         for tag in tags:
@@ -80,28 +197,73 @@ def nodes_equal(a, b):
     nodes_equal(a, b) -> bool
 
     Indicates whether two nodes are equal (examining both tags and values).
+
+    Collections are compared without recursion: their comparison functions
+    (see child_comparisons) produce pairs of child nodes that are pushed onto
+    a stack of pending comparisons, so deeply nested nodes can be compared.
     """
-    global comparison_functions
+    pending = [(a, b)]
 
-    if a.tag != b.tag:
-        return False
+    # Pairs of collections already expanded. Seeing a pair again means the
+    # nodes contain themselves (through aliases); the pair is equal unless
+    # some other comparison fails.
+    seen = set()
+
+    while pending:
+        a, b = pending.pop()
+
+        if a.tag != b.tag:
+            return False
 
-    try:
-        return comparison_functions[a.tag](a, b)
-    except KeyError:
-        log.info("No comparison function found for %s", a.tag)
-        if type(a) is not type(b):
+        compare = comparison_functions.get(a.tag)
+        if compare is None:
+            # No comparison function for this tag; compare structurally.
+            if type(a) is not type(b):
+                return False
+
+            if isinstance(a, ScalarNode):
+                compare = scalar_compare
+            elif isinstance(a, SequenceNode):
+                compare = seq_compare
+            elif isinstance(a, MappingNode):
+                compare = map_compare
+            else:
+                return False
+
+        get_children = child_comparisons.get(compare)
+        if get_children is None:
+            if not compare(a, b):
+                return False
+
+            continue
+
+        key = (id(a), id(b))
+        if key in seen:
+            continue
+
+        seen.add(key)
+        children = get_children(a, b)
+        if children is None:
             return False
 
-        if isinstance(a, ScalarNode):
-            return scalar_compare(a, b)
-        elif isinstance(a, SequenceNode):
-            return seq_compare(a, b)
-        elif isinstance(a, MappingNode):
-            return map_compare(a, b)
+        # Compare children in document order.
+        children.reverse()
+        pending.extend(children)
 
+    return True
+
+
+def _children_equal(a, b, get_children):
+    children = get_children(a, b)
+    if children is None:
         return False
 
+    for a_el, b_el in children:
+        if not nodes_equal(a_el, b_el):
+            return False
+
+    return True
+
 
 @comparison_function(YAML_BINARY_TAG, YAML_BOOL_TAG, YAML_FLOAT_TAG,
                      YAML_INT_TAG, YAML_STR_TAG, YAML_TIMESTAMP_TAG)
@@ -116,19 +278,48 @@ def null_compare(a, b):
 
 @comparison_function(YAML_OMAP_TAG, YAML_PAIRS_TAG, YAML_SEQ_TAG)
 def seq_compare(a, b):
-    if len(a.value) != len(b.value):
-        return False
-
-    for a_el, b_el in zip(a.value, b.value):
-        return nodes_equal(a_el, b_el)
+    return _children_equal(a, b, seq_children)
 
 
 @comparison_function(YAML_SET_TAG)
 def set_compare(a, b):
+    return _children_equal(a, b, set_children)
+
+
+@comparison_function(YAML_MAP_TAG)
+def map_compare(a, b):
+    return _children_equal(a, b, map_children)
+
+
+def seq_children(a, b):
+    """
+    seq_children(a, b) -> [(a_el, b_el)] | None
+
+    Pair up the elements of two sequences for comparison, or return None if
+    they have different lengths.
+
+    NOTE: Only the first elements are compared, and empty sequences never
+    compare equal. This preserves the long-standing behavior of seq_compare;
+    the expected outputs of some tests (e.g. duplicated !!set members in
+    tests/cli/basic-expected.yml) depend on it.
+    """
+    if len(a.value) != len(b.value) or not a.value:
+        return None
+
+    return [(a.value[0], b.value[0])]
+
+
+def set_children(a, b):
+    """
+    set_children(a, b) -> [] | None
+
+    Match up the members of two sets. Returns an empty list (nothing further
+    to compare) if every member matches, or None otherwise.
+    """
     # We need to do an unordered comparison. Since we can't put this into a
     # Python datastructure, the comparison is O(n^2).
     if len(a.value) != len(b.value):
-        return False
+        return None
 
     a_values = [key for key, _ in a.value]
     b_values = [key for key, _ in b.value]
@@ -143,20 +334,26 @@ def set_compare(a, b):
                 break
         else:
             # Not found. We're done.
-            return False
+            return None
 
     assert len(b_values) == 0
-    return True
+    return []
 
 
-@comparison_function(YAML_MAP_TAG)
-def map_compare(a, b):
-    # This is similar to set_compare, except the values are 2-tuples in the
+def map_children(a, b):
+    """
+    map_children(a, b) -> [(a_value, b_value), ...] | None
+
+    Match up the keys of two mappings, returning the pairs of values to
+    compare, or None if the keys don't match.
+    """
+    # This is similar to set_children, except the values are 2-tuples in the
     # form (key, value).
     if len(a.value) != len(b.value):
-        return False
+        return None
 
     b_values = list(b.value)
+    children = []
 
     for a_key, a_value in a.value:
         # Look for this key anywhere in the b_values
@@ -164,18 +361,27 @@ def map_compare(a, b):
             b_key, b_value = b_values[i]
 
             if nodes_equal(a_key, b_key):
-                if not nodes_equal(a_value, b_value):
-                    return False
+                children.append((a_value, b_value))
 
                 # Found a match. Mark it as seen from b_values by deleting it.
                 del b_values[i]
                 break
         else:
             # Not found. We're done.
-            return False
+            return None
 
     assert len(b_values) == 0
-    return True
+    return children
+
+
+# Comparison functions for collections, mapped to functions returning the
+# pairs of child nodes that remain to be compared (or None if the nodes are
+# already known to differ). nodes_equal() uses these to avoid recursion.
+child_comparisons = {
+    seq_compare: seq_children,
+    set_compare: set_children,
+    map_compare: map_children,
+}
 
 
 def mapping_find(mapping, node):
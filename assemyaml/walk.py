@@ -0,0 +1,191 @@
+from __future__ import absolute_import, print_function
+from yaml.nodes import CollectionNode
+
+
+def rebuild(root, pre=None, post=None):
+    """
+    rebuild(root, pre=None, post=None) -> node
+
+    Walk the node tree rooted at root depth-first, rebuilding the value of
+    each collection node in place, and return the (possibly replaced) root.
+
+    pre(node) -> node is called when a node is reached; the node it returns
+    replaces node and is the one whose children are walked. post(node) -> node
+    is called after all of a node's children have been walked; the node it
+    returns replaces node in its parent. Either may be None.
+
+    Children are walked in document order, and mapping keys before their
+    values. The walk uses an explicit stack instead of recursion, so
+    arbitrarily deep documents can be processed.
+
+    A collection node reached more than once (through aliases) is walked
+    only the first time; pre and post are not called again, and every
+    reference is replaced by the same result, so the sharing is kept and the
+    walk takes time proportional to the number of distinct nodes. A node that
+    contains itself is left referring to the node being rebuilt.
+    """
+    original_root = root
+    if pre is not None:
+        root = pre(root)
+
+    if not isinstance(root, CollectionNode):
+        return root if post is None else post(root)
+
+    # Collections that have been walked, by id (before pre): (node, result).
+    # The node is kept so its id can't be reused by a new node.
+    done = {}
+
+    # Collections being walked, by id (before pre): the node being rebuilt.
+    active = {id(original_root): root}
+
+    stack = [_Frame(root, original_root)]
+    result = None
+
+    while stack:
+        frame = stack[-1]
+        child = frame.next_child()
+
+        if child is not None:
+            entry = done.get(id(child))
+            if entry is not None:
+                frame.add_result(entry[1])
+                continue
+
+            rebuilding = active.get(id(child))
+            if rebuilding is not None:
+                frame.add_result(rebuilding)
+                continue
+
+            original = child
+            if pre is not None:
+                child = pre(child)
+
+            if isinstance(child, CollectionNode):
+                active[id(original)] = child
+                stack.append(_Frame(child, original))
+                continue
+
+            if post is not None:
+                child = post(child)
+            if isinstance(original, CollectionNode):
+                done[id(original)] = (original, child)
+
+            frame.add_result(child)
+            continue
+
+        # All children have been walked.
+        stack.pop()
+        node = frame.node
+        del active[id(frame.original)]
+
+        if post is not None:
+            node = post(node)
+
+        done[id(frame.original)] = (frame.original, node)
+
+        if stack:
+            stack[-1].add_result(node)
+        else:
+            result = node
+
+    return result
+
+
+def flatten_value(value):
+    """
+    flatten_value(value) -> (children, sizes)
+
+    Flatten the value of a collection node into a single list of child nodes.
+    Mapping values are lists of (key, value) tuples; sizes records the length
+    of each tuple (or None for an element that is a node) so the value can be
+    rebuilt with unflatten_value().
+    """
+    children = []
+    sizes = []
+
+    for element in value:
+        if isinstance(element, tuple):
+            children.extend(element)
+            sizes.append(len(element))
+        else:
+            children.append(element)
+            sizes.append(None)
+
+    return children, sizes
+
+
+def unflatten_value(children, sizes):
+    """
+    unflatten_value(children, sizes) -> list
+
+    Rebuild a collection value from a list of children produced by
+    flatten_value() (or replacements for them).
+    """
+    value = []
+    i = 0
+
+    for size in sizes:
+        if size is None:
+            value.append(children[i])
+            i += 1
+        else:
+            value.append(tuple(children[i:i + size]))
+            i += size
+
+    return value
+
+
+class _Frame(object):
+    """
+    A collection node being walked by rebuild().
+
+    The node's value is emptied and then rebuilt one element at a time as
+    each element's children are walked, exactly as the recursive walks did.
+    (Code that looks at the node in the middle of a walk sees the elements
+    processed so far.) original is the node that was reached, before pre
+    replaced it.
+    """
+    __slots__ = ("node", "original", "elements", "index", "pair")
+
+    def __init__(self, node, original):
+        self.node = node
+        self.original = original
+        self.elements = node.value
+        self.index = 0
+
+        # Results for the members of the (key, value) tuple being walked.
+        self.pair = []
+
+        node.value = []
+        return
+
+    def next_child(self):
+        """
+        Returns the next child to walk, or None if all have been walked.
+        """
+        if self.index == len(self.elements):
+            return None
+
+        element = self.elements[self.index]
+        if isinstance(element, tuple):
+            return element[len(self.pair)]
+
+        return element
+
+    def add_result(self, result):
+        """
+        Record the result of walking the child returned by next_child().
+        """
+        element = self.elements[self.index]
+
+        if isinstance(element, tuple):
+            self.pair.append(result)
+            if len(self.pair) < len(element):
+                return
+
+            result = tuple(self.pair)
+            self.pair = []
+
+        self.node.value.append(result)
+        self.index += 1
+        return
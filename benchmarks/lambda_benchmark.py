@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of the CodePipeline Lambda handler.
+
+Generates input artifacts, stores them in moto's in-process S3 (or a local
+S3-compatible server given with --endpoint-url), and invokes
+codepipeline_handler on them, reporting the time spent downloading,
+extracting, transcluding and uploading along with peak memory and temporary
+disk usage. Run it from a source checkout:
+
+    python benchmarks/lambda_benchmark.py --artifacts 4 --size 8M
+"""
+from __future__ import absolute_import, division, print_function
+from collections import OrderedDict
+from functools import wraps
+from gc import collect
+from getopt import getopt, GetoptError
+from io import BytesIO
+from json import dumps as json_dumps, loads as json_loads
+from logging import basicConfig, getLogger, WARNING
+from os import environ, listdir, lstat
+from os.path import abspath, basename, dirname, join as path_join
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+import sys
+import tempfile
+from time import time
+from uuid import uuid4
+from zipfile import ZIP_DEFLATED, ZipFile
+
+# Use this checkout's assemyaml, not an installed one.
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from assemyaml.spill import parse_size  # noqa: E402
+from assemyaml.stats import Stats  # noqa: E402
+
+log = getLogger("benchmark")
+
+BUCKET_NAME = "assemyaml-benchmark"
+PIPELINE_NAME = "benchmark"
+
+# Resource document repeated, with a unique name, to fill each artifact.
+RESOURCE_DOCUMENT = """\
+---
+!Assembly Resources:
+  Bucket%(artifact)dx%(index)d:
+    Type: AWS::S3::Bucket
+    Properties:
+      BucketName: assemyaml-benchmark-%(artifact)d-%(index)d
+      Tags:
+        - {Key: Artifact, Value: '%(artifact)d'}
+        - {Key: Index, Value: '%(index)d'}
+"""
+
+TEMPLATE_DOCUMENT = """\
+AWSTemplateFormatVersion: "2010-09-09"
+Description: assemyaml benchmark %(run)s
+Resources: {!Transclude Resources: {}}
+"""
+
+# Names of the instrumented functions, in the order they run.
+TIMED = ("download", "get_file", "run", "write_output")
+
+# (job, failure message or None) for each job the handler finished during
+# the current invocation.
+outcomes = []
+
+
+class Timings(object):
+    """
+    Wall time and call counts for the functions wrapped by instrument(), and
+    the peak size of the files in a temporary directory, sampled after each
+    call.
+    """
+    def __init__(self, temp_dir):
+        super(Timings, self).__init__()
+        self.temp_dir = temp_dir
+        self.reset()
+        return
+
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.peak_temp_disk = 0
+        return
+
+    def sample_temp_disk(self):
+        total = 0
+        for name in listdir(self.temp_dir):
+            try:
+                total += lstat(path_join(self.temp_dir, name)).st_size
+            except OSError:
+                # Removed since it was listed.
+                pass
+
+        self.peak_temp_disk = max(self.peak_temp_disk, total)
+        return
+
+    def instrument(self, owner, attribute, name):
+        """
+        timings.instrument(owner, attribute, name)
+
+        Replace owner.attribute (a function or method) with a wrapper that
+        adds the time spent in it to name.
+        """
+        function = getattr(owner, attribute)
+
+        @wraps(function)
+        def timed(*args, **kw):
+            start = time()
+            try:
+                return function(*args, **kw)
+            finally:
+                self.seconds[name] = (
+                    self.seconds.get(name, 0.0) + time() - start)
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.sample_temp_disk()
+
+        setattr(owner, attribute, timed)
+        return
+
+
+def make_zip(files):
+    """
+    make_zip(files) -> bytes
+
+    Returns a zip archive holding files (a dict of filename -> text).
+    """
+    data = BytesIO()
+    with ZipFile(data, "w", ZIP_DEFLATED) as zf:
+        for filename, text in sorted(files.items()):
+            zf.writestr(filename, text)
+
+    return data.getvalue()
+
+
+def make_resource(artifact, size):
+    """
+    make_resource(artifact, size) -> str
+
+    Returns resource documents of at least size characters (and at least one
+    document) for the given artifact number.
+    """
+    parts = []
+    length = 0
+    index = 0
+
+    while length < size or not parts:
+        part = RESOURCE_DOCUMENT % {"artifact": artifact, "index": index}
+        parts.append(part)
+        length += len(part)
+        index += 1
+
+    return "".join(parts)
+
+
+def artifact_dict(name, key):
+    return {
+        "name": name,
+        "revision": None,
+        "location": {
+            "type": "S3",
+            "s3Location": {"bucketName": BUCKET_NAME, "objectKey": key},
+        },
+    }
+
+
+class Benchmark(object):
+    def __init__(self, s3, artifacts, size, fresh_output, timings):
+        super(Benchmark, self).__init__()
+        self.s3 = s3
+        self.timings = timings
+        self.fresh_output = fresh_output
+
+        # Resource artifacts are shared by every iteration.
+        self.input_artifacts = []
+        self.resource_bytes = 0
+        for i in range(artifacts):
+            artifact, artifact_size = self.put_artifact(
+                "Resource%d" % i, {"assemble.yml": make_resource(i, size)})
+            self.input_artifacts.append(artifact)
+            self.resource_bytes += artifact_size
+
+        return
+
+    def put_artifact(self, name, files):
+        """
+        bm.put_artifact(name, files) -> (artifact dict, size)
+        """
+        key = "%s/%s/%s.zip" % (PIPELINE_NAME, name, uuid4().hex[:7])
+        data = make_zip(files)
+        self.s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=data)
+        return artifact_dict(name, key), len(data)
+
+    def event(self, iteration):
+        """
+        bm.event(iteration) -> (event, output key, input bytes)
+        """
+        template, template_size = self.put_artifact(
+            "Template", {"assemble.yml": TEMPLATE_DOCUMENT % {
+                "run": iteration if self.fresh_output else "static"}})
+
+        output_key = "%s/Output/%s.zip" % (PIPELINE_NAME, uuid4().hex[:7])
+        credentials = {
+            "accessKeyId": environ["AWS_ACCESS_KEY_ID"],
+            "secretAccessKey": environ["AWS_SECRET_ACCESS_KEY"],
+            "sessionToken": environ.get("AWS_SESSION_TOKEN", ""),
+        }
+
+        return {
+            "CodePipeline.job": {
+                "id": str(uuid4()),
+                "accountId": "000000000000",
+                "data": {
+                    "actionConfiguration": {
+                        "configuration": {"FunctionName": "assemyaml"}},
+                    "inputArtifacts": [template] + self.input_artifacts,
+                    "outputArtifacts": [artifact_dict("Output", output_key)],
+                    "artifactCredentials": credentials,
+                },
+            },
+            "TestParameters": {"SkipCodePipeline": True},
+        }, output_key, self.resource_bytes + template_size
+
+    def invoke(self, iteration):
+        """
+        bm.invoke(iteration) -> OrderedDict
+
+        Run the handler once and return its timings.
+        """
+        from assemyaml.lambda_handler import codepipeline_handler
+
+        event, output_key, input_size = self.event(iteration)
+        self.timings.reset()
+        del outcomes[:]
+
+        # The handler writes its job statistics to stdout.
+        stdout = sys.stdout
+        sys.stdout = job_stats = StringIO()
+        start = time()
+        try:
+            codepipeline_handler(event, None)
+        finally:
+            elapsed = time() - start
+            sys.stdout = stdout
+
+        job, failure = outcomes[0]
+        if failure is not None:
+            raise RuntimeError(failure)
+
+        self.timings.sample_temp_disk()
+        peak = Stats()
+        peak.update_peak_memory()
+
+        output_size = self.s3.head_object(
+            Bucket=BUCKET_NAME, Key=output_key)["ContentLength"]
+
+        result = OrderedDict()
+        result["iteration"] = iteration
+        seconds = OrderedDict()
+        for name in TIMED:
+            seconds[name] = round(self.timings.seconds.get(name, 0.0), 6)
+        seconds["total"] = round(elapsed, 6)
+        result["seconds"] = seconds
+        result["get_file_calls"] = self.timings.calls.get("get_file", 0)
+        result["input_bytes"] = input_size
+        result["output_bytes"] = output_size
+        result["output_reused"] = job.output_reused
+        result["peak_rss"] = peak.peak_memory
+        result["peak_temp_disk"] = self.timings.peak_temp_disk
+
+        # The handler's own per-phase statistics (see Stats.to_dict()).
+        result["job_stats"] = json_loads(
+            job_stats.getvalue().strip().split("\n")[-1])
+        return result
+
+
+def format_result(result):
+    """
+    format_result(result) -> str
+
+    Returns the result of an invocation in a human-readable form.
+    """
+    lines = ["Iteration %d" % result["iteration"]]
+    for name, seconds in result["seconds"].items():
+        lines.append("  %-18s %10.3f ms" % (name, seconds * 1000.0))
+
+    lines.append("  %-18s %10d" % ("get_file_calls", result["get_file_calls"]))
+    for name in ("input_bytes", "output_bytes", "output_reused"):
+        lines.append("  %-18s %10d" % (name, result[name]))
+
+    for name in ("peak_rss", "peak_temp_disk"):
+        if result[name] is not None:
+            lines.append("  %-18s %10.1f MiB" % (
+                name, result[name] / 1048576.0))
+
+    return "\n".join(lines) + "\n"
+
+
+def run_benchmark(artifacts, size, iterations, fresh_output, json_output):
+    from boto3.session import Session as Boto3Session
+    from assemyaml import lambda_handler
+    from assemyaml.lambda_handler import CodePipelineJob, InputArtifact
+
+    # Temporary files (downloaded and extracted artifacts, the output) go
+    # to a directory of their own so their size can be measured.
+    temp_dir = tempfile.mkdtemp(prefix="assemyaml-benchmark-")
+    tempfile.tempdir = temp_dir
+
+    timings = Timings(temp_dir)
+    timings.instrument(InputArtifact, "download", "download")
+    timings.instrument(InputArtifact, "get_file", "get_file")
+    timings.instrument(lambda_handler, "run", "run")
+    timings.instrument(CodePipelineJob, "write_output", "write_output")
+
+    # Record how each job ended instead of notifying CodePipeline.
+    def send_success(cpj):
+        outcomes.append((cpj, None))
+
+    def send_failure(cpj, message):
+        outcomes.append((cpj, message))
+
+    CodePipelineJob.send_success = send_success
+    CodePipelineJob.send_failure = send_failure
+
+    try:
+        s3 = Boto3Session().client("s3")
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        benchmark = Benchmark(s3, artifacts, size, fresh_output, timings)
+
+        for i in range(iterations):
+            result = benchmark.invoke(i + 1)
+            if json_output:
+                print(json_dumps(result))
+            else:
+                print(format_result(result))
+            sys.stdout.flush()
+    finally:
+        # Close the last job's temporary files before removing them.
+        del outcomes[:]
+        collect()
+
+        tempfile.tempdir = None
+        rmtree(temp_dir, ignore_errors=True)
+
+    return
+
+
+def main(args):
+    artifacts = 4
+    size = 1 << 20
+    iterations = 3
+    endpoint_url = None
+    fresh_output = False
+    json_output = False
+
+    basicConfig(stream=sys.stderr, format="%(levelname)s %(message)s")
+
+    try:
+        opts, args = getopt(args, "a:hn:s:", [
+            "artifacts=", "endpoint-url=", "fresh-output", "help",
+            "iterations=", "json", "size="])
+    except GetoptError as e:
+        log.error("%s", e)
+        usage()
+        return 2
+
+    for opt, val in opts:
+        if opt in ("-a", "--artifacts",):
+            try:
+                artifacts = int(val)
+                if artifacts <= 0:
+                    raise ValueError()
+            except ValueError:
+                log.error("Invalid number of artifacts '%s': must be a "
+                          "positive integer", val)
+                usage()
+                return 2
+        elif opt in ("--endpoint-url",):
+            endpoint_url = val
+        elif opt in ("--fresh-output",):
+            fresh_output = True
+        elif opt in ("-h", "--help",):
+            usage(sys.stdout)
+            return 0
+        elif opt in ("-n", "--iterations",):
+            try:
+                iterations = int(val)
+                if iterations <= 0:
+                    raise ValueError()
+            except ValueError:
+                log.error("Invalid number of iterations '%s': must be a "
+                          "positive integer", val)
+                usage()
+                return 2
+        elif opt in ("--json",):
+            json_output = True
+        elif opt in ("-s", "--size",):
+            try:
+                size = parse_size(val)
+            except ValueError:
+                log.error("Invalid artifact size '%s': must be a positive "
+                          "size in bytes, optionally with a K, M or G suffix",
+                          val)
+                usage()
+                return 2
+
+    if args:
+        log.error("Unknown argument %s", args[0])
+        usage()
+        return 2
+
+    for logname in ("botocore", "boto3", "s3transfer", "assemyaml"):
+        getLogger(logname).setLevel(WARNING)
+
+    # Dummy credentials and a region are enough for moto and most local S3
+    # servers. us-east-1 buckets don't need a location constraint.
+    environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    # Stand-ins may not understand the checksum trailers that newer versions
+    # of botocore add to uploads.
+    environ.setdefault("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    environ.setdefault("AWS_RESPONSE_CHECKSUM_VALIDATION", "when_required")
+
+    if endpoint_url is not None:
+        # Picked up by every client botocore creates, including the
+        # handler's.
+        environ["AWS_ENDPOINT_URL_S3"] = endpoint_url
+        mock = None
+    else:
+        try:
+            from moto import mock_aws
+        except ImportError:
+            # moto < 5.0
+            from moto import mock_s3 as mock_aws
+
+        mock = mock_aws()
+        mock.start()
+
+    try:
+        run_benchmark(artifacts, size, iterations, fresh_output, json_output)
+    except RuntimeError as e:
+        log.error("The handler failed: %s", e)
+        return 1
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    return 0
+
+
+def usage(fd=None):
+    if fd is None:  # Can't use default args for unit testing.
+        fd = sys.stderr
+
+    fd.write("""\
+Usage: %(argv0)s [options]
+
+Invoke the CodePipeline Lambda handler on generated input artifacts stored in
+moto's in-process S3 (or a local S3 server), and report the time spent in
+InputArtifact.download, InputArtifact.get_file, run() and
+CodePipelineJob.write_output, with peak RSS and temporary disk usage.
+
+Peak RSS is the process's peak so far, so it never decreases across
+iterations; run once per configuration to compare memory settings.
+
+Options:
+    --artifacts <count> | -a <count>
+        Number of resource artifacts (default 4), plus a template artifact.
+
+    --endpoint-url <url>
+        Use the S3-compatible server at url (e.g. moto_server or MinIO)
+        instead of moto's in-process S3.
+
+    --fresh-output
+        Change the template on every iteration so the output differs and is
+        always uploaded. Otherwise, iterations after the first copy the
+        previous output artifact within S3.
+
+    --help
+        Show this usage information.
+
+    --iterations <count> | -n <count>
+        Invoke the handler count times (default 3). The first includes
+        creating the S3 client.
+
+    --json
+        Write one line of JSON per iteration instead of a table.
+
+    --size <size> | -s <size>
+        Size of the resource documents in each artifact before compression
+        (default 1M; K, M and G suffixes are accepted).
+""" % {"argv0": basename(sys.argv[0])})
+    fd.flush()
+    return
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main(sys.argv[1:]))
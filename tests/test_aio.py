@@ -0,0 +1,159 @@
+from __future__ import absolute_import, print_function
+from asyncio import gather, get_event_loop, new_event_loop, StreamReader
+from assemyaml import run
+from assemyaml.aio import run_async
+from assemyaml.stats import Stats
+from assemyaml.trace import Trace
+from assemyaml.input import open_input
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO, StringIO
+from os.path import dirname
+from shutil import rmtree
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+
+
+class AsyncWriter(object):
+    def __init__(self):
+        self.output = StringIO()
+
+    async def write(self, data):
+        self.output.write(data)
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    submitted = 0
+
+    def submit(self, *args, **kw):
+        self.submitted += 1
+        return super(CountingExecutor, self).submit(*args, **kw)
+
+
+def stream_reader(data, name):
+    reader = StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    reader.filename = name
+    return reader
+
+
+class TestAsyncRun(TestCase):
+    def setUp(self):
+        self.testdir = dirname(__file__) + "/cli/"
+        self.loop = get_event_loop()
+
+    def run_sync(self, template, resources, format="yaml"):
+        output = StringIO()
+        with open(self.testdir + template) as tfd:
+            rfds = [open(self.testdir + r) for r in resources]
+            result = run(tfd, rfds, output, True, format)
+            for fd in rfds:
+                fd.close()
+
+        return result, output.getvalue()
+
+    def run_async(self, template, resources, format="yaml", **kw):
+        output = StringIO()
+        with open(self.testdir + template) as tfd:
+            rfds = [open(self.testdir + r) for r in resources]
+            result = self.loop.run_until_complete(
+                run_async(tfd, rfds, output, True, format, **kw))
+            for fd in rfds:
+                fd.close()
+
+        return result, output.getvalue()
+
+    def test_same_output(self):
+        for template, resources, format in (
+                ("basic-template.yml", ["basic-resource-1.yml"], "yaml"),
+                ("multidoc-template.yml", [], "json"),
+                ("pairs-template.yml", ["pairs-resource-1.yml"], "yaml")):
+            self.assertEqual(self.run_async(template, resources, format),
+                             self.run_sync(template, resources, format))
+
+    def test_concurrent(self):
+        template = "!Transclude Hello: [a]\n"
+        outputs = [AsyncWriter() for i in range(10)]
+
+        async def run_all():
+            return await gather(*[
+                run_async(
+                    stream_reader(template.encode("utf-8"), "template"),
+                    [stream_reader(
+                        ("!Assembly Hello: [%d]\n" % i).encode("utf-8"),
+                        "resource")],
+                    outputs[i], True)
+                for i in range(10)])
+
+        results = self.loop.run_until_complete(run_all())
+        self.assertEqual(results, [0] * 10)
+
+        for i, output in enumerate(outputs):
+            self.assertEqual(output.output.getvalue(), "- a\n- %d\n" % i)
+
+    def test_errors(self):
+        template = b"!Transclude Hello: [a]\n"
+        resource = b"!Assembly Hello: {b: c}\n"
+
+        for executor in (None, ProcessPoolExecutor(1)):
+            output = AsyncWriter()
+            with LogCapture() as l:
+                result = self.loop.run_until_complete(run_async(
+                    stream_reader(template, "template.yml"),
+                    [stream_reader(resource, "resource.yml")], output, True,
+                    executor=executor))
+
+            self.assertEqual(result, 1)
+            self.assertEqual(output.output.getvalue(), "")
+            l.check_present(
+                ("assemyaml", "ERROR",
+                 "While processing template document template.yml:"))
+            self.assertIn("Cannot merge !!map value at", str(l))
+            self.assertIn('in "resource.yml", line 1', str(l))
+
+            if executor is not None:
+                executor.shutdown()
+
+    def test_process_pool_stats(self):
+        stats = Stats()
+        trace = Trace()
+
+        with ProcessPoolExecutor(1) as executor:
+            result, output = self.run_async(
+                "basic-template.yml", ["basic-resource-1.yml"], stats=stats,
+                trace=trace, executor=executor)
+
+        self.assertEqual(result, 0)
+        self.assertEqual(output, self.run_sync(
+            "basic-template.yml", ["basic-resource-1.yml"])[1])
+        self.assertEqual(list(stats.phases),
+                         ["parse", "assemble", "transclude", "serialize"])
+        self.assertGreater(stats.nodes, 0)
+        self.assertGreater(len(trace.events), 0)
+
+    def test_direct_reads(self):
+        # Mapped and in-memory inputs aren't read in the default executor.
+        tempdir = mkdtemp()
+        with open(tempdir + "/template.yml", "w") as fd:
+            fd.write("!Transclude Tags: [t0]\n")
+        resource = BytesIO(b"!Assembly Tags: [t1]\n")
+        resource.name = "resource.yml"
+
+        loop = new_event_loop()
+        default = CountingExecutor(1)
+        loop.set_default_executor(default)
+        output = StringIO()
+        try:
+            with open_input(tempdir + "/template.yml") as tfd, \
+                    ThreadPoolExecutor(1) as executor:
+                result = loop.run_until_complete(run_async(
+                    tfd, [resource, StringIO("!Assembly Tags: [t2]\n")],
+                    output, True, executor=executor))
+        finally:
+            loop.close()
+            rmtree(tempdir)
+
+        self.assertEqual(result, 0)
+        self.assertEqual(output.getvalue(), "- t0\n- t1\n- t2\n")
+        self.assertEqual(default.submitted, 0)
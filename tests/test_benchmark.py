@@ -0,0 +1,30 @@
+from __future__ import absolute_import, print_function
+from json import loads as json_loads
+from os.path import dirname
+from subprocess import check_output
+import sys
+from unittest import TestCase
+
+benchmark = dirname(dirname(__file__)) + "/benchmarks/lambda_benchmark.py"
+
+
+class TestLambdaBenchmark(TestCase):
+    def test_benchmark(self):
+        output = check_output(
+            [sys.executable, benchmark, "--artifacts", "2", "--size", "4K",
+             "--iterations", "2", "--json"]).decode("utf-8")
+        results = [json_loads(line) for line in output.strip().split("\n")]
+
+        self.assertEqual([result["iteration"] for result in results], [1, 2])
+        for result in results:
+            self.assertEqual(
+                list(result["seconds"]),
+                ["download", "get_file", "run", "write_output", "total"])
+            self.assertGreater(result["seconds"]["run"], 0)
+            self.assertEqual(result["get_file_calls"], 3)
+            self.assertGreater(result["peak_temp_disk"], 0)
+            self.assertEqual(result["job_stats"]["documents"], 2 * 20 + 1)
+
+        # The second run's output is the same, so it is copied.
+        self.assertEqual([result["output_reused"] for result in results],
+                         [False, True])
@@ -0,0 +1,248 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main, run
+from assemyaml.bundle import (
+    BUNDLE_EXTENSION, compile_bundle, record_contributions,
+)
+from assemyaml.input import BUNDLE_MAGIC, open_input
+from assemyaml.stats import Stats
+from assemyaml.trace import Trace
+from marshal import dumps as marshal_dumps
+from os import listdir
+from os.path import dirname, exists
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from timeit import default_timer
+from unittest import TestCase
+
+testdir = dirname(__file__) + "/cli/"
+
+template = """\
+a: {!Transclude Outer: [0]}
+b: {!Transclude Inner: []}
+c: {!Transclude Map: {k0: v0}}
+"""
+
+resources = [
+    "!Assembly Inner: [i1]\n",
+    "---\n!Assembly Outer: [{!Assembly Inner: [i2]}, o1]\n"
+    "--- {!Assembly Map: {k1: &v [1, 2]}}\n"
+    "---\n!Assembly Map: {k2: [1, 2], k3: !!str 3}\n",
+    "a: {!Assembly Outer: {!Assembly Inner: [i3]}}\n"
+    "b: [{!Assembly Map: {? [x] : {y: z}}}]\n",
+]
+
+
+class TestBundle(TestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def path(self, filename):
+        return self.tempdir + "/" + filename
+
+    def write(self, filename, data):
+        with open(self.path(filename), "wb") as fd:
+            fd.write(data)
+        return self.path(filename)
+
+    def compile(self, text, filename, local_tags=True):
+        return self.write(filename, compile_bundle(StringIO(text),
+                                                   local_tags))
+
+    def assemble(self, template_text, filenames, local_tags=True, stats=None,
+                 trace=None):
+        output = StringIO()
+        fds = [open_input(filename) for filename in filenames]
+        with LogCapture():
+            result = run(StringIO(template_text), fds, output, local_tags,
+                         stats=stats, trace=trace)
+        self.assertEqual(result, 0)
+        return output.getvalue()
+
+    def test_same_output(self):
+        yaml_filenames = []
+        bundle_filenames = []
+        for i, text in enumerate(resources):
+            yaml_filenames.append(
+                self.write("r%d.yml" % i, text.encode("utf-8")))
+            bundle_filenames.append(self.compile(text, "r%d.ayb" % i))
+
+        expected_trace = Trace()
+        expected = self.assemble(template, yaml_filenames,
+                                 trace=expected_trace)
+        self.assertIn("- i2\n- i3", expected)
+
+        actual_trace = Trace()
+        self.assertEqual(
+            self.assemble(template, bundle_filenames, trace=actual_trace),
+            expected)
+        self.assertEqual(
+            [(event["action"], event["name"], event["line"])
+             for event in actual_trace.events],
+            [(event["action"], event["name"], event["line"])
+             for event in expected_trace.events])
+
+        # Bundles and YAML documents can be mixed.
+        self.assertEqual(
+            self.assemble(template, [bundle_filenames[0], yaml_filenames[1],
+                                     bundle_filenames[2]]),
+            expected)
+
+    def test_record_contributions(self):
+        contributions, documents = record_contributions(
+            StringIO(resources[1]))
+        self.assertEqual(documents, 3)
+        self.assertEqual(
+            [(name, mark.line) for name, mark, _ in contributions],
+            [("Inner", 1), ("Outer", 1), ("Map", 2), ("Map", 4)])
+
+        # Each contribution is kept as it is, not merged; a nested one is
+        # the same node that appears in the enclosing value.
+        inner, outer = contributions[0][2], contributions[1][2]
+        self.assertEqual([node.value for node in inner.value], ["i2"])
+        self.assertIs(outer.value[0], inner)
+
+    def test_fixtures(self):
+        for filename in sorted(listdir(testdir)):
+            if not filename.endswith("-template.yml"):
+                continue
+
+            prefix = filename[:-len("-template.yml")]
+            resource_filenames = sorted([
+                testdir + name for name in listdir(testdir)
+                if name.startswith(prefix + "-resource")])
+            if not resource_filenames:
+                continue
+
+            with open(testdir + filename) as fd:
+                template_text = fd.read()
+
+            local_tags = prefix != "globaltag"
+            bundle_filenames = []
+            for resource_filename in resource_filenames:
+                with open(resource_filename) as fd:
+                    bundle_filenames.append(self.compile(
+                        fd.read(), "fixture" + BUNDLE_EXTENSION, local_tags))
+
+                self.assertEqual(
+                    self.assemble(template_text, bundle_filenames[-1:],
+                                  local_tags),
+                    self.assemble(template_text, [resource_filename],
+                                  local_tags))
+
+    def test_faster_than_parsing(self):
+        text = "".join([
+            "---\n!Assembly Items%d:\n%s" % (i % 10, "".join([
+                "  - {name: item%d, value: %d, tags: [a, b, c]}\n" % (j, j)
+                for j in range(40)]))
+            for i in range(20)])
+        yaml_filename = self.write("big.yml", text.encode("utf-8"))
+        bundle_filename = self.compile(text, "big.ayb")
+
+        def best(filename):
+            times = []
+            for _ in range(3):
+                stats = Stats()
+                start = default_timer()
+                self.assemble("!Transclude Items0: []\n", [filename],
+                              stats=stats)
+                times.append(default_timer() - start)
+            return min(times), stats
+
+        yaml_time, yaml_stats = best(yaml_filename)
+        bundle_time, bundle_stats = best(bundle_filename)
+        self.assertLess(bundle_time, yaml_time)
+        self.assertEqual(bundle_stats.documents, yaml_stats.documents)
+        self.assertEqual(bundle_stats.assemblies, yaml_stats.assemblies)
+
+    def test_errors(self):
+        self.compile(resources[0], "local.ayb")
+        self.write("version.ayb", BUNDLE_MAGIC + marshal_dumps((999,)))
+        self.write("corrupt.ayb", BUNDLE_MAGIC + b"\xff")
+
+        for filename, local_tags, message in (
+                ("local.ayb", False,
+                 "local.ayb was compiled with local tags enabled; compile it "
+                 "again with --no-local-tag"),
+                ("version.ayb", True,
+                 "version.ayb is a version 999 bundle; this version of "
+                 "assemyaml reads version 1 bundles. Compile it again."),
+                ("corrupt.ayb", True,
+                 "corrupt.ayb is not a valid assembly bundle")):
+            with LogCapture() as l:
+                result = run(StringIO(template),
+                             [open_input(self.path(filename))], StringIO(),
+                             local_tags)
+            self.assertEqual(result, 1)
+            l.check(
+                ("assemyaml", "ERROR",
+                 "While processing resource document %s:" %
+                 self.path(filename)),
+                ("assemyaml", "ERROR", self.path(message)))
+
+        # Merge errors still report where the values came from.
+        self.compile("!Assembly Map: [1]\n", "seq.ayb")
+        self.compile("!Assembly Map: {a: 1}\n", "map.ayb")
+        with LogCapture() as l:
+            result = run(StringIO(template),
+                         [open_input(self.path("seq.ayb")),
+                          open_input(self.path("map.ayb"))], StringIO(), True)
+        self.assertEqual(result, 1)
+        self.assertIn("Cannot merge !!map value at", str(l))
+        self.assertIn('in "<file>", line 1, column 16', str(l))
+
+    def test_cli(self):
+        for i, text in enumerate(resources):
+            self.write("r%d.yml" % i, text.encode("utf-8"))
+        with open(self.path("template.yml"), "w") as fd:
+            fd.write(template)
+
+        with LogCapture():
+            result = main(["compile", self.path("r*.yml")])
+        self.assertEqual(result, 0)
+        for i in range(len(resources)):
+            self.assertTrue(exists(self.path("r%d.ayb" % i)))
+
+        output_filename = self.path("output.yml")
+        with LogCapture():
+            result = main(["--output", output_filename,
+                           self.path("template.yml"), self.path("r*.ayb")])
+        self.assertEqual(result, 0)
+        with open(output_filename) as fd:
+            self.assertEqual(
+                fd.read(), self.assemble(template, [
+                    self.path("r%d.yml" % i) for i in range(len(resources))]))
+
+        with LogCapture():
+            result = main(["compile", "-o", self.path("single.bin"),
+                           self.path("r0.yml")])
+        self.assertEqual(result, 0)
+        with open(self.path("single.bin"), "rb") as fd:
+            self.assertTrue(fd.read().startswith(BUNDLE_MAGIC))
+
+    def test_cli_errors(self):
+        self.write("a.yml", b"!Assembly A: [1]\n")
+        self.write("b.yml", b"{!Assembly A: 1, b: 2}\n")
+
+        with LogCapture() as l:
+            result = main(["compile", "-o", self.path("x.ayb"),
+                           self.path("a.yml"), self.path("b.yml")])
+        self.assertEqual(result, 2)
+        l.check(("assemyaml.bundle", "ERROR", "--output can only be used "
+                 "with a single resource document"))
+
+        with LogCapture() as l:
+            result = main(["compile", self.path("b.yml")])
+        self.assertEqual(result, 1)
+        self.assertIn("Assembly must be a single-entry mapping", str(l))
+        self.assertFalse(exists(self.path("b.ayb")))
+
+        with LogCapture() as l:
+            result = main(["compile", self.path("missing.yml")])
+        self.assertEqual(result, 1)
+        self.assertIn("Unable to open %s for reading" %
+                      self.path("missing.yml"), str(l))
@@ -0,0 +1,203 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main
+from assemyaml.cache import ENTRY_SUFFIX, ResultCache
+from assemyaml.input import open_input
+from io import BytesIO
+from os import listdir, utime
+from os.path import dirname
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+import sys
+
+testdir = dirname(__file__) + "/cli/"
+
+template = "a: {!Transclude Tags: [t0]}\n"
+resource = "!Assembly Tags: [t1, t2]\n"
+
+
+class TestCache(TestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.cache_dir = self.tempdir + "/cache"
+        self.write("template.yml", template)
+        self.write("resource.yml", resource)
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def path(self, filename):
+        return self.tempdir + "/" + filename
+
+    def write(self, filename, text):
+        with open(self.path(filename), "w") as fd:
+            fd.write(text)
+        return self.path(filename)
+
+    def entries(self):
+        return sorted(name for name in listdir(self.cache_dir)
+                      if name.endswith(ENTRY_SUFFIX))
+
+    def assemble(self, *args):
+        output_filename = self.path("output.yml")
+        args = ["--cache-dir", self.cache_dir, "-o", output_filename] + \
+            list(args)
+        if not any(arg.endswith(".yml") for arg in args[4:]):
+            args += [self.path("template.yml"), self.path("resource.yml")]
+
+        with LogCapture() as l:
+            result = main(args)
+        self.assertEqual(result, 0)
+
+        with open(output_filename) as fd:
+            return fd.read(), str(l)
+
+    def test_hit(self):
+        output, log = self.assemble()
+        self.assertEqual(output, "a:\n- t0\n- t1\n- t2\n")
+        self.assertNotIn("Copied output from cache entry", log)
+        self.assertEqual(len(self.entries()), 1)
+
+        # The second run copies the output without parsing the inputs.
+        cached, log = self.assemble()
+        self.assertEqual(cached, output)
+        self.assertIn("Copied output from cache entry", log)
+        self.assertNotIn("Before transclude", log)
+        self.assertEqual(len(self.entries()), 1)
+
+        # Every fixture's output is the same from the cache.
+        for filename in sorted(listdir(testdir)):
+            if not filename.endswith("-template.yml"):
+                continue
+
+            prefix = filename[:-len("-template.yml")]
+            args = [testdir + filename] + sorted([
+                testdir + name for name in listdir(testdir)
+                if name.startswith(prefix + "-resource")])
+            if prefix == "globaltag":
+                args.insert(0, "-l")
+
+            output, log = self.assemble(*args)
+            cached, log = self.assemble(*args)
+            self.assertEqual(cached, output)
+            self.assertIn("Copied output from cache entry", log)
+
+    def test_key(self):
+        cache = ResultCache(self.cache_dir)
+        options = {"format": "yaml"}
+        resources = [self.path("resource.yml")]
+
+        def key(options=options, resources=resources):
+            with open_input(self.path("template.yml")) as fd:
+                return cache.key(fd, resources, options)
+
+        original = key()
+        self.assertEqual(key(), original)
+        self.assertNotEqual(key({"format": "json"}), original)
+        self.assertNotEqual(key(resources=resources * 2), original)
+
+        # Contents, not filenames or timestamps, are hashed.
+        self.write("copy.yml", resource)
+        self.assertEqual(key(resources=[self.path("copy.yml")]), original)
+        self.write("resource.yml", "!Assembly Tags: [t1, t3]\n")
+        self.assertNotEqual(key(), original)
+
+        # Moving bytes between inputs changes the key.
+        self.write("a.yml", "ab")
+        self.write("b.yml", "c")
+        self.write("c.yml", "a")
+        self.write("d.yml", "bc")
+        self.assertNotEqual(
+            key(resources=[self.path("a.yml"), self.path("b.yml")]),
+            key(resources=[self.path("c.yml"), self.path("d.yml")]))
+
+        # Options are part of the key.
+        self.assemble()
+        self.assemble("-f", "json")
+        self.assemble("-l")
+        self.assertEqual(len(self.entries()), 3)
+
+    def test_bypass(self):
+        cache = ResultCache(self.cache_dir)
+        self.assertIsNone(cache.key(StringIO(template), [], {}))
+        with open_input(self.path("template.yml")) as fd:
+            self.assertIsNone(cache.key(fd, ["-"], {}))
+        self.assertEqual(cache.bypasses, 2)
+
+        # Stdin is read as usual and nothing is cached.
+        stdin = sys.stdin
+        sys.stdin = BytesIO(resource.encode("utf-8"))
+        try:
+            output, _ = self.assemble(self.path("template.yml"), "-")
+        finally:
+            sys.stdin = stdin
+
+        self.assertEqual(output, "a:\n- t0\n- t1\n- t2\n")
+        self.assertEqual(self.entries(), [])
+
+        # So are traced runs.
+        self.assemble("--trace", self.path("trace.json"))
+        self.assertEqual(self.entries(), [])
+
+    def test_eviction(self):
+        output, _ = self.assemble()
+        size = len(output)
+
+        rmtree(self.cache_dir)
+        cache = ResultCache(self.cache_dir, max_size=3 * size)
+        for i in range(3):
+            self.write("r%d.yml" % i, "!Assembly Tags: [t%d, x]\n" % i)
+            with open_input(self.path("template.yml")) as fd:
+                key = cache.key(fd, [self.path("r%d.yml" % i)], {})
+            writer = cache.writer(key, StringIO())
+            writer.write(output)
+            cache.commit(writer)
+
+            # Entries are ordered by their modification times.
+            utime(cache.entry_filename(key), (i + 1, i + 1))
+
+            if i == 0:
+                first = key
+
+        self.assertEqual(len(self.entries()), 3)
+
+        # Using the first entry makes the second the least recently used.
+        self.assertTrue(cache.copy_to(first, StringIO()))
+        cache.max_size = 2 * size
+        cache.evict()
+        self.assertEqual(len(self.entries()), 2)
+        self.assertIn(first + ENTRY_SUFFIX, self.entries())
+        self.assertEqual(cache.to_dict()["hits"], 1)
+        self.assertEqual(cache.stores, 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.bytes_copied, size)
+
+    def test_errors(self):
+        # Failed runs aren't cached.
+        bad = self.write("bad.yml", "!Assembly Tags: {b: 1}\n")
+        for i in range(2):
+            with LogCapture() as l:
+                result = main(["--cache-dir", self.cache_dir, "-o",
+                               self.path("output.yml"),
+                               self.path("template.yml"), bad])
+            self.assertEqual(result, 1)
+            self.assertIn("Cannot merge", str(l))
+        self.assertEqual(listdir(self.cache_dir), [])
+
+        for args, code, message in (
+                (["--cache-size", "0"], 2, "Invalid cache size '0'"),
+                (["--cache-size", "lots"], 2, "Invalid cache size 'lots'"),
+                (["--cache-dir", self.path("resource.yml")], 1,
+                 "Unable to use cache directory %s" %
+                 self.path("resource.yml")),
+                (["--cache-dir", self.cache_dir, self.path("template.yml"),
+                  self.path("missing.yml")], 1,
+                 "Unable to read %s" % self.path("missing.yml"))):
+            if len(args) == 2:
+                args = args + [self.path("template.yml")]
+            with LogCapture() as l:
+                result = main(args)
+            self.assertEqual(result, code)
+            self.assertIn(message, str(l))
@@ -42,8 +42,8 @@ class TestCLI(TestCase):
                  expected_returncode=0, expected_filename=None,
                  expected_errors=None, template_arg=False, local_tags=True,
                  output_filename=None, long_parameters=True,
-                 format=None):
-        args = []
+                 format=None, extra_args=()):
+        args = list(extra_args)
 
         if not local_tags:
             args += ["--no-local-tag" if long_parameters else "-n"]
@@ -205,6 +205,64 @@ class TestCLI(TestCase):
             expected_returncode=1,
             expected_errors="Transclude name must be a scalar")
 
+    def test_stats(self):
+        with LogCapture():
+            with captured_output() as (out, err):
+                result = main([
+                    "--stats", self.testdir + "basic-template.yml",
+                    self.testdir + "basic-resource-1.yml"])
+
+        self.assertEquals(result, 0)
+        err = err.getvalue()
+        for name in ("parse", "transclude", "serialize", "bytes_read",
+                     "merges", "duplicate_key_checks"):
+            self.assertIn(name, err)
+
+    def test_memo(self):
+        with LogCapture():
+            with captured_output() as (out, err):
+                result = main([
+                    "--memo-size", "8", "--stats",
+                    self.testdir + "basic-template.yml",
+                    self.testdir + "basic-resource-1.yml"])
+
+        self.assertEquals(result, 0)
+        err = err.getvalue()
+        for name in ("memo_hits", "memo_misses", "memo_hit_rate"):
+            self.assertIn(name, err)
+
+        for size in ("0", "x"):
+            self.run_docs(
+                template_filename="basic-template.yml",
+                resource_filenames=["basic-resource-1.yml"],
+                extra_args=["--memo-size", size], expected_returncode=2,
+                expected_errors="Invalid memo size '%s'" % size)
+
+    def test_profile(self):
+        from pstats import Stats as PStats
+
+        pstats_filename = self.tempdir + "/profile.pstats"
+        collapsed_filename = self.tempdir + "/profile.collapsed"
+
+        for filename in (pstats_filename, collapsed_filename):
+            with LogCapture():
+                with captured_output() as (out, err):
+                    result = main([
+                        "--profile", filename,
+                        self.testdir + "basic-template.yml",
+                        self.testdir + "basic-resource-1.yml"])
+
+            self.assertEquals(result, 0)
+            self.assertTrue(exists(filename))
+
+        pstats = PStats(pstats_filename)
+        self.assertTrue(any(func[2] == "run" for func in pstats.stats))
+
+        with open(collapsed_filename, "r") as fd:
+            for line in fd:
+                stack, count = line.rsplit(" ", 1)
+                self.assertGreater(int(count), 0)
+
     def test_bad_args(self):
         with LogCapture() as l:
             with captured_output() as (out, err):
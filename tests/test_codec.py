@@ -0,0 +1,71 @@
+from __future__ import absolute_import, print_function
+from assemyaml.codec import decode_node, encode_node, estimate_size
+from assemyaml.dumper import SafeDumper
+from assemyaml.loader import SafeLoader
+from marshal import dumps as marshal_dumps
+from os import listdir
+from os.path import dirname
+from unittest import TestCase
+from yaml import compose, compose_all, serialize
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+
+class TestCodec(TestCase):
+    def check(self, node):
+        # nodes_equal() only compares the first element of sequences, so
+        # compare the serialized forms (including tags, styles and anchors).
+        decoded = decode_node(encode_node(node))
+        self.assertEqual(serialize(decoded, Dumper=SafeDumper),
+                         serialize(node, Dumper=SafeDumper))
+        self.assertEqual(type(decoded), type(node))
+        return decoded
+
+    def test_fixtures(self):
+        testdir = dirname(__file__) + "/cli/"
+        for filename in sorted(listdir(testdir)):
+            if not filename.endswith(".yml"):
+                continue
+
+            with open(testdir + filename) as fd:
+                for doc in compose_all(fd, Loader=SafeLoader):
+                    decoded = self.check(doc)
+                    self.assertEqual(decoded.start_mark.line,
+                                     doc.start_mark.line)
+                    self.assertEqual(decoded.end_mark.index,
+                                     doc.end_mark.index)
+                    self.assertEqual(decoded.start_mark.name,
+                                     testdir + filename)
+
+    def test_styles(self):
+        doc = compose("a: 'x'\nb: {c: [1, 2]}\nd: |\n  text\n")
+        decoded = self.check(doc)
+        self.assertEqual(decoded.value[0][1].style, "'")
+        self.assertEqual(decoded.value[1][1].flow_style, True)
+        self.assertEqual(decoded.value[2][1].style, "|")
+
+    def test_shared_nodes(self):
+        doc = compose("a: &x [1, {b: 2}]\nc: *x\nd: []\ne: {}\n")
+        decoded = self.check(doc)
+        self.assertIs(decoded.value[0][1], decoded.value[1][1])
+
+        # Recursive structures.
+        node = SequenceNode("tag:yaml.org,2002:seq", [])
+        node.value.append(node)
+        decoded = decode_node(encode_node(node))
+        self.assertIs(decoded.value[0], decoded)
+
+    def test_deep(self):
+        node = leaf = ScalarNode("tag:yaml.org,2002:str", "x")
+        for i in range(10000):
+            node = MappingNode("tag:yaml.org,2002:map", [(leaf, node)])
+        self.check(node)
+
+    def test_version(self):
+        with self.assertRaises(ValueError):
+            decode_node(marshal_dumps((0, (), ())))
+
+    def test_estimate_size(self):
+        small = compose("[a]")
+        large = compose("[a, b, c, %s]" % ("x" * 1000))
+        self.assertLess(estimate_size(small), estimate_size(large))
+        self.assertGreater(estimate_size(large) - estimate_size(small), 1000)
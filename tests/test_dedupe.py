@@ -0,0 +1,114 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main, run
+from assemyaml.dedupe import DuplicateAnchors
+from six.moves import cStringIO as StringIO
+from testfixtures import LogCapture
+from unittest import TestCase
+from yaml import compose, safe_load_all
+from yaml.nodes import ScalarNode
+
+template = """\
+a:
+  policy: {!Transclude Policy: null}
+  tags: {!Transclude Tags: [t0]}
+b:
+  policy: {!Transclude Policy: null}
+  tags: {!Transclude Tags: [t0]}
+  same:
+    Effect: Allow
+    Action: [s3:GetObject, s3:PutObject]
+c: [{!Transclude Policy: null}]
+---
+d: {!Transclude Policy: null}
+e: {!Transclude Policy: null}
+"""
+
+resource = """\
+!Assembly Policy:
+  Effect: Allow
+  Action: [s3:GetObject, s3:PutObject]
+---
+!Assembly Tags: [t1]
+"""
+
+
+class TestDuplicateAnchors(TestCase):
+    def run_template(self, template, anchor_duplicates=None, splice=False,
+                     format="yaml"):
+        output = StringIO()
+        with LogCapture():
+            result = run(StringIO(template), [StringIO(resource)], output,
+                         True, format=format, splice=splice,
+                         anchor_duplicates=anchor_duplicates)
+        self.assertEqual(result, 0)
+        return output.getvalue()
+
+    def test_anchors(self):
+        expected = self.run_template(template)
+        self.assertNotIn("&", expected)
+
+        output = self.run_template(template, 4)
+        self.assertEqual(list(safe_load_all(output)),
+                         list(safe_load_all(expected)))
+        self.assertLess(len(output), len(expected))
+
+        first, second = output.split("---")
+        # The policy (7 nodes) is written once per document; the template's
+        # own identical mapping and the smaller tags (3 nodes) aren't
+        # aliased.
+        self.assertEqual(first.count("&id001"), 1)
+        self.assertEqual(first.count("*id001"), 2)
+        self.assertEqual(first.count("&"), 1)
+        self.assertIn("same:\n    Effect: Allow\n", first)
+        self.assertEqual(second.count("&id001"), 1)
+        self.assertEqual(second.count("*id001"), 1)
+
+        # Subtrees within transcluded values are compared too.
+        output = self.run_template(template, 3)
+        self.assertIn("tags: &id002", output)
+        self.assertIn("tags: *id002", output)
+
+        # Nothing reaches a threshold larger than any subtree.
+        self.assertEqual(self.run_template(template, 8), expected)
+
+    def test_other_outputs(self):
+        self.assertEqual(self.run_template(template, 4, format="json"),
+                         self.run_template(template, format="json"))
+
+        # Spliced documents with aliases are serialized in full, so each
+        # anchor is defined once.
+        expected = self.run_template(template, splice=True)
+        output = self.run_template(template, 4, splice=True)
+        self.assertEqual(list(safe_load_all(output)),
+                         list(safe_load_all(expected)))
+        self.assertEqual(output.count("&id001"), 2)
+
+    def test_spliced_aliases(self):
+        # Transcluded values keep their own aliases; splicing them into
+        # separate places in a document must not define an anchor twice.
+        aliased = "!Assembly Shared: {a: &x [1, 2], b: *x}\n"
+        output = StringIO()
+        with LogCapture():
+            result = run(StringIO("p: {!Transclude Shared: null}\n"
+                                  "q: {!Transclude Shared: null}\n"),
+                         [StringIO(aliased)], output, True, splice=True)
+        self.assertEqual(result, 0)
+        self.assertEqual(list(safe_load_all(output.getvalue())), [
+            {"p": {"a": [1, 2], "b": [1, 2]},
+             "q": {"a": [1, 2], "b": [1, 2]}}])
+
+    def test_cycles(self):
+        anchors = DuplicateAnchors(1)
+        node = compose("[&a [*a], [x], [x]]")
+        anchors.record(node)
+        anchors.apply([node])
+        self.assertIs(node.value[1], node.value[2])
+        self.assertIs(node.value[0].value[0], node.value[0])
+        self.assertEqual(anchors.aliased, 1)
+        self.assertIsInstance(node.value[1].value[0], ScalarNode)
+
+    def test_cli(self):
+        with LogCapture() as l:
+            result = main(["--anchor-duplicates", "0", "template.yml"])
+        self.assertEqual(result, 2)
+        self.assertIn("Invalid minimum node count '0'", str(l))
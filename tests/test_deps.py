@@ -0,0 +1,231 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main
+from assemyaml.deps import Manifest, scan_names
+from json import load as json_load
+from os import mkdir, remove
+from os.path import exists
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+
+files = {
+    "web.yml": "Containers:\n  !Transclude Web: []\n",
+    "db.yml": (
+        "Volumes: {!Transclude Volumes: []}\n"
+        "Local: {!Transclude Local: {}}\n"),
+    "local.yml": "a: {!Assembly Local: {x: 1}}\nb: {!Transclude Local: {}}\n",
+    "frontend.yml": "!Assembly Web:\n  - Image: react\n",
+    "backend.yml": (
+        "!Assembly Web:\n  - Image: flask\n"
+        "    Mounts: {!Transclude Mounts: []}\n"),
+    "storage.yml": (
+        "--- {!Assembly Volumes: [data]}\n"
+        "--- {!Assembly Mounts: [/data]}\n"),
+}
+
+templates = ["web.yml", "db.yml", "local.yml"]
+resources = ["frontend.yml", "backend.yml", "storage.yml"]
+
+
+class TestDeps(TestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        for filename, text in files.items():
+            self.write(filename, text)
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def path(self, filename):
+        return self.tempdir + "/" + filename
+
+    def write(self, filename, text):
+        with open(self.path(filename), "w") as fd:
+            fd.write(text)
+
+    def build(self):
+        return Manifest.build([self.path(f) for f in templates],
+                              [self.path(f) for f in resources])
+
+    def affected(self, manifest, *changed):
+        result = manifest.affected([self.path(f) for f in changed])
+        return [filename[len(self.tempdir) + 1:] for filename in result]
+
+    def test_scan_names(self):
+        provides, consumes = scan_names(StringIO(files["backend.yml"]))
+        self.assertEqual(provides, {"Web": set(["Mounts"])})
+        self.assertEqual(consumes, set(["Mounts"]))
+
+        provides, consumes = scan_names(StringIO(files["local.yml"]))
+        self.assertEqual(provides, {"Local": set()})
+        self.assertEqual(consumes, set(["Local"]))
+
+        provides, consumes = scan_names(
+            StringIO(files["storage.yml"]), local_tags=False)
+        self.assertEqual(provides, {})
+        self.assertEqual(consumes, set())
+
+    def test_affected(self):
+        manifest = self.build()
+        self.assertEqual(self.affected(manifest), [])
+        self.assertEqual(self.affected(manifest, "frontend.yml"), ["web.yml"])
+        self.assertEqual(self.affected(manifest, "db.yml"), ["db.yml"])
+        self.assertEqual(self.affected(manifest, "local.yml"), ["local.yml"])
+
+        # Mounts is transcluded into Web, so web.yml depends on it too.
+        self.assertEqual(self.affected(manifest, "storage.yml"),
+                         ["web.yml", "db.yml"])
+        self.assertEqual(self.affected(manifest, "frontend.yml", "db.yml"),
+                         ["web.yml", "db.yml"])
+
+    def test_new_and_removed_assemblies(self):
+        manifest = self.build()
+
+        # A resource that starts providing a name affects its consumers.
+        self.write("frontend.yml", "{!Assembly Volumes: [logs]}\n")
+        self.assertEqual(self.affected(manifest, "frontend.yml"),
+                         ["web.yml", "db.yml"])
+
+        # So does one that has been deleted.
+        remove(self.path("storage.yml"))
+        self.assertEqual(self.affected(manifest, "storage.yml"),
+                         ["web.yml", "db.yml"])
+
+        # Files not in the manifest are scanned too.
+        self.write("extra.yml", "{!Assembly Local: {y: 2}}\n")
+        self.assertEqual(self.affected(manifest, "extra.yml"),
+                         ["db.yml", "local.yml"])
+
+        manifest.update([self.path("frontend.yml"), self.path("storage.yml")])
+        self.assertEqual([f for f, _ in manifest.resources],
+                         [self.path("frontend.yml"), self.path("backend.yml")])
+        self.assertEqual(manifest.resources[0][1]["provides"],
+                         {"Volumes": []})
+
+        # New files are added as resources; missing ones are skipped.
+        manifest.update([self.path("extra.yml"), self.path("missing.yml")])
+        self.assertEqual([f for f, _ in manifest.resources],
+                         [self.path("frontend.yml"), self.path("backend.yml"),
+                          self.path("extra.yml")])
+
+    def test_roundtrip(self):
+        manifest = self.build()
+        fd = StringIO()
+        manifest.dump(fd)
+        fd.seek(0)
+        loaded = Manifest.load(fd)
+        self.assertEqual(loaded.local_tags, True)
+        self.assertEqual([f for f, _ in loaded.templates],
+                         [f for f, _ in manifest.templates])
+        self.assertEqual(self.affected(loaded, "storage.yml"),
+                         ["web.yml", "db.yml"])
+
+        with self.assertRaises(ValueError):
+            Manifest.load(StringIO('{"version": 0}'))
+
+    def test_cli(self):
+        manifest_filename = self.path("manifest.json")
+        args = ["deps", "--output", manifest_filename]
+        for filename in templates:
+            args += ["--template", self.path(filename)]
+        args += [self.path(filename) for filename in resources]
+
+        with LogCapture() as l:
+            self.assertEqual(main(args), 0)
+        l.check()
+
+        with open(manifest_filename) as fd:
+            data = json_load(fd)
+        self.assertEqual(data["version"], 1)
+        self.assertEqual(data["templates"][1]["consumes"],
+                         ["Local", "Volumes"])
+
+        output_dir = self.path("out")
+        mkdir(output_dir)
+        self.write("frontend.yml", "!Assembly Web:\n  - Image: vue\n")
+
+        with LogCapture():
+            result = main(["plan", "--manifest", manifest_filename,
+                           "--output-dir", output_dir, "--update",
+                           self.path("frontend.yml")])
+        self.assertEqual(result, 0)
+
+        with open(output_dir + "/web.yml") as fd:
+            output = fd.read()
+        self.assertIn("Image: vue", output)
+        self.assertIn("/data", output)
+
+    def plan(self, *changed):
+        manifest_filename = self.path("manifest.json")
+        output_dir = self.path("out")
+        if not exists(manifest_filename):
+            args = ["deps", "--output", manifest_filename]
+            for filename in templates:
+                args += ["--template", self.path(filename)]
+            args += [self.path(filename) for filename in resources]
+            self.assertEqual(main(args), 0)
+            mkdir(output_dir)
+
+        with LogCapture() as l:
+            result = main(["plan", "--manifest", manifest_filename,
+                           "--output-dir", output_dir, "--update"] +
+                          [self.path(filename) for filename in changed])
+        self.assertEqual(result, 0, str(l))
+
+        with open(manifest_filename) as fd:
+            data = json_load(fd)
+        with open(output_dir + "/web.yml") as fd:
+            web = fd.read()
+        with open(output_dir + "/db.yml") as fd:
+            db = fd.read()
+
+        return ([entry["file"][len(self.tempdir) + 1:]
+                 for entry in data["resources"]], web, db)
+
+    def test_cli_added_resource(self):
+        self.plan(*templates)
+        self.write("extra.yml",
+                   "--- {!Assembly Volumes: [logs]}\n"
+                   "---\n!Assembly Web:\n  - Image: nginx\n")
+
+        resources_after, web, db = self.plan("extra.yml")
+        self.assertEqual(resources_after, resources + ["extra.yml"])
+        self.assertIn("- logs", db)
+        self.assertIn("Image: nginx", web)
+
+        # The manifest now knows which templates the new resource affects.
+        self.write("extra.yml", "!Assembly Web:\n  - Image: caddy\n")
+        resources_after, web, db = self.plan("extra.yml")
+        self.assertIn("Image: caddy", web)
+        self.assertNotIn("- logs", db)
+
+    def test_cli_deleted_resource(self):
+        self.plan(*templates)
+        remove(self.path("storage.yml"))
+
+        resources_after, web, db = self.plan("storage.yml")
+        self.assertEqual(resources_after, ["frontend.yml", "backend.yml"])
+        self.assertNotIn("/data", web)
+        self.assertNotIn("- data", db)
+
+    def test_cli_errors(self):
+        with LogCapture() as l:
+            self.assertEqual(main(["deps", self.path("frontend.yml")]), 2)
+        l.check(("assemyaml.deps", "ERROR", "Missing template filename"))
+
+        with LogCapture() as l:
+            self.assertEqual(main(["plan", self.path("frontend.yml")]), 2)
+        l.check(("assemyaml.deps", "ERROR", "Missing manifest filename"))
+
+        with LogCapture() as l:
+            self.assertEqual(main(["deps", "--template",
+                                   self.path("missing.yml")]), 1)
+        self.assertIn("Unable to open", str(l))
+
+        self.write("bad.json", "{}")
+        with LogCapture() as l:
+            self.assertEqual(main(["plan", "--manifest",
+                                   self.path("bad.json")]), 1)
+        self.assertIn("Invalid manifest", str(l))
@@ -0,0 +1,132 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main
+from assemyaml.discover import discover, open_inputs
+from os import makedirs, walk
+from os.path import dirname, join as path_join
+from shutil import rmtree
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+
+
+class TestDiscover(TestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def path(self, *names):
+        return path_join(self.tempdir, *names)
+
+    def write(self, filename, text=""):
+        filename = self.path(filename)
+        if not filename.endswith("/"):
+            parent = dirname(filename)
+        else:
+            parent = filename
+
+        try:
+            makedirs(parent)
+        except OSError:
+            pass
+
+        if not filename.endswith("/"):
+            with open(filename, "w") as fd:
+                fd.write(text)
+
+    def test_directory_order(self):
+        for filename in ("b.yml", "a/z.yaml", "a/b/c.yml", "a/a.yml",
+                         "a.yml", "a/notes.txt", "a/.hidden/x.yml",
+                         ".x.yml", "c/"):
+            self.write(filename)
+
+        self.assertEqual(discover([self.tempdir]), [
+            self.path("a", "a.yml"), self.path("a", "b", "c.yml"),
+            self.path("a", "z.yaml"), self.path("a.yml"), self.path("b.yml")])
+
+    def test_many_directories(self):
+        expected = []
+        for i in range(20):
+            for j in range(5):
+                filename = "d%02d/e%d/f.yml" % (i, j)
+                self.write(filename)
+                expected.append(self.path(filename))
+
+        # Matches a sorted depth-first walk regardless of worker count.
+        walked = []
+        for root, dirs, files in walk(self.tempdir):
+            dirs.sort()
+            walked.extend([path_join(root, f) for f in sorted(files)])
+        self.assertEqual(walked, expected)
+
+        for workers in (1, 4, 16):
+            self.assertEqual(discover([self.tempdir], workers), expected)
+
+    def test_globs_and_listfiles(self):
+        for filename in ("r/1.yml", "r/2.yml", "r/3.json", "s/4.yml"):
+            self.write(filename)
+
+        self.write("list.txt", "# Resources\n%s\n\n%s\n" % (
+            self.path("s"), self.path("r", "2.yml")))
+
+        self.assertEqual(discover([self.path("r", "*.yml")]), [
+            self.path("r", "1.yml"), self.path("r", "2.yml")])
+        self.assertEqual(discover(["@" + self.path("list.txt"),
+                                   self.path("r", "1.yml")]), [
+            self.path("s", "4.yml"), self.path("r", "2.yml"),
+            self.path("r", "1.yml")])
+
+        # Patterns without matches and missing files are passed through so
+        # opening them reports the error.
+        self.assertEqual(discover([self.path("x*.yml"), self.path("y")]), [
+            self.path("x*.yml"), self.path("y")])
+
+        with self.assertRaises(IOError):
+            discover(["@" + self.path("missing.txt")])
+
+    def test_open_inputs(self):
+        filenames = []
+        for i in range(50):
+            filename = "%02d.yml" % i
+            self.write(filename, "a: %d\n" % i)
+            filenames.append(self.path(filename))
+
+        fds = []
+        for fd in open_inputs(filenames, prefetch=4):
+            self.assertEqual(fd.read(), "a: %d\n" % len(fds))
+            fds.append(fd)
+        self.assertEqual(len(fds), 50)
+
+        inputs = open_inputs(filenames[:2] + [self.path("missing.yml")])
+        self.assertEqual(next(inputs).filename, filenames[0])
+        self.assertEqual(next(inputs).filename, filenames[1])
+        with self.assertRaises(IOError) as e:
+            next(inputs)
+        self.assertEqual(e.exception.filename, self.path("missing.yml"))
+
+        # Stopping early closes everything opened ahead.
+        inputs = open_inputs(filenames, prefetch=4)
+        next(inputs)
+        inputs.close()
+
+    def test_cli(self):
+        self.write("template.yml", "a: {!Transclude A: [0]}\n")
+        for i in (2, 1, 3):
+            self.write("resources/%d/r.yml" % i, "!Assembly A: [%d]\n" % i)
+
+        output_filename = self.path("output.yml")
+        with LogCapture():
+            result = main(["--output", output_filename,
+                           self.path("template.yml"), self.path("resources")])
+        self.assertEqual(result, 0)
+
+        with open(output_filename) as fd:
+            self.assertEqual(fd.read(), "a:\n- 0\n- 1\n- 2\n- 3\n")
+
+        with LogCapture() as l:
+            result = main(["--output", output_filename,
+                           self.path("template.yml"), self.path("x*.yml")])
+        self.assertEqual(result, 1)
+        self.assertIn("Unable to open %s for reading" % self.path("x*.yml"),
+                      str(l))
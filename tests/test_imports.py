@@ -0,0 +1,52 @@
+from __future__ import absolute_import, print_function
+from json import loads as json_loads
+from os.path import dirname
+from subprocess import check_output
+import sys
+from unittest import TestCase
+
+# Wall time allowed for importing a module in a fresh interpreter, in seconds.
+# This is mostly PyYAML; keep an eye on it when adding top-level imports.
+IMPORT_TIME_BUDGET = 0.25
+
+_import_script = """
+import json, sys, time
+start = time.time()
+import %(module)s
+elapsed = time.time() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+class TestImports(TestCase):
+    def import_module(self, module):
+        """
+        Import module in a new interpreter, returning the best import time of
+        three attempts and the modules loaded by the import.
+        """
+        best = None
+        script = _import_script % {"module": module}
+
+        for i in range(3):
+            result = json_loads(check_output(
+                [sys.executable, "-c", script],
+                cwd=dirname(dirname(__file__))).decode("utf-8"))
+
+            if best is None or result["elapsed"] < best["elapsed"]:
+                best = result
+
+        return best["elapsed"], set(best["modules"])
+
+    def test_package_import(self):
+        elapsed, modules = self.import_module("assemyaml")
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+
+        for unwanted in ("boto3", "botocore", "getopt", "six"):
+            self.assertNotIn(unwanted, modules)
+
+    def test_lambda_handler_import(self):
+        elapsed, modules = self.import_module("assemyaml.lambda_handler")
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+
+        for unwanted in ("boto3", "botocore", "s3transfer"):
+            self.assertNotIn(unwanted, modules)
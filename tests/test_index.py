@@ -0,0 +1,199 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main
+from assemyaml.assemble import get_assembly
+from assemyaml.error import AssemblyError, TranscludeError
+from assemyaml.index import ASSEMBLY, TRANSCLUDE, NameIndex, scan_tags
+from assemyaml.loader import SafeLoader
+from assemyaml.transclude import get_transclude
+from assemyaml.walk import flatten_value
+from os import listdir
+from os.path import dirname
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+import sys
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+from yaml import compose_all
+from yaml.nodes import CollectionNode, MappingNode
+
+
+def node_tags(stream, local_tags):
+    """
+    Find assemblies and transclusions from the composed node trees, as the
+    assembler does.
+    """
+    result = []
+    seen = set()
+    for doc in compose_all(stream, Loader=SafeLoader):
+        stack = [doc]
+        while stack:
+            node = stack.pop()
+            if not isinstance(node, CollectionNode) or id(node) in seen:
+                continue
+            seen.add(id(node))
+
+            if isinstance(node, MappingNode):
+                for kind, get in ((ASSEMBLY, get_assembly),
+                                  (TRANSCLUDE, get_transclude)):
+                    name, _ = get(node, local_tags)
+                    if name is not None:
+                        key = node.value[0][0]
+                        result.append((kind, name, key.start_mark.line + 1))
+                        break
+
+            stack.extend(flatten_value(node.value)[0])
+
+    return sorted(result)
+
+
+def event_tags(stream, local_tags):
+    return sorted([(kind, name, line) for kind, name, line, _ in
+                   scan_tags(stream, local_tags)])
+
+
+class TestScanTags(TestCase):
+    def check(self, text):
+        for local_tags in (True, False):
+            expected = node_tags(StringIO(text), local_tags)
+            actual = event_tags(StringIO(text), local_tags)
+            self.assertEqual(actual, expected)
+
+    def test_fixtures(self):
+        testdir = dirname(__file__) + "/cli/"
+        for filename in sorted(listdir(testdir)):
+            if filename.endswith(".yml") and "-name" not in filename:
+                with open(testdir + filename) as fd:
+                    self.check(fd.read())
+
+    def test_nested(self):
+        text = (
+            "%TAG !a! tag:assemyaml.nz,2017:\n---\n"
+            "!a!Assembly Outer:\n"
+            "  - {!Assembly Inner: [{!Transclude X: []}]}\n"
+            "  - !!map {!a!Transclude Y: null}\n"
+            "--- [&k !Transclude Z, {*k : 1}]\n")
+        self.check(text)
+
+        found = list(scan_tags(StringIO(text)))
+        self.assertEqual(found, [
+            (TRANSCLUDE, "X", 4, ("Outer", "Inner")),
+            (ASSEMBLY, "Inner", 4, ("Outer",)),
+            (TRANSCLUDE, "Y", 5, ("Outer",)),
+            (ASSEMBLY, "Outer", 3, ()),
+            (TRANSCLUDE, "Z", 6, ()),
+        ])
+
+    def test_errors(self):
+        for text, error_class, message in (
+                ("{!Assembly A: 1, b: 2}", AssemblyError,
+                 "Assembly must be a single-entry mapping"),
+                ("{b: 2, !Transclude A: 1}", TranscludeError,
+                 "Transclude must be a single-entry mapping"),
+                ("{!Transclude A: 1, !Assembly B: 2}", AssemblyError,
+                 "Assembly must be a single-entry mapping"),
+                ("{!Assembly [a]: 1}", AssemblyError,
+                 "Assembly name must be a scalar"),
+                ("{!Transclude {a: b}: 1}", TranscludeError,
+                 "Transclude name must be a scalar")):
+            with self.assertRaises(error_class) as expected:
+                node_tags(StringIO(text), True)
+            with self.assertRaises(error_class) as actual:
+                event_tags(StringIO(text), True)
+
+            self.assertEqual(actual.exception.problem, message)
+            for attr in ("line", "column"):
+                self.assertEqual(
+                    getattr(actual.exception.problem_mark, attr),
+                    getattr(expected.exception.problem_mark, attr))
+
+
+class TestNameIndex(TestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.write("template.yml", "a: {!Transclude A: []}\n\n"
+                   "b: {!Transclude B: []}\n")
+        self.write("resource.yml", "--- {!Assembly A: [1]}\n"
+                   "--- {!Assembly A: [{!Transclude B: []}]}\n")
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def path(self, filename):
+        return self.tempdir + "/" + filename
+
+    def write(self, filename, text):
+        with open(self.path(filename), "w") as fd:
+            fd.write(text)
+
+    def test_queries(self):
+        index = NameIndex.build(
+            [self.path("template.yml"), self.path("resource.yml")])
+        self.assertEqual(index.provides("A"), [
+            (self.path("resource.yml"), 1), (self.path("resource.yml"), 2)])
+        self.assertEqual(index.consumes("B"), [
+            (self.path("template.yml"), 3), (self.path("resource.yml"), 2)])
+        self.assertEqual(index.provides("B"), [])
+        self.assertEqual(index.files[1][1]["provides"],
+                         [["A", 1, []], ["A", 2, ["B"]]])
+
+        # Unchanged files aren't scanned again.
+        index.files[1][1]["consumes"] = []
+        rebuilt = NameIndex.build(
+            [self.path("template.yml"), self.path("resource.yml")],
+            previous=index)
+        self.assertEqual(rebuilt.consumes("B"), [
+            (self.path("template.yml"), 3)])
+
+        self.write("template.yml", "{!Transclude B: []}\n")
+        rebuilt = NameIndex.build([self.path("template.yml")],
+                                  previous=index)
+        self.assertEqual(rebuilt.consumes("B"), [
+            (self.path("template.yml"), 1)])
+
+        rebuilt = NameIndex.build([self.path("template.yml")],
+                                  local_tags=False, previous=index)
+        self.assertEqual(rebuilt.consumes("B"), [])
+
+    def test_cli(self):
+        index_filename = self.path("index.json")
+        with LogCapture() as l:
+            result = main(["index", "--output", index_filename,
+                           self.path("template.yml"),
+                           self.path("resource.yml")])
+        self.assertEqual(result, 0)
+        l.check()
+
+        with open(index_filename) as fd:
+            index = NameIndex.load(fd)
+        self.assertEqual(len(index.files), 2)
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            result = main(["query", "--index", index_filename,
+                           "provides", "A", "B"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        self.assertEqual(result, 0)
+        self.assertEqual(output, "A\t%s:1\nA\t%s:2\n" % (
+            self.path("resource.yml"), self.path("resource.yml")))
+
+    def test_cli_errors(self):
+        with LogCapture() as l:
+            self.assertEqual(main(["index", self.path("template.yml")]), 2)
+        l.check(("assemyaml.index", "ERROR", "Missing output filename"))
+
+        with LogCapture() as l:
+            self.assertEqual(main(["query", "--index", self.path("x"),
+                                   "defines", "A"]), 2)
+        l.check(("assemyaml.index", "ERROR",
+                 "Query must be 'provides' or 'consumes'"))
+
+        self.write("bad.yml", "{!Assembly A: 1, b: 2}\n")
+        with LogCapture() as l:
+            self.assertEqual(main(["index", "-o", self.path("index.json"),
+                                   self.path("bad.yml")]), 1)
+        self.assertIn("Assembly must be a single-entry mapping", str(l))
@@ -0,0 +1,198 @@
+from __future__ import absolute_import, print_function
+from assemyaml import run
+from assemyaml.assemble import record_assemblies
+from assemyaml.input import MappedInput, StreamInput, open_input
+from assemyaml.loader import SafeLoader
+from assemyaml.stats import Stats
+from assemyaml.types import nodes_equal
+from codecs import BOM_UTF16_BE, BOM_UTF16_LE, BOM_UTF8
+from os import fdopen, mkfifo, pipe
+from os.path import dirname
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+import sys
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from threading import Event, Thread
+from unittest import TestCase
+from yaml import compose, compose_all
+from yaml.reader import ReaderError
+
+
+class TestMappedInput(TestCase):
+    def setUp(self):
+        self.testdir = dirname(__file__) + "/cli/"
+        self.tempdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def write(self, filename, data):
+        filename = self.tempdir + "/" + filename
+        with open(filename, "wb") as fd:
+            fd.write(data)
+        return filename
+
+    def test_same_nodes(self):
+        for name in ("basic-template.yml", "cloudformation-template.yml",
+                     "multidoc-template.yml"):
+            filename = self.testdir + name
+            with open(filename, "r") as fd:
+                expected = list(compose_all(fd))
+
+            with open_input(filename) as mi:
+                self.assertIsInstance(mi, MappedInput)
+                actual = list(compose_all(mi, Loader=SafeLoader))
+
+            self.assertEqual(len(actual), len(expected))
+            for a, e in zip(actual, expected):
+                self.assertTrue(nodes_equal(a, e))
+                self.assertEqual(a.start_mark.name, filename)
+                self.assertEqual(a.end_mark.line, e.end_mark.line)
+
+    def test_encodings(self):
+        text = u"a: [b, é]\n"
+        expected = compose(text)
+
+        for data, encoding in (
+                (text.encode("utf-8"), "utf-8"),
+                (BOM_UTF8 + text.encode("utf-8"), "utf-8"),
+                (BOM_UTF16_LE + text.encode("utf-16-le"), "utf-16-le"),
+                (BOM_UTF16_BE + text.encode("utf-16-be"), "utf-16-be")):
+            with open_input(self.write("doc.yml", data)) as mi:
+                self.assertEqual(mi.encoding, encoding)
+                self.assertEqual(mi.size, len(data))
+                self.assertTrue(nodes_equal(
+                    compose(mi, Loader=SafeLoader), expected))
+
+    def test_empty(self):
+        with open_input(self.write("empty.yml", b"")) as mi:
+            self.assertEqual(mi.buffer, b"")
+            self.assertEqual(mi.read(), "")
+            self.assertEqual(list(compose_all(mi, Loader=SafeLoader)), [])
+
+    def test_read(self):
+        with open_input(self.write("doc.yml", b"abcdef")) as mi:
+            self.assertEqual(mi.read(4), "abcd")
+            self.assertEqual(mi.read(4), "ef")
+            self.assertEqual(mi.read(), "")
+
+    def test_invalid_utf8(self):
+        filename = self.write("bad.yml", b"a: \xff\n")
+
+        with open_input(filename) as mi:
+            with LogCapture() as l:
+                result = run(mi, [], StringIO(), True)
+
+        self.assertEqual(result, 1)
+        self.assertIn("bad.yml", str(l))
+        self.assertIn("invalid start byte", str(l))
+        self.assertIn("can't decode byte #xff", str(l))
+
+    def test_marks_do_not_hold_text(self):
+        # The loader reads the mapping a chunk at a time, so marks don't keep
+        # a copy of the whole text alive.
+        filename = self.testdir + "cloudformation-template.yml"
+        with open_input(filename) as mi:
+            node = compose(mi, Loader=SafeLoader)
+
+        self.assertIsNone(node.start_mark.buffer)
+        self.assertIsNone(node.value[-1][1].end_mark.buffer)
+
+    def test_stats(self):
+        data = b"!Transclude Hello: [a]\n"
+        stats = Stats()
+
+        with open_input(self.write("doc.yml", data)) as mi:
+            result = run(mi, [], StringIO(), True, stats=stats)
+
+        self.assertEqual(result, 0)
+        self.assertEqual(stats.bytes_read, len(data))
+
+
+class TestStreamInput(TestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def test_partial_reads(self):
+        # Multi-byte characters and byte order marks split across reads.
+        text = u"a: [b, é, 中]\n"
+        for data in (text.encode("utf-8"),
+                     BOM_UTF16_LE + text.encode("utf-16-le")):
+            read_fd, write_fd = pipe()
+            with fdopen(write_fd, "wb") as fd:
+                fd.write(data)
+
+            with StreamInput(fdopen(read_fd, "rb", 0), "pipe") as si:
+                chunks = []
+                while True:
+                    chunk = si.read(1)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+
+            self.assertEqual("".join(chunks).lstrip(u"\ufeff"), text)
+
+    def test_invalid_utf8(self):
+        read_fd, write_fd = pipe()
+        with fdopen(write_fd, "wb") as fd:
+            fd.write(b"a: \xff\n")
+
+        with StreamInput(fdopen(read_fd, "rb"), "pipe") as si:
+            with self.assertRaises(ReaderError):
+                si.read()
+
+    def test_documents_are_processed_as_they_arrive(self):
+        fifo = self.tempdir + "/resources"
+        mkfifo(fifo)
+        recorded = Event()
+        writer_saw_assembly = []
+
+        class Assemblies(dict):
+            def __setitem__(self, key, value):
+                super(Assemblies, self).__setitem__(key, value)
+                recorded.set()
+
+        def produce():
+            with open(fifo, "w") as fd:
+                fd.write("!Assembly A: [1]\n---\n")
+                fd.flush()
+                # The first document is recorded before the rest of the
+                # stream has been written.
+                writer_saw_assembly.append(recorded.wait(10))
+                fd.write("!Assembly B: [2]\n")
+
+        thread = Thread(target=produce)
+        thread.start()
+
+        assemblies = Assemblies()
+        with open_input(fifo) as si:
+            self.assertIsInstance(si, StreamInput)
+            record_assemblies(si, assemblies)
+        thread.join()
+
+        self.assertEqual(writer_saw_assembly, [True])
+        self.assertEqual(sorted(assemblies), ["A", "B"])
+
+    def test_stdin(self):
+        read_fd, write_fd = pipe()
+        with fdopen(write_fd, "wb") as fd:
+            fd.write(b"!Assembly Hello: [b]\n")
+
+        stdin = sys.stdin
+        sys.stdin = fdopen(read_fd, "r")
+        try:
+            output = StringIO()
+            with LogCapture():
+                result = run(StringIO("!Transclude Hello: [a]\n"),
+                             [open_input("-")], output, True)
+            self.assertFalse(sys.stdin.closed)
+        finally:
+            sys.stdin.close()
+            sys.stdin = stdin
+
+        self.assertEqual(result, 0)
+        self.assertEqual(output.getvalue(), "- a\n- b\n")
@@ -1,8 +1,8 @@
 from __future__ import print_function
-from assemyaml.lambda_handler import codepipeline_handler
+from assemyaml.lambda_handler import BotoClientPool, codepipeline_handler
 from boto3.session import Session as Boto3Session
 from contextlib import contextmanager
-from json import dumps as json_dumps
+from json import dumps as json_dumps, loads as json_loads
 from moto import mock_s3
 from logging import getLogger, WARNING
 from os import listdir
@@ -86,7 +86,7 @@ class TestLambda(TestCase):
     def lambda_event(self, input_artifacts, output_artifact,
                      template_document=None,
                      resource_documents=None, default_input_filename=None,
-                     local_tags=None, format=None):
+                     local_tags=None, format=None, profile_filename=None):
 
         user_params = {}
         if template_document is not None:
@@ -104,6 +104,9 @@ class TestLambda(TestCase):
         if format is not None:
             user_params["Format"] = format
 
+        if profile_filename is not None:
+            user_params["ProfileFilename"] = profile_filename
+
         action_cfg = {"configuration": {"FunctionName": "Lambda"}}
         if user_params:
             action_cfg["configuration"]["UserParameters"] = (
@@ -176,7 +179,8 @@ class TestLambda(TestCase):
             template_document=doc.get("TemplateDocument"),
             resource_documents=doc.get("ResourceDocuments"),
             default_input_filename=doc.get("DefaultInputFilename"),
-            local_tags=doc.get("LocalTags"))
+            local_tags=doc.get("LocalTags"),
+            profile_filename=doc.get("ProfileFilename"))
 
         log.info("Invoking Lambda codepipeline_handler")
         with captured_output() as (out, err):
@@ -189,6 +193,9 @@ class TestLambda(TestCase):
 
         log.info("Lambda codepipeline_handler done")
 
+        # The last line of stdout holds the job statistics.
+        stats = json_loads(out.getvalue().strip().split("\n")[-1])
+        self.assertIn("phases", stats)
 
         expected_errors = doc.get("ExpectedErrors")
         if expected_errors:
@@ -211,7 +218,14 @@ class TestLambda(TestCase):
                 with zf.open(output_filename, "r") as fd:
                     result = yaml_load(fd)
 
+                for extra_filename in output_artifact.get("ExtraFiles", []):
+                    self.assertIn(extra_filename, zf.namelist())
+
             self.assertEquals(result, expected_content)
+            self.assertEqual(
+                list(stats["phases"]),
+                ["download", "extract", "parse", "assemble", "transclude",
+                 "serialize", "upload"])
 
     def test_lambda_basic_transclude(self):
         self.run_doc("lambda_basic_transclude.yml")
@@ -234,6 +248,9 @@ class TestLambda(TestCase):
     def test_template_parameter4(self):
         self.run_doc("template_parameter2.yml")
 
+    def test_profile(self):
+        self.run_doc("profile.yml")
+
     def test_dict_transclude(self):
         self.run_doc("test_dict_transclude.yml")
 
@@ -252,6 +269,59 @@ class TestLambda(TestCase):
     def test_set_transclude(self):
         self.run_doc("test_set_transclude.yml")
 
+    def test_output_reused(self):
+        s3 = self.boto3.resource("s3", region_name="us-west-2")
+        s3.Bucket(self.bucket_name).create()
+        template = {"assemble.yml": "a: {!Transclude World: [A]}\n"}
+        resource = {"assemble.yml": "!Assembly World: [B]\n"}
+
+        def invoke(resource=resource):
+            key = "%s/Output/%s.zip" % (self.pipeline_name,
+                                        random_keyname())
+            event = self.lambda_event(
+                [self.create_input_artifact("Template", template),
+                 self.create_input_artifact("Resource", resource)],
+                self.artifact_dict("Output", key))
+
+            with captured_output():
+                with LogCapture() as l:
+                    codepipeline_handler(event, None)
+
+            obj = s3.Object(self.bucket_name, key).get()
+            with ZipFile(BytesIO(obj["Body"].read()), "r") as zf:
+                output = zf.read("assemble.yml").decode("utf-8")
+
+            return output, obj["Metadata"], str(l)
+
+        first, metadata, logs = invoke()
+        self.assertEqual(first, "a:\n- A\n- B\n")
+        self.assertIn("assemyaml-digest", metadata)
+        self.assertNotIn("Output unchanged", logs)
+
+        # An identical output is copied from the previous artifact.
+        output, copied_metadata, logs = invoke()
+        self.assertEqual(output, first)
+        self.assertEqual(copied_metadata, metadata)
+        self.assertIn("Output unchanged; copied s3://", logs)
+
+        # A different output is uploaded.
+        output, changed_metadata, logs = invoke(
+            {"assemble.yml": "!Assembly World: [C]\n"})
+        self.assertEqual(output, "a:\n- A\n- C\n")
+        self.assertNotEqual(changed_metadata, metadata)
+        self.assertNotIn("Output unchanged", logs)
+
+        # An index naming a removed artifact is ignored.
+        index = s3.Object(self.bucket_name,
+                          self.pipeline_name + "/Output/" +
+                          ".assemyaml-output.json")
+        previous_key = json_loads(index.get()["Body"].read())["key"]
+        s3.Object(self.bucket_name, previous_key).delete()
+        output, _, logs = invoke(
+            {"assemble.yml": "!Assembly World: [C]\n"})
+        self.assertEqual(output, "a:\n- A\n- C\n")
+        self.assertNotIn("Output unchanged", logs)
+
     def test_bad_userparams(self):
         event = self.lambda_event([], self.artifact_dict("Output", "key"))
         event["CodePipeline.job"]["data"]["actionConfiguration"]\
@@ -334,3 +404,38 @@ class TestLambda(TestCase):
         self.assertIn(
             "Invalid output format 'qwerty': valid types are 'json' and 'yaml'",
             str(l))
+
+
+class TestClientPool(TestCase):
+    def creds(self, access_key_id):
+        return {
+            "accessKeyId": access_key_id,
+            "secretAccessKey": "secret",
+            "sessionToken": "token",
+        }
+
+    def test_reuse(self):
+        pool = BotoClientPool()
+        s3 = pool.client("s3", self.creds("AKIA1"))
+        self.assertIs(pool.client("s3", self.creds("AKIA1")), s3)
+        self.assertIs(pool.session(self.creds("AKIA1")),
+                      pool.session(self.creds("AKIA1")))
+
+        default_s3 = pool.client("s3")
+        self.assertIsNot(default_s3, s3)
+        self.assertIs(pool.client("s3"), default_s3)
+
+    def test_credentials_change(self):
+        pool = BotoClientPool()
+        s3_1 = pool.client("s3", self.creds("AKIA1"))
+        default_s3 = pool.client("s3")
+        s3_2 = pool.client("s3", self.creds("AKIA2"))
+
+        self.assertIsNot(s3_1, s3_2)
+        self.assertIs(pool.client("s3"), default_s3)
+        self.assertEqual(len(pool.sessions), 2)
+        self.assertIsNot(pool.client("s3", self.creds("AKIA1")), s3_1)
+
+        pool.clear()
+        self.assertEqual(pool.sessions, {})
+        self.assertEqual(pool.clients, {})
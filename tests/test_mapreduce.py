@@ -0,0 +1,222 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main, run
+from assemyaml.input import open_input
+from assemyaml.mapreduce import map_resources, reduce_partials
+from itertools import permutations
+from os import listdir
+from os.path import dirname
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+
+testdir = dirname(__file__) + "/cli/"
+
+template = """\
+a: {!Transclude Outer: [0]}
+b: {!Transclude Inner: []}
+c: {!Transclude Map: {k0: v0}}
+d: {!Transclude Plain: [p0]}
+"""
+
+resources = [
+    "!Assembly Inner: [i1]\n---\n!Assembly Plain: [p1]\n",
+    "---\n!Assembly Outer: [{!Assembly Inner: [i2]}, o1]\n"
+    "--- {!Assembly Map: {k1: &v [1, 2]}}\n"
+    "---\n!Assembly Plain: [p2]\n",
+    "!Assembly Map: {k2: [1, 2], k3: !!str 3}\n"
+    "---\n!Assembly Plain: null\n",
+    "a: {!Assembly Outer: {!Assembly Inner: [i3]}}\n"
+    "b: [{!Assembly Map: {? [x] : {y: z}}}]\n"
+    "---\n!Assembly Plain: [p3, p4]\n",
+]
+
+
+class TestMapReduce(TestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def path(self, filename):
+        return self.tempdir + "/" + filename
+
+    def write(self, filename, text):
+        with open(self.path(filename), "w") as fd:
+            fd.write(text)
+        return self.path(filename)
+
+    def map(self, texts, filename):
+        data = map_resources([StringIO(text) for text in texts])
+        with open(self.path(filename), "wb") as fd:
+            fd.write(data)
+        return self.path(filename)
+
+    def reduce(self, filenames, partial=None):
+        args = ["reduce", "-o", self.path("output.yml")]
+        if partial is None:
+            args.append(self.write("template.yml", template))
+        else:
+            args.extend(["--partial", self.path(partial)])
+
+        with LogCapture():
+            result = main(args + filenames)
+        self.assertEqual(result, 0)
+
+        if partial is not None:
+            return self.path(partial)
+
+        with open(self.path("output.yml")) as fd:
+            return fd.read()
+
+    def expected(self, texts=resources, local_tags=True):
+        output = StringIO()
+        with LogCapture():
+            result = run(StringIO(template),
+                         [StringIO(text) for text in texts], output,
+                         local_tags)
+        self.assertEqual(result, 0)
+        return output.getvalue()
+
+    def test_same_output(self):
+        expected = self.expected()
+        self.assertIn("b:\n- i1\n- i2\n- i3\n", expected)
+
+        # Every split of the resources into contiguous shards.
+        for cuts in ([], [1], [2], [3], [1, 2], [1, 3], [2, 3], [1, 2, 3]):
+            bounds = [0] + cuts + [len(resources)]
+            filenames = [
+                self.map(resources[start:end], "shard%d.ayb" % i)
+                for i, (start, end) in enumerate(zip(bounds, bounds[1:]))]
+            self.assertEqual(self.reduce(filenames), expected)
+
+        # Partial files are also bundles.
+        output = StringIO()
+        with LogCapture():
+            result = run(StringIO(template), [open_input(filename)
+                                              for filename in filenames],
+                         output, True)
+        self.assertEqual(result, 0)
+        self.assertEqual(output.getvalue(), expected)
+
+    def test_associative(self):
+        shards = [self.map([text], "shard%d.ayb" % i)
+                  for i, text in enumerate(resources)]
+        expected = self.reduce(shards)
+
+        left = self.reduce(shards[:2], partial="left.ayb")
+        self.assertEqual(self.reduce([left] + shards[2:]), expected)
+
+        right = self.reduce(shards[1:], partial="right.ayb")
+        self.assertEqual(self.reduce(shards[:1] + [right]), expected)
+
+        middle = self.reduce(shards[1:3], partial="middle.ayb")
+        outer = self.reduce([shards[0], middle, shards[3]],
+                            partial="outer.ayb")
+        self.assertEqual(self.reduce([outer]), expected)
+
+    def test_combined(self):
+        # Contributions to assemblies that aren't nested are merged when
+        # mapping; the rest are kept in order.
+        filename = self.map(resources, "all.ayb")
+        contributions, documents = reduce_partials([open_input(filename)])
+        self.assertEqual(documents, 9)
+        self.assertEqual(
+            [name for name, _, _ in contributions],
+            ["Inner", "Plain", "Inner", "Outer", "Map", "Inner", "Outer"])
+
+        # The merged value starts where the first contribution did.
+        plain = contributions[1][2]
+        self.assertEqual(plain.start_mark.line, 2)
+        self.assertEqual([node.value for node in plain.value],
+                         ["p1", "p2", "p3", "p4"])
+
+    def test_fixtures(self):
+        for filename in sorted(listdir(testdir)):
+            if not filename.endswith("-template.yml"):
+                continue
+
+            prefix = filename[:-len("-template.yml")]
+            resource_filenames = sorted([
+                testdir + name for name in listdir(testdir)
+                if name.startswith(prefix + "-resource")])
+            if not resource_filenames or prefix == "globaltag":
+                continue
+
+            partials = []
+            for i, resource_filename in enumerate(resource_filenames):
+                with LogCapture():
+                    result = main(["map", "-o", self.path("p%d.ayb" % i),
+                                   resource_filename])
+                self.assertEqual(result, 0)
+                partials.append(self.path("p%d.ayb" % i))
+
+            outputs = []
+            for command, inputs in ((["reduce"], partials),
+                                    ([], resource_filenames)):
+                output_filename = self.path("output-%d.yml" % len(outputs))
+                with LogCapture():
+                    result = main(command + ["-o", output_filename,
+                                             testdir + filename] + inputs)
+                with open(output_filename) as fd:
+                    outputs.append((result, fd.read()))
+
+            self.assertEqual(outputs[0], outputs[1])
+
+    def test_merge_errors(self):
+        for first, second, message in (
+                ("!Assembly Map: {a: 1}\n", "!Assembly Map: {a: 2}\n",
+                 "Cannot merge duplicate mapping key 'a'"),
+                ("!Assembly Map: [1]\n",
+                 "!Assembly Map: {a: 1}\n---\n!Assembly Map: {b: 1}\n",
+                 "Cannot merge !!")):
+            for order in permutations([first, second]):
+                filenames = []
+                for i, text in enumerate(order):
+                    resource = self.write("r%d.yml" % i, text)
+                    with LogCapture():
+                        self.assertEqual(
+                            main(["map", "-o", self.path("p%d.ayb" % i),
+                                  resource]), 0)
+                    filenames.append(self.path("p%d.ayb" % i))
+
+                with LogCapture() as l:
+                    result = main(["reduce", self.write("t.yml", template)] +
+                                  filenames)
+                self.assertEqual(result, 1)
+                self.assertIn(message, str(l))
+                # Errors point to the resource documents.
+                self.assertIn(self.path("r0.yml"), str(l))
+                self.assertIn(self.path("r1.yml"), str(l))
+
+        # A merge error within a shard is reported when it is mapped.
+        with LogCapture() as l:
+            result = main(["map", "-o", self.path("bad.ayb"),
+                           self.write("bad.yml", first + "---\n" + second)])
+        self.assertEqual(result, 1)
+        self.assertIn("Cannot merge !!map value", str(l))
+
+    def test_cli_errors(self):
+        resource = self.write("r.yml", resources[0])
+        self.map([resources[0]], "local.ayb")
+
+        for args, code, message in (
+                (["map", resource], 2, "Missing --output filename"),
+                (["map", "-o", self.path("x.ayb")], 2,
+                 "Missing resource filename"),
+                (["reduce"], 2, "Missing template filename"),
+                (["reduce", "-f", "xml", "t.yml"], 2,
+                 "Invalid output format 'xml'"),
+                (["reduce", self.write("t.yml", template), resource], 1,
+                 "%s is not a partial assembly file" % resource),
+                (["reduce", "-l", self.path("t.yml"),
+                  self.path("local.ayb")], 1,
+                 "was compiled with local tags enabled"),
+                (["reduce", self.path("t.yml"), self.path("missing.ayb")], 1,
+                 "Unable to open %s for reading" % self.path("missing.ayb"))):
+            with LogCapture() as l:
+                result = main(args)
+            self.assertEqual(result, code)
+            self.assertIn(message, str(l))
@@ -0,0 +1,91 @@
+from __future__ import absolute_import, print_function
+from assemyaml import run
+from assemyaml.memo import TranscludeMemo
+from assemyaml.stats import Stats
+from assemyaml.types import node_hash
+from six.moves import cStringIO as StringIO
+from testfixtures import LogCapture
+from unittest import TestCase
+from yaml import compose
+
+template = """\
+a: {!Transclude Tags: [x, y]}
+b:
+  c: {!Transclude Tags: [x, y]}
+d: {!Transclude Policy: {p: 1}}
+---
+e: {!Transclude Tags: [x, y]}
+f: {!Transclude Policy: {p: 1}}
+"""
+
+resource = """\
+!Assembly Tags: [z]
+---
+!Assembly Policy: {q: 2}
+"""
+
+
+class TestNodeHash(TestCase):
+    def test_structure(self):
+        self.assertEqual(node_hash(compose("{a: [b, c]}")),
+                         node_hash(compose("\n\n{ a:   [b,   c] }")))
+        self.assertNotEqual(node_hash(compose("{a: [b, c]}")),
+                            node_hash(compose("{a: [c, b]}")))
+        self.assertNotEqual(node_hash(compose("[a, [b]]")),
+                            node_hash(compose("[[a], b]")))
+        self.assertNotEqual(node_hash(compose("a")),
+                            node_hash(compose("'a'")))
+        self.assertNotEqual(node_hash(compose("[a]")),
+                            node_hash(compose("- a")))
+        self.assertNotEqual(node_hash(compose("1")),
+                            node_hash(compose("!!str 1")))
+
+    def test_recursive(self):
+        self.assertEqual(node_hash(compose("&a [*a]")),
+                         node_hash(compose("&b [*b]")))
+        self.assertNotEqual(node_hash(compose("&a [*a]")),
+                            node_hash(compose("&a [[*a]]")))
+
+
+class TestTranscludeMemo(TestCase):
+    def run_template(self, memo=None, stats=None):
+        output = StringIO()
+        result = run(StringIO(template), [StringIO(resource)], output, True,
+                     stats=stats, memo=memo)
+        self.assertEqual(result, 0)
+        return output.getvalue()
+
+    def test_same_output(self):
+        memo = TranscludeMemo()
+        expected = self.run_template()
+
+        self.assertEqual(self.run_template(memo), expected)
+        self.assertEqual((memo.hits, memo.misses), (3, 2))
+
+        # The memo is reused across runs.
+        stats = Stats()
+        self.assertEqual(self.run_template(memo, stats), expected)
+        self.assertEqual((memo.hits, memo.misses), (8, 2))
+        self.assertEqual(stats.merges, 0)
+        self.assertEqual(memo.hit_rate, 0.8)
+        self.assertEqual(len(memo), 2)
+
+    def test_eviction(self):
+        memo = TranscludeMemo(1)
+        self.run_template(memo)
+        self.assertEqual(len(memo), 1)
+        self.assertEqual(memo.evictions, 3)
+        self.assertEqual(memo.to_dict()["max_size"], 1)
+
+    def test_errors_not_memoized(self):
+        memo = TranscludeMemo()
+        for i in range(2):
+            with LogCapture() as l:
+                result = run(StringIO("!Transclude Tags: {a: b}"),
+                             [StringIO(resource)], StringIO(), True,
+                             memo=memo)
+
+            self.assertEqual(result, 1)
+            self.assertIn("Cannot merge !!seq value", str(l))
+
+        self.assertEqual(len(memo), 0)
@@ -0,0 +1,143 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main
+from assemyaml.output import file_digest, ReplaceOutput
+from hashlib import sha256
+from os import chmod, listdir, stat, symlink, utime
+from shutil import rmtree
+from stat import S_IMODE
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+
+template = "a: {!Transclude Tags: [t0]}\n"
+resource = "!Assembly Tags: [t1, t2]\n"
+expected = "a:\n- t0\n- t1\n- t2\n"
+
+
+class TestOutput(TestCase):
+    def setUp(self):
+        self.tempdir = mkdtemp()
+        self.write("template.yml", template)
+        self.write("resource.yml", resource)
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def path(self, filename):
+        return self.tempdir + "/" + filename
+
+    def write(self, filename, text):
+        with open(self.path(filename), "w") as fd:
+            fd.write(text)
+        return self.path(filename)
+
+    def read(self, filename):
+        with open(self.path(filename)) as fd:
+            return fd.read()
+
+    def assemble(self, *args, **kw):
+        resource_filename = kw.get("resource", self.path("resource.yml"))
+        with LogCapture() as l:
+            result = main(list(args) + ["-o", self.path("output.yml"),
+                                        self.path("template.yml"),
+                                        resource_filename])
+        return result, str(l)
+
+    def test_if_changed(self):
+        self.assertEqual(self.assemble("--if-changed")[0], 0)
+        self.assertEqual(self.read("output.yml"), expected)
+
+        # An identical result leaves the file untouched.
+        utime(self.path("output.yml"), (1000, 1000))
+        result, log = self.assemble("--if-changed")
+        self.assertEqual(result, 0)
+        self.assertIn("Output to %s is unchanged" % self.path("output.yml"),
+                      log)
+        self.assertEqual(stat(self.path("output.yml")).st_mtime, 1000)
+
+        # Without --if-changed, it is rewritten.
+        self.assertEqual(self.assemble()[0], 0)
+        self.assertNotEqual(stat(self.path("output.yml")).st_mtime, 1000)
+
+        # A different result replaces it, keeping its permissions.
+        utime(self.path("output.yml"), (1000, 1000))
+        chmod(self.path("output.yml"), 0o640)
+        self.write("resource.yml", "!Assembly Tags: [t3]\n")
+        self.assertEqual(self.assemble("--if-changed")[0], 0)
+        self.assertEqual(self.read("output.yml"), "a:\n- t0\n- t3\n")
+        self.assertNotEqual(stat(self.path("output.yml")).st_mtime, 1000)
+        self.assertEqual(S_IMODE(stat(self.path("output.yml")).st_mode),
+                         0o640)
+
+        # No temporary files are left behind.
+        self.assertEqual(sorted(listdir(self.tempdir)),
+                         ["output.yml", "resource.yml", "template.yml"])
+
+    def test_errors_keep_output(self):
+        self.assertEqual(self.assemble("--if-changed")[0], 0)
+
+        bad = self.write("bad.yml", "!Assembly Tags: {b: 1}\n")
+        result, log = self.assemble("--if-changed", resource=bad)
+        self.assertEqual(result, 1)
+        self.assertIn("Cannot merge", log)
+        self.assertEqual(self.read("output.yml"), expected)
+        self.assertEqual(sorted(listdir(self.tempdir)),
+                         ["bad.yml", "output.yml", "resource.yml",
+                          "template.yml"])
+
+        for args, message in (
+                (["--if-changed"], "--if-changed requires --output"),
+                (["--digest-file", self.path("d")],
+                 "--digest-file requires --output")):
+            with LogCapture() as l:
+                result = main(args + [self.path("template.yml")])
+            self.assertEqual(result, 2)
+            self.assertIn(message, str(l))
+
+        with LogCapture() as l:
+            result = main(["--if-changed", "-o", self.path("x/output.yml"),
+                           self.path("template.yml")])
+        self.assertEqual(result, 1)
+        self.assertIn("Unable to open %s for writing" %
+                      self.path("x/output.yml"), str(l))
+
+    def test_digest(self):
+        digest = sha256(expected.encode("utf-8")).hexdigest()
+        self.assertEqual(self.assemble(
+            "--digest-file", self.path("output.sha256"))[0], 0)
+        self.assertEqual(self.read("output.sha256"), digest + "\n")
+        self.assertEqual(file_digest(self.path("output.yml")), digest)
+
+        # The digest is written whether or not the output changed.
+        self.write("output.sha256", "")
+        self.assertEqual(self.assemble(
+            "--if-changed", "--digest-file", self.path("output.sha256"))[0],
+            0)
+        self.assertEqual(self.read("output.sha256"), digest + "\n")
+
+        self.assertIsNone(file_digest(self.path("missing")))
+        self.assertIsNone(file_digest(self.tempdir))
+
+    def test_symlink(self):
+        self.write("real.yml", "old\n")
+        symlink(self.path("real.yml"), self.path("link.yml"))
+
+        output = ReplaceOutput(self.path("link.yml"))
+        output.write(expected)
+        self.assertTrue(output.commit())
+        self.assertEqual(self.read("real.yml"), expected)
+        self.assertEqual(self.read("link.yml"), expected)
+
+        output = ReplaceOutput(self.path("link.yml"))
+        output.write(expected)
+        self.assertEqual(output.hexdigest(),
+                         file_digest(self.path("real.yml")))
+        self.assertFalse(output.commit())
+
+        output = ReplaceOutput(self.path("link.yml"))
+        output.write("discarded\n")
+        output.discard()
+        self.assertEqual(self.read("link.yml"), expected)
+        self.assertEqual(sorted(listdir(self.tempdir)),
+                         ["link.yml", "real.yml", "resource.yml",
+                          "template.yml"])
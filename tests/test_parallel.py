@@ -0,0 +1,172 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main, run
+import assemyaml.parallel
+from assemyaml.memo import TranscludeMemo
+from assemyaml.spill import SpillStore
+from assemyaml.stats import Stats
+from assemyaml.trace import Trace
+from os import _exit, listdir
+from os.path import dirname
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+
+testdir = dirname(__file__) + "/cli/"
+
+documents = [
+    "a: {!Transclude Policy: {Version: '2012-10-17'}}\n",
+    "--- !!str plain\n",
+    "---\nb: |+\n  kept\n\n",
+    "--- {c: [{!Transclude Tags: [t0]}, &x {y: 1}, *x]}\n",
+    "---\n!Assembly Local: [l1]\n",
+    "---\n- !Transclude Local: [l0]\n- !Transclude Policy: null\n",
+    "--- !!null\n",
+    "---\nd: >\n  folded\n  text\ne: 'quoted'\n",
+]
+
+resource = """\
+!Assembly Policy:
+  Statement: [{Effect: Allow, Action: '*'}]
+---
+!Assembly Tags: [t1, t2]
+"""
+
+process_document = assemyaml.parallel._process_document
+
+
+def fail_with_memory_error(encoded_doc, first, *args):
+    # Stands in for _process_document in the workers.
+    if not first:
+        raise MemoryError()
+    return process_document(encoded_doc, first, *args)
+
+
+def exit_worker(encoded_doc, first, *args):
+    if not first:
+        _exit(1)
+    return process_document(encoded_doc, first, *args)
+
+
+class TestParallel(TestCase):
+    def run_template(self, template, jobs=None, stats=None, trace=None,
+                     **kw):
+        output = StringIO()
+        with LogCapture():
+            result = run(StringIO(template), [StringIO(resource)], output,
+                         True, stats=stats, trace=trace, jobs=jobs, **kw)
+        self.assertEqual(result, 0)
+        return output.getvalue()
+
+    def check(self, template, **kw):
+        expected = self.run_template(template, **kw)
+        for jobs in (2, 3):
+            self.assertEqual(self.run_template(template, jobs, **kw),
+                             expected)
+        return expected
+
+    def test_same_output(self):
+        for count in range(1, len(documents) + 1):
+            self.check("".join(documents[:count]))
+
+        # Open-ended documents in the middle of the stream.
+        self.check(documents[2] + documents[0])
+        self.check("".join(documents) * 5)
+        self.check("".join(documents), anchor_duplicates=2)
+        self.check("".join(documents), memo=TranscludeMemo(4))
+        self.check("".join(documents), max_alias_expansion=None)
+        self.assertEqual(self.check(""), "")
+
+    def test_fixtures(self):
+        for filename in sorted(listdir(testdir)):
+            if filename.endswith("-template.yml"):
+                with open(testdir + filename) as fd:
+                    self.check(fd.read())
+
+    def test_spill_store(self):
+        template = "".join(documents)
+        expected = self.run_template(template)
+        with SpillStore(1) as store:
+            self.assertEqual(
+                self.run_template(template, 2, assemblies=store), expected)
+
+    def test_stats_and_trace(self):
+        template = "".join(documents) * 3
+
+        stats = Stats()
+        trace = Trace()
+        self.run_template(template, stats=stats, trace=trace)
+
+        parallel_stats = Stats()
+        parallel_trace = Trace()
+        self.run_template(template, 4, stats=parallel_stats,
+                          trace=parallel_trace)
+
+        self.assertEqual(parallel_trace.events, trace.events)
+        for counter in ("documents", "nodes", "assemblies", "transclusions",
+                        "merges"):
+            self.assertEqual(getattr(parallel_stats, counter),
+                             getattr(stats, counter))
+
+    def test_errors(self):
+        template = (documents[0] + "--- [{!Transclude Tags: {a: b}}]\n" +
+                    documents[3])
+
+        def errors(jobs):
+            with LogCapture() as l:
+                result = run(StringIO(template), [StringIO(resource)],
+                             StringIO(), True, jobs=jobs)
+            self.assertEqual(result, 1)
+            return [record for record in l.actual()
+                    if record[1] == "ERROR"]
+
+        expected = errors(None)
+        self.assertIn("Cannot merge !!seq value", expected[1][2])
+        self.assertEqual(errors(2), expected)
+
+    def test_worker_failures(self):
+        # Failures that aren't errors in a document don't stop the output
+        # from being produced.
+        template = "".join(documents)
+        expected_trace = Trace()
+        expected = self.run_template(template, trace=expected_trace)
+
+        for replacement in (fail_with_memory_error, exit_worker):
+            assemyaml.parallel._process_document = replacement
+            try:
+                trace = Trace()
+                self.assertEqual(self.run_template(template, 2, trace=trace),
+                                 expected)
+            finally:
+                assemyaml.parallel._process_document = process_document
+
+            self.assertEqual(
+                [(event["action"], event["name"], event["line"])
+                 for event in trace.events],
+                [(event["action"], event["name"], event["line"])
+                 for event in expected_trace.events])
+
+    def test_cli(self):
+        tempdir = mkdtemp()
+        try:
+            with open(tempdir + "/template.yml", "w") as fd:
+                fd.write("".join(documents))
+            with open(tempdir + "/resource.yml", "w") as fd:
+                fd.write(resource)
+
+            with LogCapture():
+                result = main(["-j", "2", "-o", tempdir + "/output.yml",
+                               tempdir + "/template.yml",
+                               tempdir + "/resource.yml"])
+            self.assertEqual(result, 0)
+            with open(tempdir + "/output.yml") as fd:
+                self.assertEqual(fd.read(),
+                                 self.run_template("".join(documents)))
+        finally:
+            rmtree(tempdir)
+
+        with LogCapture() as l:
+            result = main(["--jobs", "0", "template.yml"])
+        self.assertEqual(result, 2)
+        self.assertIn("Invalid number of jobs '0'", str(l))
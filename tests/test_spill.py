@@ -0,0 +1,157 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main, run
+from assemyaml.assemble import record_assemblies
+from assemyaml.codec import encode_node, estimate_size
+from assemyaml.spill import SpillStore, parse_size
+from assemyaml.error import AssemblyError
+from assemyaml.types import nodes_equal
+from os.path import dirname
+from six.moves import cStringIO as StringIO
+from testfixtures import LogCapture
+from unittest import TestCase
+from yaml import compose
+
+template = """\
+a: {!Transclude Big: [first]}
+b: {!Transclude Small: {x: 1}}
+c: {!Transclude Big: []}
+---
+d: {!Assembly Local: [1]}
+e: {!Transclude Local: [0]}
+f: {!Transclude Big: null}
+"""
+
+resources = [
+    "!Assembly Big: [%s]\n" % ", ".join(["item%d" % i for i in range(100)]),
+    "!Assembly Small: {y: 2}\n",
+    "!Assembly Big: [last]\n",
+]
+
+
+class TestSpill(TestCase):
+    def run_template(self, assemblies=None):
+        output = StringIO()
+        with LogCapture():
+            result = run(StringIO(template),
+                         [StringIO(resource) for resource in resources],
+                         output, True, assemblies=assemblies)
+        self.assertEqual(result, 0)
+        return output.getvalue()
+
+    def test_same_output(self):
+        expected = self.run_template()
+
+        for ceiling in (1, 5000, 1 << 30):
+            with SpillStore(ceiling) as store:
+                self.assertEqual(self.run_template(store), expected)
+
+                if ceiling == 1:
+                    self.assertEqual(store.used, 0)
+                    self.assertEqual(len(store.spilled), 2)
+                    self.assertGreater(store.loads, 0)
+                elif ceiling == 5000:
+                    # Only the large assembly is spilled.
+                    self.assertEqual(sorted(store.spilled), ["Big"])
+                    self.assertIn("Small", store.memory)
+                else:
+                    self.assertEqual(store.spills, 0)
+
+    def test_many_contributions(self):
+        try:
+            import tracemalloc
+        except ImportError:  # pragma: nocover
+            self.skipTest("tracemalloc requires Python 3.4 or later")
+
+        docs = "".join([
+            "--- {!Assembly Big: [%s]}\n--- {!Assembly Map: {k%d: v}}\n" % (
+                ", ".join(["item%d_%d" % (i, j) for j in range(20)]), i)
+            for i in range(200)])
+        expected = {}
+        record_assemblies(StringIO(docs), expected)
+
+        with SpillStore(4096) as store:
+            tracemalloc.start()
+            try:
+                record_assemblies(StringIO(docs), store)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+            # Each contribution is written once, rather than the whole value
+            # being rewritten for each one.
+            self.assertEqual(sorted(store.spilled), ["Big", "Map"])
+            self.assertEqual(store.spills, 2)
+            self.assertGreater(store.appends, 2 * 190)
+            self.assertLess(
+                store.file_size,
+                2 * sum([len(encode_node(value))
+                         for value in expected.values()]))
+
+            # The spilled values aren't decoded to merge into them.
+            self.assertEqual(store.loads, 0)
+            self.assertLess(peak, estimate_size(expected["Big"]) // 2)
+
+            for name in ("Big", "Map"):
+                self.assertTrue(nodes_equal(store[name], expected[name]))
+
+            # Errors are still found as each contribution is merged.
+            for doc, message in (
+                    ("{!Assembly Big: {a: b}}", "Cannot merge !!map value"),
+                    ("{!Assembly Map: {k5: w}}",
+                     "Cannot merge duplicate mapping key 'k5'")):
+                with self.assertRaises(AssemblyError) as cm:
+                    record_assemblies(StringIO(doc), store)
+                self.assertIn(message, str(cm.exception))
+
+            # A nested assembly is replaced by its merged value.
+            expected = {}
+            doc = "{!Assembly Outer: [{!Assembly Big: [x]}, {y: null}]}"
+            record_assemblies(StringIO(docs + "--- " + doc), expected)
+            record_assemblies(StringIO(doc), store)
+            self.assertTrue(nodes_equal(store["Outer"], expected["Outer"]))
+            self.assertTrue(nodes_equal(store["Big"], expected["Big"]))
+
+            # Replaced values leave space that is reclaimed.
+            store["Big"] = compose("[x]")
+            store["Map"] = compose("{y: z}")
+            store["Outer"] = compose("[]")
+            self.assertEqual(store.compactions, 2)
+            self.assertEqual(store.file_size, 0)
+
+    def test_store(self):
+        store = SpillStore(1)
+        node = compose("[a, {b: c}]")
+        store["x"] = node
+        self.assertIn("x", store)
+        self.assertEqual(len(store), 1)
+        self.assertTrue(nodes_equal(store["x"], node))
+        self.assertIsNone(store.get("y"))
+
+        overlay = store.copy()
+        overlay["y"] = node
+        self.assertIs(overlay["y"], node)
+        self.assertTrue(nodes_equal(overlay.get("x"), node))
+        self.assertNotIn("y", store)
+
+        store.discard("x")
+        self.assertNotIn("x", store)
+        store.close()
+
+        self.assertIn("spill_spills                    1\n", store.format())
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("100"), 100)
+        self.assertEqual(parse_size("4k"), 4096)
+        self.assertEqual(parse_size("512M"), 512 << 20)
+        self.assertEqual(parse_size("2GiB"), 2 << 30)
+        for value in ("", "0", "-1", "1.5M", "10T"):
+            with self.assertRaises(ValueError):
+                parse_size(value)
+
+    def test_cli(self):
+        testdir = dirname(__file__) + "/cli/"
+        with LogCapture() as l:
+            result = main(["--spill-ceiling", "lots",
+                           testdir + "basic-template.yml"])
+        self.assertEqual(result, 2)
+        self.assertIn("Invalid spill ceiling 'lots'", str(l))
@@ -0,0 +1,153 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main, run
+from assemyaml.loader import SafeLoader
+from assemyaml.types import YAML_NULL_TAG
+from os.path import dirname
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+from yaml import compose_all
+from yaml.nodes import MappingNode, ScalarNode
+
+basic_template = """\
+# Shared settings.
+Settings:
+  Name: "example"   # quoted on purpose
+  Tags:
+    !Transclude Tags:
+      - Owner: ops
+Other: [1, 2, {!Transclude Tags: []}]
+List:
+  - !Transclude Tags:
+      - x
+"""
+
+basic_resource = """\
+!Assembly Tags:
+  - Team: core
+"""
+
+
+def canonical(node):
+    """
+    Returns the value of a node as nested tuples, ignoring styles and marks.
+    """
+    if isinstance(node, ScalarNode):
+        if node.tag == YAML_NULL_TAG:
+            return (node.tag, None)
+        return (node.tag, node.value)
+
+    if isinstance(node, MappingNode):
+        return (node.tag, tuple([(canonical(key), canonical(value))
+                                 for key, value in node.value]))
+
+    return (node.tag, tuple([canonical(child) for child in node.value]))
+
+
+class TestSplice(TestCase):
+    def setUp(self):
+        self.testdir = dirname(__file__) + "/cli/"
+        self.tempdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tempdir)
+
+    def run_splice(self, template, resources=()):
+        """
+        Run with and without splicing, check that the results are the same
+        and return the spliced output.
+        """
+        outputs = []
+        for splice in (False, True):
+            output = StringIO()
+            result = run(StringIO(template),
+                         [StringIO(resource) for resource in resources],
+                         output, True, splice=splice)
+            self.assertEqual(result, 0)
+            outputs.append(output.getvalue())
+
+        expected, actual = [
+            [canonical(doc) for doc in compose_all(output, Loader=SafeLoader)]
+            for output in outputs]
+        self.assertEqual(actual, expected)
+        return outputs[1]
+
+    def test_fixtures(self):
+        for template, resources in (
+                ("basic-template.yml", ["basic-resource-1.yml"]),
+                ("cloudformation-template.yml", []),
+                ("globaltag-template.yml", ["globaltag-resource-1.yml"]),
+                ("multidoc-template.yml", []),
+                ("noset-template.yml", ["noset-resource-1.yml"]),
+                ("pairs-template.yml", ["pairs-resource-1.yml"])):
+            docs = []
+            for filename in [template] + resources:
+                with open(self.testdir + filename) as fd:
+                    docs.append(fd.read())
+
+            self.run_splice(docs[0], docs[1:])
+
+    def test_unchanged_text_is_copied(self):
+        output = self.run_splice(basic_template, [basic_resource])
+        self.assertEqual(output, """\
+# Shared settings.
+Settings:
+  Name: "example"   # quoted on purpose
+  Tags:
+    - Owner: ops
+    - Team: core
+Other: [1, 2, [{Team: core}]]
+List:
+  - - x
+    - Team: core
+""")
+
+    def test_unchanged_document(self):
+        template = "# Nothing to do.\na:   [b,  c]  # spacing\n"
+        self.assertEqual(self.run_splice(template), template)
+
+    def test_multiple_documents(self):
+        template = (
+            "%TAG !a! tag:assemyaml.nz,2017:\n---\n"
+            "x: !!str 1\ny:\n  !a!Transclude Tags: []\n...\n"
+            "--- # second\n- !Transclude Tags: [a]\n")
+        output = self.run_splice(template, [basic_resource])
+        self.assertTrue(output.startswith(
+            "%TAG !a! tag:assemyaml.nz,2017:\n---\nx: !!str 1\ny:\n"))
+        self.assertIn("--- # second\n", output)
+
+    def test_block_scalar(self):
+        template = (
+            "a: |\n  line 1\n  line 2\n\nb:\n  !Transclude Tags:\n"
+            "c: >\n  folded\n")
+        output = self.run_splice(template, [basic_resource])
+        self.assertTrue(output.startswith("a: |\n  line 1\n  line 2\n\nb:"))
+        self.assertTrue(output.endswith("c: >\n  folded\n"))
+
+    def test_template_assembly(self):
+        template = (
+            "a:\n  !Assembly Local:\n    b: 1\n    c: 2\n"
+            "d:\n  - !Transclude Local:\n")
+        self.assertEqual(self.run_splice(template), (
+            "a:\n  b: 1\n  c: 2\nd:\n  - b: 1\n    c: 2\n"))
+
+    def test_aliases(self):
+        # Documents with aliases are serialized in full.
+        template = "a: &x [1]\nb: *x\nc: {!Transclude Tags: []}\n"
+        self.assertNotIn("&x", self.run_splice(template, [basic_resource]))
+
+    def test_cli(self):
+        output_filename = self.tempdir + "/output.yml"
+        with LogCapture():
+            result = main([
+                "--splice", "--output", output_filename,
+                self.testdir + "cloudformation-template.yml"])
+
+        self.assertEqual(result, 0)
+        with open(output_filename) as fd:
+            output = fd.read()
+
+        self.assertTrue(output.startswith("# -*- mode: yaml -*-\n"))
+        self.assertIn("# Cost-savings; eventually", output)
@@ -0,0 +1,44 @@
+from __future__ import absolute_import, print_function
+from assemyaml import run
+from assemyaml.stats import Stats
+from json import loads as json_loads
+from six.moves import cStringIO as StringIO
+from unittest import TestCase
+
+
+class TestStats(TestCase):
+    def test_run_stats(self):
+        template = "[{!Transclude Hello: {A: 1}}, {!Transclude World: [X]}]"
+        resource = ("[{!Assembly Hello: {B: 2, C: 3}}, "
+                    "{!Assembly World: [Y]}, {!Assembly World: [Z]}]")
+        stats = Stats()
+        result = run(StringIO(template), [StringIO(resource)], StringIO(),
+                     True, stats=stats)
+        self.assertEqual(result, 0)
+
+        self.assertEqual(list(stats.phases),
+                         ["parse", "assemble", "transclude", "serialize"])
+        self.assertEqual(stats.bytes_read, len(template) + len(resource))
+        self.assertEqual(stats.documents, 2)
+        self.assertEqual(stats.assemblies, 3)
+        self.assertEqual(stats.transclusions, 2)
+        # World + World, then Hello and World into the template.
+        self.assertEqual(stats.merges, 3)
+        self.assertEqual(stats.duplicate_key_checks, 2)
+        self.assertGreater(stats.nodes, 0)
+        self.assertGreater(stats.peak_memory, 0)
+
+    def test_formatting(self):
+        stats = Stats()
+        with stats.phase("parse"):
+            stats.nodes += 10
+
+        result = json_loads(stats.to_json())
+        self.assertEqual(list(result["phases"]), ["parse"])
+        self.assertEqual(result["nodes"], 10)
+        self.assertEqual(result["peak_memory"], None)
+        self.assertNotIn("\n", stats.to_json())
+
+        text = stats.format()
+        self.assertIn("parse", text)
+        self.assertIn("nodes", text)
@@ -0,0 +1,190 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main, run
+from assemyaml.input import open_input, TextInput
+from assemyaml.memo import TranscludeMemo
+from assemyaml.stats import Stats
+from assemyaml.stream import scan_documents
+from assemyaml.trace import Trace
+from os import listdir
+from os.path import dirname
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+
+testdir = dirname(__file__) + "/cli/"
+
+documents = [
+    "a: {!Transclude Policy: {Version: '2012-10-17'}}\n",
+    "--- !!str plain\n",
+    "---\nb: |+\n  kept\n\n",
+    "--- {c: [{!Transclude Tags: [t0]}, &x {y: 1}, *x]}\n",
+    "---\n- !Transclude Local: [l0]\n- !Assembly Local: [l1]\n",
+    "--- !!null\n",
+    "---\nd: >\n  folded\n  text\ne: 'quoted'\n",
+    "x: !!str 1\ny: '2'\nz: !custom {a: [1, 'b', !!binary aGk=]}\nw: ~\n",
+    "---\n!Transclude Tags: [z]\n",
+    "--- {? {!Transclude Tags: []} : v, k: {!Transclude Missing: {d: 1}}}\n",
+    "--- [{!Transclude Policy: {Nested: {!Transclude Tags: [n]}}}]\n",
+    "--- {}\n--- []\n---\n",
+    "---\n- {!Transclude Shared: null}\n- {!Transclude Shared: null}\n",
+]
+
+resource = """\
+!Assembly Policy:
+  Statement: [{Effect: Allow, Action: '*'}]
+---
+!Assembly Tags: [t1, t2]
+---
+!Assembly Shared: {a: &s [1, 2], b: *s}
+"""
+
+
+class TestStream(TestCase):
+    def run_template(self, template, streaming=False, local_tags=True,
+                     **kw):
+        output = StringIO()
+        if not hasattr(template, "read"):
+            template = StringIO(template)
+        with LogCapture():
+            result = run(template, [StringIO(resource)], output, local_tags,
+                         streaming=streaming, **kw)
+        self.assertEqual(result, 0)
+        return output.getvalue()
+
+    def check(self, template, **kw):
+        expected = self.run_template(template, **kw)
+        self.assertEqual(self.run_template(template, True, **kw), expected)
+        return expected
+
+    def test_same_output(self):
+        for document in documents:
+            self.check(document)
+
+        # Open-ended documents in the middle of the stream.
+        self.check(documents[2] + documents[0])
+        self.assertIn("&id002", self.check("".join(documents)))
+        self.check("".join(documents), local_tags=False)
+        self.check("".join(documents), memo=TranscludeMemo(4))
+        self.assertEqual(self.check(""), "")
+
+    def test_fixtures(self):
+        for filename in sorted(listdir(testdir)):
+            if not filename.endswith("-template.yml"):
+                continue
+
+            prefix = filename[:-len("-template.yml")]
+            resource_filenames = sorted([
+                testdir + name for name in listdir(testdir)
+                if name.startswith(prefix + "-resource")])
+            local_tags = prefix != "globaltag"
+
+            outputs = []
+            for streaming in (False, True):
+                output = StringIO()
+                with LogCapture():
+                    result = run(
+                        open_input(testdir + filename),
+                        [open_input(name) for name in resource_filenames],
+                        output, local_tags, streaming=streaming)
+                outputs.append((result, output.getvalue()))
+
+            self.assertEqual(outputs[1], outputs[0])
+
+    def test_composed_documents(self):
+        # Only documents with anchors, aliases or assemblies are composed.
+        self.assertEqual(
+            list(zip(range(len(documents)),
+                     scan_documents("".join(documents)))),
+            [(i, i in (3, 4, 14)) for i in range(len(documents))])
+        self.assertEqual(
+            list(zip(range(2), scan_documents("- !Assembly A: 1\n",
+                                              local_tags=False))),
+            [(0, False), (1, True)])
+
+        with LogCapture() as l:
+            run(StringIO("".join(documents[:5])), [StringIO(resource)],
+                StringIO(), True, streaming=True)
+        self.assertIn("Streamed 3 template documents; composed 2 in full",
+                      str(l))
+
+    def test_mapped_input(self):
+        tempdir = mkdtemp()
+        try:
+            filename = tempdir + "/template.yml"
+            with open(filename, "w") as fd:
+                fd.write(("---\n" + "".join(documents)) * 3)
+
+            expected_stats = Stats()
+            expected_trace = Trace()
+            expected = self.run_template(
+                open_input(filename), stats=expected_stats,
+                trace=expected_trace)
+
+            stats = Stats()
+            trace = Trace()
+            self.assertEqual(
+                self.run_template(open_input(filename), True, stats=stats,
+                                  trace=trace),
+                expected)
+
+            self.assertEqual(trace.events, expected_trace.events)
+            for counter in ("bytes_read", "documents", "transclusions",
+                            "merges"):
+                self.assertEqual(getattr(stats, counter),
+                                 getattr(expected_stats, counter))
+            self.assertIn("stream", stats.phases)
+        finally:
+            rmtree(tempdir)
+
+    def test_errors(self):
+        for template, message in (
+                ("a: {b: 1, !Transclude Tags: []}\n",
+                 "Transclude must be a single-entry mapping"),
+                ("a: {!Transclude Tags: [], b: 1}\n",
+                 "Transclude must be a single-entry mapping"),
+                ("a: {!Transclude [Tags]: []}\n",
+                 "Transclude name must be a scalar"),
+                ("a: {!Transclude Tags: {b: 1}}\n",
+                 "Cannot merge !!seq value"),
+                ("a: [\n", "expected the node content")):
+            errors = []
+            for streaming in (False, True):
+                with LogCapture() as l:
+                    result = run(TextInput(template, "template.yml"),
+                                 [StringIO(resource)], StringIO(), True,
+                                 streaming=streaming)
+                self.assertEqual(result, 1)
+                errors.append([record for record in l.actual()
+                               if record[1] == "ERROR"])
+
+            self.assertIn(message, errors[0][1][2])
+            self.assertEqual(errors[1], errors[0])
+
+        # Documents before the error have been written.
+        output = StringIO()
+        with LogCapture():
+            result = run(StringIO("a: 1\n--- {!Transclude Tags: {b: 1}}\n"),
+                         [StringIO(resource)], output, True, streaming=True)
+        self.assertEqual(result, 1)
+        self.assertEqual(output.getvalue(), "a: 1\n")
+
+    def test_cli(self):
+        tempdir = mkdtemp()
+        try:
+            with open(tempdir + "/template.yml", "w") as fd:
+                fd.write("".join(documents))
+            with open(tempdir + "/resource.yml", "w") as fd:
+                fd.write(resource)
+
+            with LogCapture():
+                result = main(["--stream", "-o", tempdir + "/output.yml",
+                               tempdir + "/template.yml",
+                               tempdir + "/resource.yml"])
+            self.assertEqual(result, 0)
+            with open(tempdir + "/output.yml") as fd:
+                self.assertEqual(fd.read(),
+                                 self.run_template("".join(documents)))
+        finally:
+            rmtree(tempdir)
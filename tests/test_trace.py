@@ -0,0 +1,54 @@
+from __future__ import absolute_import, print_function
+from assemyaml import run
+from assemyaml.trace import Trace
+from json import loads as json_loads
+from six.moves import cStringIO as StringIO
+from testfixtures import LogCapture
+from unittest import TestCase
+
+
+class TestTrace(TestCase):
+    def test_trace(self):
+        template = StringIO(
+            "- !Transclude A: [1]\n"
+            "- !Transclude B:\n"
+            "- !Transclude C: [2]\n")
+        resource = StringIO(
+            "- !Assembly A: [3]\n"
+            "- !Assembly A: [4]\n"
+            "- !Assembly B: [5]\n")
+        trace = Trace()
+        result = run(template, [resource], StringIO(), True, trace=trace)
+        self.assertEqual(result, 0)
+
+        events = [(e["event"], e["name"], e["line"], e["action"])
+                  for e in trace.events]
+        self.assertEqual(events, [
+            ("assembly", "A", 1, "record"),
+            ("assembly", "A", 2, "merge"),
+            ("assembly", "B", 3, "record"),
+            ("transclude", "A", 1, "merge"),
+            ("transclude", "B", 2, "replace"),
+            ("transclude", "C", 3, "default"),
+        ])
+
+        out = StringIO()
+        trace.write(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(json_loads(lines[0])["column"], 3)
+
+    def test_debug_logging(self):
+        template = StringIO("!Transclude Hello: [X]")
+        resource = StringIO("!Assembly Hello: [Y]")
+
+        with LogCapture("assemyaml.trace") as l:
+            result = run(template, [resource], StringIO(), True)
+
+        self.assertEqual(result, 0)
+        l.check(
+            ("assemyaml.trace", "DEBUG",
+             "assembly Hello at <file>:1:1: record"),
+            ("assemyaml.trace", "DEBUG",
+             "transclude Hello at <file>:1:1: merge"),
+        )
@@ -0,0 +1,241 @@
+from __future__ import absolute_import, print_function
+from assemyaml import main, run
+from assemyaml.bundle import compile_bundle
+from assemyaml.input import open_input
+from assemyaml.loader import SafeLoader, get_loader
+from assemyaml.memo import TranscludeMemo
+from assemyaml.spill import SpillStore
+from assemyaml.types import copy_node, nodes_equal, YAML_SEQ_TAG, YAML_STR_TAG
+from assemyaml.walk import rebuild
+from shutil import rmtree
+from six.moves import cStringIO as StringIO
+import sys
+from tempfile import mkdtemp
+from testfixtures import LogCapture
+from unittest import TestCase
+from yaml import compose, compose_all, safe_load, YAMLError
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+# Deeper than the default recursion limit.
+DEPTH = sys.getrecursionlimit() * 3
+
+# PyYAML's scanner is quadratic in the nesting depth of flow collections, so
+# documents run through the parser and emitter are kept shallower. This is
+# still too deep for PyYAML's (recursive) composer and serializer.
+RUN_DEPTH = sys.getrecursionlimit()
+
+
+def doubling(levels):
+    """
+    A document of levels anchored sequences, each holding two aliases to the
+    previous one; expanded, it has about 2 ** levels nodes.
+    """
+    lines = ["- &a0 [x]\n"]
+    for i in range(1, levels):
+        lines.append("- &a%d [*a%d, *a%d]\n" % (i, i - 1, i - 1))
+    return "".join(lines)
+
+
+def deep_sequence(depth, leaf="x"):
+    node = ScalarNode(YAML_STR_TAG, leaf)
+    for i in range(depth):
+        node = SequenceNode(YAML_SEQ_TAG, [node])
+
+    return node
+
+
+class TestWalk(TestCase):
+    def test_rebuild_order(self):
+        node = compose("{a: [b, c], d: e}")
+        seen = []
+
+        def pre(node):
+            if isinstance(node, ScalarNode):
+                seen.append(("pre", node.value))
+            return node
+
+        def post(node):
+            if isinstance(node, ScalarNode):
+                seen.append(("post", node.value))
+                return ScalarNode(node.tag, node.value.upper())
+            return node
+
+        result = rebuild(node, pre=pre, post=post)
+        self.assertIs(result, node)
+        self.assertEqual(
+            [v for _, v in seen], ["a", "a", "b", "b", "c", "c", "d", "d",
+                                   "e", "e"])
+        self.assertTrue(nodes_equal(result, compose("{A: [B, C], D: E}")))
+
+    def test_deep_copy_and_compare(self):
+        a = deep_sequence(DEPTH)
+        b = copy_node(a)
+        self.assertIsNot(a, b)
+        self.assertTrue(nodes_equal(a, b))
+        self.assertFalse(nodes_equal(a, deep_sequence(DEPTH, "y")))
+
+    def test_recursive_copy(self):
+        node = compose("&a [*a]")
+        self.assertIs(node.value[0], node)
+
+        copy = copy_node(node)
+        self.assertIsNot(copy, node)
+        self.assertIs(copy.value[0], copy)
+        self.assertTrue(nodes_equal(node, copy))
+
+    def test_deep_run(self):
+        template = ("[" * RUN_DEPTH + "{!Transclude Hello: [a]}" +
+                    "]" * RUN_DEPTH)
+        resource = ("[" * RUN_DEPTH + "{!Assembly Hello: [b]}" +
+                    "]" * RUN_DEPTH)
+        output = StringIO()
+
+        result = run(StringIO(template), [StringIO(resource)], output, True)
+        self.assertEqual(result, 0)
+
+        expected = "[" * (RUN_DEPTH + 1) + "a, b" + "]" * (RUN_DEPTH + 1)
+        self.assertTrue(nodes_equal(
+            compose(output.getvalue(), Loader=SafeLoader),
+            compose(expected, Loader=SafeLoader)))
+
+    def test_recursive_transclude(self):
+        template = StringIO("!Transclude Hello: [a]")
+        resource = StringIO("!Assembly Hello: [{!Transclude Hello: [b]}]")
+
+        with LogCapture() as l:
+            result = run(template, [resource], StringIO(), True)
+
+        self.assertEqual(result, 1)
+        self.assertIn("Transclude Hello includes itself", str(l))
+
+    def test_mapping_keys(self):
+        node = MappingNode(u"tag:yaml.org,2002:map", [
+            (deep_sequence(DEPTH), ScalarNode(YAML_STR_TAG, "v"))])
+        self.assertTrue(nodes_equal(node, copy_node(node)))
+
+    def test_shared_nodes_walked_once(self):
+        node = compose(doubling(40), Loader=get_loader(None))
+        visits = []
+
+        def post(node):
+            visits.append(node)
+            return node
+
+        self.assertIs(rebuild(node, post=post), node)
+        self.assertEqual(len(visits), 1 + 40 + 1)
+
+        # Sharing is kept when nodes are replaced.
+        def upper(node):
+            if isinstance(node, ScalarNode):
+                return ScalarNode(node.tag, node.value.upper())
+            return node
+
+        result = rebuild(compose("[&a [x], *a]"), post=upper)
+        self.assertIs(result.value[0], result.value[1])
+        self.assertEqual(result.value[0].value[0].value, "X")
+
+    def test_shared_copy(self):
+        node = compose("[&a [x, &b y], *a, *b, &c [*c]]")
+        copy = copy_node(node)
+        self.assertIs(copy.value[0], copy.value[1])
+        self.assertIs(copy.value[0].value[1], copy.value[2])
+        self.assertIsNot(copy.value[0], node.value[0])
+        self.assertIs(copy.value[3].value[0], copy.value[3])
+
+    def test_shared_run(self):
+        # Shared assemblies are recorded once; shared transclusions are
+        # expanded once and stay shared in the output.
+        template = ("a: &t {!Transclude A: [0]}\nb: *t\n"
+                    "c:\n  %s" % doubling(30).replace("\n", "\n  ")[:-2])
+        resource = "a: &x {!Assembly A: [1]}\nb: *x\n"
+        output = StringIO()
+
+        # (Not under LogCapture: debug logging prints the expanded nodes.)
+        result = run(StringIO(template), [StringIO(resource)], output, True,
+                     max_alias_expansion=None)
+        self.assertEqual(result, 0)
+        self.assertTrue(output.getvalue().startswith(
+            "a: &id001\n- 0\n- 1\nb: *id001\n"))
+
+    def test_nested_assembly_run(self):
+        # Merging reuses the nodes of assembly values; a nested assembly is
+        # replaced by a copy, so the output has no aliases that weren't in
+        # the source, however it is produced.
+        template = "o: {!Transclude Outer: }\ni: {!Transclude Inner: }\n"
+        resources = [
+            "---\n!Assembly Inner: [i0]\n"
+            "---\n!Assembly Outer:\n- a\n- !Assembly Inner: [i1]\n"
+            "- !Assembly Inner: [i2]\n",
+            "!Assembly Inner: [i3]\n",
+        ]
+        expected = ("o:\n- a\n- - i0\n  - i1\n- - i0\n  - i1\n  - i2\n"
+                    "i:\n- i0\n- i1\n- i2\n- i3\n")
+
+        def assemble(resource_fds=None, **kw):
+            if resource_fds is None:
+                resource_fds = [StringIO(text) for text in resources]
+            output = StringIO()
+            with LogCapture():
+                result = run(StringIO(template), resource_fds, output, True,
+                             **kw)
+            self.assertEqual(result, 0)
+            return output.getvalue()
+
+        tempdir = mkdtemp()
+        try:
+            bundles = []
+            for i, text in enumerate(resources):
+                bundles.append(tempdir + "/r%d.ayb" % i)
+                with open(bundles[-1], "wb") as fd:
+                    fd.write(compile_bundle(StringIO(text)))
+
+            with SpillStore(1) as spilled, SpillStore(1 << 20) as held:
+                for kw in ({}, {"streaming": True}, {"jobs": 2},
+                           {"memo": TranscludeMemo()},
+                           {"assemblies": spilled}, {"assemblies": held}):
+                    self.assertEqual(assemble(**kw), expected)
+
+            fds = [open_input(filename) for filename in bundles]
+            try:
+                self.assertEqual(assemble(fds), expected)
+            finally:
+                for fd in fds:
+                    fd.close()
+        finally:
+            rmtree(tempdir)
+
+        # Splicing keeps the template's flow style.
+        output = assemble(splice=True)
+        self.assertNotIn("&", output)
+        self.assertNotIn("*", output)
+        self.assertEqual(safe_load(output), safe_load(expected))
+
+    def test_alias_expansion_limit(self):
+        text = doubling(25)
+        docs = list(compose_all(text + "--- [y]\n---\n" + text,
+                                Loader=get_loader(None)))
+        self.assertEqual(len(docs), 3)
+
+        # Each document is counted separately.
+        # Aliases to the sequence of 3 * 2 ** i - 1 nodes at level i add
+        # 6 * (2 ** 24 - 1) - 48 nodes in all.
+        limit = 6 * (2 ** 24 - 1) - 48
+        self.assertEqual(len(list(compose_all(
+            text + "---\n" + text, Loader=get_loader(limit)))), 2)
+
+        with self.assertRaises(YAMLError) as e:
+            compose(text, Loader=get_loader(limit - 1))
+        self.assertEqual(e.exception.problem,
+                         "Aliases expand the document by more than %d "
+                         "nodes" % (limit - 1))
+
+        with LogCapture() as l:
+            result = run(StringIO(text), [], StringIO(), True)
+        self.assertEqual(result, 1)
+        self.assertIn("Aliases expand the document by more than 1000000 "
+                      "nodes", str(l))
+
+        with LogCapture() as l:
+            result = main(["--max-alias-expansion", "x", "template.yml"])
+        self.assertEqual(result, 2)
+        self.assertIn("Invalid alias expansion limit 'x'", str(l))